@@ -0,0 +1,90 @@
+"""
+Compare two result files written by run.py, e.g., from two different commits.
+
+Prints the relative change of every measurement, and exits with a non-zero code if any of them got worse by more than
+the threshold.
+
+Usage::
+
+    python benchmarks/compare.py old.json new.json --threshold 10
+"""
+
+import argparse
+import json
+import sys
+from typing import Dict, Iterator, Tuple
+
+# measurements where a higher value is better, for all others a lower value is better
+higher_is_better = {"throughput_per_second"}
+
+# measurements which are just reported for context
+ignored = {"iterations", "names", "urls", "file_bytes"}
+
+
+def flatten(data: dict, prefix: str = "") -> Iterator[Tuple[str, float]]:
+    for key, value in data.items():
+        name = "{}.{}".format(prefix, key) if prefix else key
+
+        if isinstance(value, dict):
+            yield from flatten(value, name)
+
+        elif isinstance(value, (int, float)) and key not in ignored:
+            yield name, value
+
+
+def index_results(results: dict) -> Dict[str, float]:
+    indexed = {}
+
+    for benchmark in results["benchmarks"]:
+        indexed.update(flatten(benchmark, str(benchmark["names"])))
+
+    return indexed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("old", help="results of the baseline")
+    parser.add_argument("new", help="results to compare to the baseline")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="relative change in percent above which a change counts as regression")
+    args = parser.parse_args()
+
+    with open(args.old) as f:
+        old = json.load(f)
+
+    with open(args.new) as f:
+        new = json.load(f)
+
+    print("comparing {} to {}".format(old["revision"][:10], new["revision"][:10]))
+
+    old_results = index_results(old)
+    new_results = index_results(new)
+
+    regressions = 0
+
+    for name, old_value in old_results.items():
+        if name not in new_results or old_value == 0:
+            continue
+
+        new_value = new_results[name]
+        change = (new_value - old_value) / old_value * 100
+
+        if name.rsplit(".", 1)[-1] in higher_is_better:
+            is_regression = change < -args.threshold
+        else:
+            is_regression = change > args.threshold
+
+        if is_regression:
+            regressions += 1
+
+        print("{:<70} {:>14.2f} {:>14.2f} {:>+9.1f}%{}".format(
+            name, old_value, new_value, change, "  REGRESSION" if is_regression else ""
+        ))
+
+    if regressions:
+        print("{} regression(s) found".format(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""
+Benchmark suite for the redirector.
+
+Generates synthetic maps of different sizes, and measures the time and memory needed to load them, the time needed to
+import the package and create the app (as every worker process does on startup), as well as the latency and throughput
+of the most important endpoints, both through Flask's test client and by calling the WSGI app
+directly, including the time needed to render the index page and the API responses from scratch. The results are
+written as JSON, so that they can be compared between commits with compare.py.
+
+Usage::
+
+    python benchmarks/run.py --sizes 1000,10000 --output results.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from typing import Callable, Dict, List
+
+# make sure the benchmarks use the redirector from this repository
+repo_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, repo_dir)
+
+
+def generate_map(names_count: int, seed: int = 0) -> Dict[str, List[str]]:
+    """
+    Generate a synthetic map. Like in real maps, most URLs have one or two names, and a few URLs have many.
+
+    :param names_count: number of names in the map
+    :param seed: seed for the random number generator, the same seed always results in the same map
+    :return: map
+    """
+
+    rng = random.Random(seed)
+
+    urls_to_names = {}
+    name_index = 0
+    url_index = 0
+
+    while name_index < names_count:
+        # geometric distribution with a mean of about 1.7 names per URL
+        names_per_url = 1
+
+        while rng.random() < 0.4 and names_per_url < 50:
+            names_per_url += 1
+
+        names_per_url = min(names_per_url, names_count - name_index)
+
+        url = "https://example.org/{}/{}".format(rng.choice(["docs", "download", "blog", "project"]), url_index)
+        urls_to_names[url] = ["name-{}".format(name_index + i) for i in range(names_per_url)]
+
+        name_index += names_per_url
+        url_index += 1
+
+    return urls_to_names
+
+
+def max_rss_kib() -> int:
+    # on Linux, ru_maxrss is in KiB, on macOS in bytes
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    if sys.platform == "darwin":
+        return max_rss // 1024
+
+    return max_rss
+
+
+def measure_load(path: str) -> dict:
+    """
+    Load a map in a fresh interpreter, to measure time and memory in isolation.
+    """
+
+    child_code = (
+        "import json, sys, time\n"
+        "sys.path.insert(0, {repo_dir!r})\n"
+        "from benchmarks.run import max_rss_kib\n"
+        "from redirector.non_database import NonDatabase\n"
+        "rss_before = max_rss_kib()\n"
+        "start = time.perf_counter()\n"
+        "non_db = NonDatabase({path!r})\n"
+        "duration = time.perf_counter() - start\n"
+        "print(json.dumps({{'load_seconds': duration, 'peak_rss_kib': max_rss_kib(), "
+        "'peak_rss_delta_kib': max_rss_kib() - rss_before}}))\n"
+    ).format(repo_dir=repo_dir, path=path)
+
+    output = subprocess.check_output([sys.executable, "-c", child_code])
+    return json.loads(output.decode())
+
+
+def measure_startup(path: str, snapshot_dir: str) -> dict:
+    """
+    Import the package and create the app in fresh interpreters, like a worker process does on startup. The app is
+    created without a snapshot, with an empty snapshot directory, and with the snapshot written by the previous run.
+    """
+
+    child_code = (
+        "import json, sys, time, warnings\n"
+        "sys.path.insert(0, {repo_dir!r})\n"
+        "start = time.perf_counter()\n"
+        "import redirector\n"
+        "import_seconds = time.perf_counter() - start\n"
+        "warnings.simplefilter('ignore')\n"
+        "start = time.perf_counter()\n"
+        "config = {{'REDIRECTIONS_MAP_PATH': {path!r}, 'REDIRECTIONS_MAP_SNAPSHOT_DIR': {snapshot_dir!r}}}\n"
+        "redirector.create_app(config)\n"
+        "print(json.dumps({{'import_seconds': import_seconds, 'create_app_seconds': time.perf_counter() - start}}))\n"
+    )
+
+    def run(snapshot_dir):
+        code = child_code.format(repo_dir=repo_dir, path=path, snapshot_dir=snapshot_dir)
+        return json.loads(subprocess.check_output([sys.executable, "-c", code]).decode())
+
+    results = run(None)
+    results["create_app_snapshot_cold_seconds"] = run(snapshot_dir)["create_app_seconds"]
+    results["create_app_snapshot_warm_seconds"] = run(snapshot_dir)["create_app_seconds"]
+
+    return results
+
+
+def measure_latency(fn: Callable, iterations: int) -> dict:
+    """
+    Call a function repeatedly and collect latency statistics.
+    """
+
+    # warm up caches
+    for _ in range(min(10, iterations)):
+        fn()
+
+    durations = []
+
+    start = time.perf_counter()
+
+    for _ in range(iterations):
+        call_start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - call_start)
+
+    total = time.perf_counter() - start
+
+    durations.sort()
+
+    def percentile(p):
+        return durations[min(len(durations) - 1, int(len(durations) * p))]
+
+    return {
+        "iterations": iterations,
+        "mean_us": total / iterations * 1e6,
+        "p50_us": percentile(0.5) * 1e6,
+        "p99_us": percentile(0.99) * 1e6,
+        "throughput_per_second": iterations / total,
+    }
+
+
+def make_wsgi_caller(app, path: str) -> Callable:
+    from werkzeug.test import EnvironBuilder
+
+    environ = EnvironBuilder(path=path).get_environ()
+
+    def start_response(status, headers, exc_info=None):
+        pass
+
+    def call():
+        body = app(dict(environ), start_response)
+
+        for _ in body:
+            pass
+
+        if hasattr(body, "close"):
+            body.close()
+
+    return call
+
+
+def benchmark_size(names_count: int, iterations: int, render_iterations: int, workdir: str) -> dict:
+    import redirector
+
+    urls_to_names = generate_map(names_count)
+
+    path = os.path.join(workdir, "redirects-{}.json".format(names_count))
+
+    with open(path, "w") as f:
+        json.dump(urls_to_names, f, indent=4)
+
+    results = {
+        "names": names_count,
+        "urls": len(urls_to_names),
+        "file_bytes": os.path.getsize(path),
+        "load": measure_load(path),
+        "startup": measure_startup(path, os.path.join(workdir, "snapshots-{}".format(names_count))),
+    }
+
+    all_names = [name for names in urls_to_names.values() for name in names]
+    rng = random.Random(1)
+    existing_name = rng.choice(all_names)
+
+    for fast_path in (False, True):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+
+            app = redirector.create_app({
+                "REDIRECTIONS_MAP_PATH": path,
+                "STATIC_REDIRECTIONS_FAST_PATH": fast_path,
+            })
+
+        client = app.test_client()
+
+        suffix = "_fast_path" if fast_path else ""
+
+        results["shortener_hit_test_client" + suffix] = measure_latency(
+            lambda: client.get("/" + existing_name), iterations
+        )
+        results["shortener_hit_wsgi" + suffix] = measure_latency(
+            make_wsgi_caller(app, "/" + existing_name), iterations
+        )
+        results["shortener_miss_wsgi" + suffix] = measure_latency(
+            make_wsgi_caller(app, "/does-not-exist"), iterations
+        )
+
+    # the endpoints cache their responses, so after the warm-up, these only measure cache hits
+    results["index_wsgi"] = measure_latency(make_wsgi_caller(app, "/"), render_iterations)
+    results["api_urls_wsgi"] = measure_latency(make_wsgi_caller(app, "/api/urls.json"), render_iterations)
+
+    # the cold path, i.e., the work done on the first request after every reload of the map
+    from redirector.responses import SerializedMap
+    from redirector.views import render_index_page
+
+    non_db = redirector.non_db_ext.non_db
+
+    with app.test_request_context("/"):
+        results["index_render_cold"] = measure_latency(lambda: render_index_page(non_db, "", 1), render_iterations)
+        results["api_urls_serialize_cold"] = measure_latency(lambda: SerializedMap(non_db), render_iterations)
+
+    return results
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=repo_dir).decode().strip()
+
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000",
+                        help="comma-separated list of map sizes (number of names)")
+    parser.add_argument("--iterations", type=int, default=2000, help="number of requests per latency benchmark")
+    parser.add_argument("--render-iterations", type=int, default=5,
+                        help="number of requests per index/API benchmark")
+    parser.add_argument("--output", help="file to write the results to, default: stdout")
+    args = parser.parse_args()
+
+    results = {
+        "revision": git_revision(),
+        "date": datetime.datetime.utcnow().isoformat() + "Z",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "benchmarks": [],
+    }
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes.split(","):
+            print("benchmarking map with {} names".format(size), file=sys.stderr)
+
+            results["benchmarks"].append(
+                benchmark_size(int(size), args.iterations, args.render_iterations, workdir)
+            )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+
+    else:
+        json.dump(results, sys.stdout, indent=4)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,16 @@
+import gc
 import importlib
+import logging
 import os
-import sys
 
 from flask import Flask
 from flask_caching import Cache
 
 from .non_database import FlaskNonDatabase
+from .util import parse_flag
+
+
+logger = logging.getLogger(__name__)
 
 # global non-database instance
 # note for self: import everything that uses the non-database _after_ this line
@@ -33,20 +38,45 @@ def create_app(config: dict = None) -> Flask:
     app = Flask("redirector")
 
     app.config.setdefault("STATIC_REDIRECTIONS_MAX_AGE", "120")
+    app.config.setdefault("STATIC_REDIRECTIONS_FAST_PATH", False)
+
+    app.config.setdefault("INDEX_PAGE_SIZE", "100")
+    app.config.setdefault("INDEX_CACHE_TIMEOUT", "3600")
+
+    app.config.setdefault("API_BATCH_MAX_SIZE", "100000")
+
+    app.config.setdefault("SUGGESTIONS_LIMIT", "5")
+    app.config.setdefault("SUGGESTIONS_BUDGET", "50000")
 
     app.config.setdefault("CACHE_TYPE", "simple")
 
+    # maximum time other processes wait for a process computing a dynamic redirection before trying themselves
+    app.config.setdefault("DYNAMIC_REDIRECTS_LOCK_TIMEOUT", "30")
+
+    # exclude everything created by the factory (most notably the map) from garbage collection
+    app.config.setdefault("GC_FREEZE", False)
+
     # optional: load config.py from current working directory
     try:
         app.config.from_pyfile("config.py")
     except FileNotFoundError:
-        print("config.py not found, skipping", file=sys.stderr)
+        logger.debug("config.py not found, skipping")
 
     if config is not None:
         app.config.update(config)
 
     # environment variables support
-    for env_var in ["REDIRECTIONS_MAP_PATH", "STATIC_REDIRECTIONS_MAX_AGE", "DYNAMIC_REDIRECTS_MODULES"]:
+    for env_var in ["REDIRECTIONS_MAP_PATH", "REDIRECTIONS_MAP_RELOAD", "REDIRECTIONS_MAP_RELOAD_INTERVAL",
+                    "REDIRECTIONS_MAP_COMPACT", "REDIRECTIONS_MAP_BACKEND", "REDIRECTIONS_MAP_CACHE_SIZE",
+                    "REDIRECTIONS_MAP_LOAD_PROCESSES", "REDIRECTIONS_MAP_SNAPSHOT_DIR", "REDIRECTIONS_CHANGE_LOG_SIZE",
+                    "STATIC_REDIRECTIONS_MAX_AGE", "STATIC_REDIRECTIONS_FAST_PATH", "DYNAMIC_REDIRECTS_MODULES",
+                    "DYNAMIC_REDIRECTS_REFRESH", "DYNAMIC_REDIRECTS_REFRESH_MARGIN", "DYNAMIC_REDIRECTS_LOCK_TIMEOUT",
+                    "DYNAMIC_REDIRECTS_L1_SIZE", "DYNAMIC_REDIRECTS_L1_TIMEOUT", "DYNAMIC_REDIRECTS_CALLBACK_TIMEOUT",
+                    "DYNAMIC_REDIRECTS_MAX_WORKERS", "DYNAMIC_REDIRECTS_BREAKER_THRESHOLD",
+                    "DYNAMIC_REDIRECTS_BREAKER_RESET_TIMEOUT", "DYNAMIC_REDIRECTS_FALLBACK_URL", "INDEX_PAGE_SIZE",
+                    "INDEX_CACHE_TIMEOUT", "API_BATCH_MAX_SIZE", "SUGGESTIONS_LIMIT", "SUGGESTIONS_BUDGET",
+                    "METRICS_DIR", "METRICS_FLUSH_INTERVAL", "METRICS_PER_NAME_HITS",
+                    "ANALYTICS_DB", "ANALYTICS_FLUSH_INTERVAL", "ANALYTICS_MAX_BUFFERED_NAMES", "GC_FREEZE"]:
         if env_var in os.environ:
             app.config[env_var] = os.environ[env_var]
 
@@ -61,12 +91,44 @@ def create_app(config: dict = None) -> Flask:
     non_db_ext.init_app(app)
     cache.init_app(app)
 
+    from .tiered_cache import tiered_cache
+    tiered_cache.init_app(app)
+
+    from .refresh import refresh_scheduler
+    refresh_scheduler.init_app(app)
+
+    from .callback_guard import callback_guard
+    callback_guard.init_app(app)
+
+    from .metrics import metrics
+    metrics.init_app(app)
+
+    from .analytics import analytics
+    analytics.init_app(app)
+
     # importing here to avoid annoying cyclic imports
     from .views import bp  # noqa: E402
     from .dynamic import dynamic_redirects_bp
+    from .cli import cli
 
     # register routes
     app.register_blueprint(bp)
     app.register_blueprint(dynamic_redirects_bp)
 
+    # register maintenance commands, available as "flask redirector ..."
+    app.cli.add_command(cli)
+
+    # optionally, static redirections can be served by a WSGI middleware, bypassing Flask entirely
+    # this must be done after all routes have been registered
+    if parse_flag(app.config["STATIC_REDIRECTIONS_FAST_PATH"]):
+        from .fast_path import StaticRedirectsFastPath
+        app.wsgi_app = StaticRedirectsFastPath(app, app.wsgi_app)
+
+    # when the app is preloaded in the master process (e.g., gunicorn --preload), the workers share its memory until
+    # they write to it, and the garbage collector writes to every object it inspects
+    # the map is never part of a reference cycle, so there is no need to inspect it anyway
+    if parse_flag(app.config["GC_FREEZE"]) and hasattr(gc, "freeze"):
+        gc.collect()
+        gc.freeze()
+
     return app
@@ -0,0 +1,266 @@
+import atexit
+import datetime
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Set, Tuple, Union
+
+from flask import Flask
+
+from .async_support import BackgroundThread
+
+
+logger = logging.getLogger(__name__)
+
+
+# (day, kind, name), where kind is either "static" or "dynamic"
+HitKey = Tuple[str, str, str]
+
+
+_schema = """
+CREATE TABLE IF NOT EXISTS hits (
+    day TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (day, kind, name)
+)
+"""
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """
+    Open the analytics database, creating the schema if necessary.
+
+    :param path: path to the SQLite file
+    :return: connection
+    """
+
+    # all worker processes write to the same file, so we have to wait for the others rather than fail right away
+    connection = sqlite3.connect(path, timeout=30)
+
+    # readers (e.g., the CLI) do not block the writers in WAL mode
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute(_schema)
+
+    return connection
+
+
+# maximum number of names returned by top_names(), larger limits are capped
+MAX_TOP_LIMIT = 1000
+
+
+def _since_day(days: Union[int, None]) -> str:
+    if days is None:
+        return ""
+
+    return (datetime.date.today() - datetime.timedelta(days=days - 1)).isoformat()
+
+
+def top_names(path: str, limit: int = 20, days: Union[int, None] = None, kind: Union[str, None] = None) -> List[dict]:
+    """
+    Query the most used names.
+
+    :param path: path to the SQLite file
+    :param limit: maximum number of names, at least 1, capped at :data:`MAX_TOP_LIMIT`
+    :param days: only count the hits of the last ``days`` days (including today)
+    :param kind: only count hits of this kind (``static`` or ``dynamic``)
+    :return: names with their kind, number of hits, and the last day they have been used on
+    """
+
+    # SQLite treats negative limits as no limit at all
+    if limit < 1:
+        raise ValueError("limit must be at least 1")
+
+    query = "SELECT kind, name, SUM(count) AS hits, MAX(day) FROM hits WHERE day >= ?"
+    parameters = [_since_day(days)]
+
+    if kind is not None:
+        query += " AND kind = ?"
+        parameters.append(kind)
+
+    query += " GROUP BY kind, name ORDER BY hits DESC, name LIMIT ?"
+    parameters.append(min(limit, MAX_TOP_LIMIT))
+
+    connection = connect(path)
+
+    try:
+        rows = connection.execute(query, parameters).fetchall()
+
+    finally:
+        connection.close()
+
+    return [{"kind": kind, "name": name, "hits": hits, "last_used": last_used} for kind, name, hits, last_used in rows]
+
+
+def used_names(path: str, days: Union[int, None] = None) -> Set[str]:
+    """
+    :param path: path to the SQLite file
+    :param days: only consider the last ``days`` days (including today)
+    :return: static names which have been used
+    """
+
+    connection = connect(path)
+
+    try:
+        rows = connection.execute(
+            "SELECT DISTINCT name FROM hits WHERE kind = 'static' AND day >= ?", [_since_day(days)]
+        ).fetchall()
+
+    finally:
+        connection.close()
+
+    return {name for name, in rows}
+
+
+class HitAnalytics:
+    """
+    Counts the hits of static and dynamic redirections. Hits are aggregated in memory, and written to a SQLite database
+    in batches by a background thread, so handling a request never has to wait for the disk.
+
+    The number of distinct names buffered in memory is bounded. If the limit is reached, the background thread is
+    woken up to write the buffer early. If the buffer grows to twice the limit before that has happened (e.g., because
+    the database is locked), hits of names which are not in the buffer yet are dropped.
+
+    Buffered hits are written on exit, so no hits are lost on graceful shutdowns.
+    """
+
+    def __init__(self):
+        self.path: Union[str, None] = None
+        self.flush_interval = 10.0
+        self.max_buffered_names = 10000
+
+        self._buffer: Dict[HitKey, int] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+        # number of hits which could not be recorded because the buffer was full
+        self.dropped = 0
+
+        # looking up the current date for every hit is comparably slow, so it is only done once per day
+        self._day = ""
+        self._day_ends_at = 0.0
+
+        self._thread = BackgroundThread(self._run, "redirector-analytics-flush")
+
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+        atexit.register(self._flush_at_exit)
+
+    def init_app(self, app: Flask):
+        app.config.setdefault("ANALYTICS_DB", None)
+        app.config.setdefault("ANALYTICS_FLUSH_INTERVAL", "10")
+        app.config.setdefault("ANALYTICS_MAX_BUFFERED_NAMES", "10000")
+
+        self.path = app.config["ANALYTICS_DB"]
+        self.flush_interval = float(app.config["ANALYTICS_FLUSH_INTERVAL"])
+        self.max_buffered_names = int(app.config["ANALYTICS_MAX_BUFFERED_NAMES"])
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def _after_fork(self):
+        # hits recorded before forking have been recorded by the parent process
+        self._buffer = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    def record(self, kind: str, name: str):
+        """
+        Record a hit.
+
+        :param kind: ``static`` or ``dynamic``
+        :param name: short name, or path of the dynamic redirection
+        """
+
+        if self.path is None:
+            return
+
+        if time.time() >= self._day_ends_at:
+            today = datetime.date.today()
+            tomorrow = datetime.datetime.combine(today + datetime.timedelta(days=1), datetime.time())
+
+            self._day, self._day_ends_at = today.isoformat(), tomorrow.timestamp()
+
+        key = (self._day, kind, name)
+
+        with self._lock:
+            buffered_names = len(self._buffer)
+
+            if buffered_names >= 2 * self.max_buffered_names and key not in self._buffer:
+                self.dropped += 1
+                return
+
+            self._buffer[key] = self._buffer.get(key, 0) + 1
+
+        if buffered_names >= self.max_buffered_names:
+            self._wakeup.set()
+
+        self._thread.ensure_started()
+
+    def flush(self):
+        """
+        Write all buffered hits to the database. If that fails, the hits are put back into the buffer.
+        """
+
+        with self._lock:
+            buffer, self._buffer = self._buffer, {}
+
+        # analytics might have been disabled since the hits have been recorded
+        if not buffer or self.path is None:
+            return
+
+        try:
+            connection = connect(self.path)
+
+            try:
+                # a single transaction for all hits
+                with connection:
+                    connection.executemany(
+                        "INSERT OR IGNORE INTO hits (day, kind, name, count) VALUES (?, ?, ?, 0)", buffer.keys()
+                    )
+                    connection.executemany(
+                        "UPDATE hits SET count = count + ? WHERE day = ? AND kind = ? AND name = ?",
+                        ((count, day, kind, name) for (day, kind, name), count in buffer.items())
+                    )
+
+            finally:
+                connection.close()
+
+        except Exception:
+            # merge the hits back, so they are written with the next batch
+            with self._lock:
+                for key, count in buffer.items():
+                    self._buffer[key] = self._buffer.get(key, 0) + count
+
+            raise
+
+    def _flush_at_exit(self):
+        if self.path is None or not self._thread.running:
+            return
+
+        try:
+            self.flush()
+
+        except Exception:
+            logger.exception("failed to write hit analytics on exit")
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+
+            try:
+                self.flush()
+
+            except Exception:
+                # the thread must keep running, the hits are written with the next batch
+                logger.exception("failed to write hit analytics")
+
+
+# global instance, like the other extensions
+analytics = HitAnalytics()
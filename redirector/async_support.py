@@ -0,0 +1,129 @@
+import asyncio
+import concurrent.futures
+import os
+import threading
+from typing import Awaitable, Callable, Union
+
+
+class BackgroundThread:
+    """
+    A daemon thread running a function in the background, e.g., to write buffered data regularly.
+
+    The thread is started lazily, and started again in processes which have been forked after it was started (threads
+    do not survive a fork), so it is safe to use with preloading application servers.
+    """
+
+    def __init__(self, target: Callable, name: str):
+        """
+        :param target: function run by the thread, it should never return
+        :param name: name of the thread
+        """
+
+        self.target = target
+        self.name = name
+
+        self._lock = threading.Lock()
+        self._pid: Union[int, None] = None
+
+        # the lock might be held by another thread while forking, which would never release it in the child
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        """
+        :return: whether the thread has been started in the current process
+        """
+
+        return self._pid == os.getpid()
+
+    def ensure_started(self):
+        """
+        Start the thread, unless it is running in the current process already.
+        """
+
+        pid = os.getpid()
+
+        if self._pid == pid:
+            return
+
+        with self._lock:
+            if self._pid == pid:
+                return
+
+            thread = threading.Thread(target=self.target, name=self.name, daemon=True)
+            thread.start()
+
+            self._pid = pid
+
+
+class EventLoopThread:
+    """
+    Runs an asyncio event loop in a background thread. Coroutines can be submitted from any thread, e.g., the threads of
+    a threaded WSGI server, so that many of them can be in flight at once in a single process.
+
+    The thread is started lazily, and restarted if the process has been forked (threads do not survive a fork), so it is
+    safe to use with preloading application servers.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop: Union[asyncio.AbstractEventLoop, None] = None
+        self._pid: Union[int, None] = None
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        pid = os.getpid()
+
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    loop = asyncio.new_event_loop()
+
+                    thread = threading.Thread(target=loop.run_forever, name="redirector-event-loop", daemon=True)
+                    thread.start()
+
+                    self._loop = loop
+                    self._pid = pid
+
+        return self._loop
+
+    def submit(self, coro: Awaitable) -> concurrent.futures.Future:
+        """
+        Schedule a coroutine on the event loop without waiting for it.
+
+        The coroutine runs in a copy of the calling thread's context, like with :meth:`run`.
+
+        :param coro: coroutine to run
+        :return: future of the coroutine's result, cancelling it cancels the coroutine
+        """
+
+        return asyncio.run_coroutine_threadsafe(coro, self._get_loop())
+
+    def run(self, coro: Awaitable, timeout: Union[float, None] = None):
+        """
+        Run a coroutine on the event loop, and wait for the result.
+
+        The coroutine runs in a copy of the calling thread's context, so context variables (e.g., Flask's request
+        context in recent Flask versions) are available.
+
+        :param coro: coroutine to run
+        :param timeout: maximum time in seconds to wait for the result
+        :return: result of the coroutine
+        :raises concurrent.futures.TimeoutError: if the result is not available in time
+        """
+
+        future = self.submit(coro)
+
+        try:
+            return future.result(timeout)
+
+        except BaseException:
+            future.cancel()
+            raise
+
+
+# global event loop shared by all async callbacks
+event_loop = EventLoopThread()
@@ -0,0 +1,33 @@
+import os
+import uuid
+from typing import Union
+
+from . import cache
+
+
+def acquire_lock(key: str, timeout: int) -> Union[str, None]:
+    """
+    Take a lock shared by all processes using the same cache backend. ``add`` is atomic in shared backends (e.g.,
+    Redis), so only one process gets the lock.
+
+    :param key: cache key of the lock
+    :param timeout: seconds after which the lock expires, in case its holder never releases it
+    :return: token needed to release the lock, or None if another process holds it
+    """
+
+    # identifies the holder of the lock, so we never release a lock held by another process
+    token = "{}-{}".format(os.getpid(), uuid.uuid4().hex)
+
+    if not cache.add(key, token, timeout=timeout):
+        return None
+
+    return token
+
+
+def release_lock(key: str, token: str):
+    """
+    Release a lock taken with :func:`acquire_lock`, unless it has expired and been taken by another process meanwhile.
+    """
+
+    if cache.get(key) == token:
+        cache.delete(key)
@@ -0,0 +1,338 @@
+import functools
+import inspect
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, Union
+
+from flask import Flask, copy_current_request_context, has_request_context
+from werkzeug.exceptions import HTTPException
+
+from .async_support import event_loop
+from .metrics import metrics
+
+
+class CallbackUnavailable(Exception):
+    """
+    Raised instead of calling a callback if it cannot be called right now (its circuit is open, or all workers are
+    busy), or if it has not returned in time.
+    """
+
+    def __init__(self, route: str, reason: str, message: str):
+        """
+        :param route: route of the dynamic redirection
+        :param reason: ``timeout``, ``circuit_open`` or ``overloaded``
+        :param message: description of the problem
+        """
+
+        super().__init__(message)
+
+        self.route = route
+        self.reason = reason
+
+
+class CircuitBreaker:
+    """
+    Keeps track of the failures of a single callback.
+
+    After ``threshold`` consecutive failures, the circuit is opened, and calls are rejected right away for
+    ``reset_timeout`` seconds. Afterwards, a single trial call is let through (the circuit is half-open). If it
+    succeeds, the circuit is closed again, otherwise it is opened for another ``reset_timeout`` seconds.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, threshold: int, reset_timeout: float):
+        """
+        :param threshold: number of consecutive failures after which the circuit is opened, 0 disables the breaker
+        :param reset_timeout: seconds after which a trial call is let through an open circuit
+        """
+
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+
+        self.failures = 0
+        self.opened_at: Union[float, None] = None
+
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def state(self, now: Union[float, None] = None) -> str:
+        """
+        :param now: current time as returned by :func:`time.monotonic`
+        :return: current state of the circuit
+        """
+
+        if self.opened_at is None:
+            return self.CLOSED
+
+        if now is None:
+            now = time.monotonic()
+
+        if now - self.opened_at < self.reset_timeout:
+            return self.OPEN
+
+        return self.HALF_OPEN
+
+    def allow(self, now: Union[float, None] = None) -> bool:
+        """
+        :param now: current time as returned by :func:`time.monotonic`
+        :return: whether the callback may be called
+        """
+
+        if self.threshold <= 0 or self.opened_at is None:
+            return True
+
+        with self._lock:
+            if self.state(now) != self.HALF_OPEN or self._trial_running:
+                return False
+
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def cancel_trial(self):
+        """
+        Record that a call which has been allowed has not been made after all.
+        """
+
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self, now: Union[float, None] = None):
+        if now is None:
+            now = time.monotonic()
+
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+
+            if 0 < self.threshold <= self.failures:
+                self.opened_at = now
+
+
+class CallbackGuard:
+    """
+    Protects the workers from slow or failing upstream services of dynamic redirections.
+
+    Regular callbacks are run on a bounded pool of threads, and the calling thread waits for their result only until
+    the deadline has passed. Coroutine functions are run on the shared event loop, and cancelled once the deadline has
+    passed. If all threads of the pool are busy, e.g., because an upstream service hangs, calls are rejected right away
+    instead of being queued. Every route has its own :class:`CircuitBreaker`, so a failing upstream service is not
+    asked again and again, while other routes keep working.
+
+    In all these cases, :class:`CallbackUnavailable` is raised, so the caller can fall back to the last good value.
+    """
+
+    def __init__(self):
+        # seconds a callback may take, and maximum number of callbacks running at once
+        self.deadline = 10.0
+        self.max_workers = 16
+
+        self.breaker_threshold = 5
+        self.breaker_reset_timeout = 30.0
+
+        # URL redirected to if a callback fails and there is no last good value, unless the route has its own
+        self.fallback_url: Union[str, None] = None
+
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+        self._executor: Union[ThreadPoolExecutor, None] = None
+        self._slots = threading.BoundedSemaphore(self.max_workers)
+
+        # threads do not survive forking, so we need to check whether the pool has been created in the current process
+        self._executor_pid: Union[int, None] = None
+
+        # number of calls which have failed or have been rejected, by reason
+        self.stats = Counter()
+
+        # the locks might be held by other threads while forking
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def init_app(self, app: Flask):
+        app.config.setdefault("DYNAMIC_REDIRECTS_CALLBACK_TIMEOUT", "10")
+        app.config.setdefault("DYNAMIC_REDIRECTS_MAX_WORKERS", "16")
+        app.config.setdefault("DYNAMIC_REDIRECTS_BREAKER_THRESHOLD", "5")
+        app.config.setdefault("DYNAMIC_REDIRECTS_BREAKER_RESET_TIMEOUT", "30")
+        app.config.setdefault("DYNAMIC_REDIRECTS_FALLBACK_URL", None)
+
+        self.deadline = float(app.config["DYNAMIC_REDIRECTS_CALLBACK_TIMEOUT"])
+        self.max_workers = int(app.config["DYNAMIC_REDIRECTS_MAX_WORKERS"])
+        self.breaker_threshold = int(app.config["DYNAMIC_REDIRECTS_BREAKER_THRESHOLD"])
+        self.breaker_reset_timeout = float(app.config["DYNAMIC_REDIRECTS_BREAKER_RESET_TIMEOUT"])
+        self.fallback_url = app.config["DYNAMIC_REDIRECTS_FALLBACK_URL"] or None
+
+        with self._lock:
+            self._breakers.clear()
+
+            # threads of a previous pool which are still running keep their slots of the previous semaphore
+            self._executor = None
+            self._executor_pid = None
+            self._slots = threading.BoundedSemaphore(self.max_workers)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+        for breaker in self._breakers.values():
+            breaker._lock = threading.Lock()
+
+    def breaker(self, route: str) -> CircuitBreaker:
+        """
+        :return: circuit breaker of a route
+        """
+
+        breaker = self._breakers.get(route)
+
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(
+                    route, CircuitBreaker(self.breaker_threshold, self.breaker_reset_timeout)
+                )
+
+        return breaker
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        pid = os.getpid()
+
+        if self._executor_pid != pid:
+            with self._lock:
+                if self._executor_pid != pid:
+                    self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="redirector-callback")
+                    self._slots = threading.BoundedSemaphore(self.max_workers)
+                    self._executor_pid = pid
+
+        return self._executor
+
+    def _reject(self, route: str, reason: str, message: str) -> CallbackUnavailable:
+        self.stats[reason] += 1
+        metrics.inc("redirector_dynamic_callback_failures_total", (("route", route), ("reason", reason)))
+        return CallbackUnavailable(route, reason, message)
+
+    def _submit_to_executor(self, route: str, callback: Callable, kwargs: dict) -> Future:
+        executor = self._get_executor()
+        slots = self._slots
+
+        # a thread which is still busy with a callback which has missed its deadline keeps its slot
+        if not slots.acquire(blocking=False):
+            raise self._reject(route, "overloaded", "all {} callback workers are busy".format(self.max_workers))
+
+        f = functools.partial(callback, **kwargs)
+
+        # the callback might need the request context
+        if has_request_context():
+            f = copy_current_request_context(f)
+
+        try:
+            future = executor.submit(f)
+
+        except BaseException:
+            slots.release()
+            raise
+
+        future.add_done_callback(lambda _: slots.release())
+
+        return future
+
+    def _record_error(self, route: str, breaker: CircuitBreaker):
+        breaker.record_failure()
+        self.stats["error"] += 1
+        metrics.inc("redirector_dynamic_callback_failures_total", (("route", route), ("reason", "error")))
+
+    def call(self, route: str, callback: Callable, kwargs: dict, deadline: Union[float, None] = None):
+        """
+        Call the callback of a dynamic redirection, unless its circuit is open.
+
+        :param route: route of the dynamic redirection
+        :param callback: regular function or coroutine function
+        :param kwargs: arguments of the callback
+        :param deadline: seconds the callback may take, overrides ``DYNAMIC_REDIRECTS_CALLBACK_TIMEOUT``
+        :return: result of the callback
+        :raises CallbackUnavailable: if the callback has not been called or has not returned in time
+        """
+
+        if deadline is None:
+            deadline = self.deadline
+
+        breaker = self.breaker(route)
+
+        if not breaker.allow():
+            raise self._reject(route, "circuit_open", "circuit of {} is open after {} failures".format(
+                route, breaker.failures
+            ))
+
+        future = None
+
+        try:
+            if inspect.iscoroutinefunction(callback):
+                # coroutines do not tie up a thread while waiting, and can be cancelled
+                future = event_loop.submit(callback(**kwargs))
+            else:
+                future = self._submit_to_executor(route, callback, kwargs)
+
+            value = future.result(deadline)
+
+        except CallbackUnavailable:
+            # too many calls are running, that is not the callback's fault
+            breaker.cancel_trial()
+            raise
+
+        except HTTPException:
+            # the callback has deliberately answered with an HTTP error (e.g., abort(404)), the upstream service works
+            breaker.record_success()
+            raise
+
+        except FutureTimeoutError:
+            # since Python 3.11, this is the builtin TimeoutError, which the callback might raise itself (e.g., when a
+            # socket times out), but only if the callback is still running, the deadline has passed
+            if future is None or future.done():
+                self._record_error(route, breaker)
+                raise
+
+            # coroutines are cancelled, threads cannot be interrupted and keep their slot until they return
+            future.cancel()
+
+            breaker.record_failure()
+            raise self._reject(route, "timeout", "callback of {} has not returned within {} seconds".format(
+                route, deadline
+            ))
+
+        except Exception:
+            self._record_error(route, breaker)
+            raise
+
+        breaker.record_success()
+
+        return value
+
+    def get_stats(self) -> dict:
+        """
+        :return: number of failed or rejected calls by reason, and number of routes whose circuit is open
+        """
+
+        now = time.monotonic()
+
+        result = {}
+
+        for reason in ("error", "timeout", "circuit_open", "overloaded"):
+            result["callback_{}".format(reason)] = self.stats[reason]
+
+        result["open_circuits"] = sum(
+            1 for breaker in list(self._breakers.values()) if breaker.state(now) == CircuitBreaker.OPEN
+        )
+
+        return result
+
+
+# global instance, like the other extensions
+callback_guard = CallbackGuard()
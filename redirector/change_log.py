@@ -0,0 +1,101 @@
+from collections import deque
+from collections.abc import Mapping
+from typing import Deque, Dict, Tuple, Union
+
+
+# maps names to their new URL, or None if they have been removed
+Changes = Dict[str, Union[str, None]]
+
+
+def compute_changes(old_names_to_urls: Mapping, new_names_to_urls: Mapping) -> Changes:
+    """
+    Compute the changes between two maps, i.e., names which have been added, removed or retargeted.
+
+    :param old_names_to_urls: names-to-URLs mapping of the old map
+    :param new_names_to_urls: names-to-URLs mapping of the new map
+    :return: changes
+    """
+
+    changes = {}
+
+    for name, url in new_names_to_urls.items():
+        if old_names_to_urls.get(name) != url:
+            changes[name] = url
+
+    for name in old_names_to_urls:
+        if name not in new_names_to_urls:
+            changes[name] = None
+
+    return changes
+
+
+class ChangeLog:
+    """
+    Bounded log of the changes made to a map over a series of reloads. Allows clients which know the map at a certain
+    version to catch up by fetching only the changes made since.
+
+    Instances are never modified once they have been published, a reload creates a new log instead. This way, requests
+    can use the log without any locking.
+    """
+
+    def __init__(self, version: int, max_changes: int = 10000):
+        """
+        :param version: version of the map the log belongs to
+        :param max_changes: maximum number of changes kept, older changes are discarded
+        """
+
+        self.version = version
+        self.max_changes = max_changes
+
+        # oldest version clients can catch up from
+        self.base_version = version
+
+        # versions and the changes which led to them, in order
+        self._entries: Deque[Tuple[int, Changes]] = deque()
+        self._changes_count = 0
+
+    def extend(self, version: int, changes: Changes) -> "ChangeLog":
+        """
+        :param version: version of the new map
+        :param changes: changes from the current version to the new version
+        :return: a new log, containing all entries of this log and the given changes
+        """
+
+        new_log = ChangeLog(version, self.max_changes)
+
+        # if there are more changes than we can keep, clients have to start over anyway
+        if len(changes) > self.max_changes:
+            return new_log
+
+        new_log.base_version = self.base_version
+        new_log._entries = deque(self._entries)
+        new_log._changes_count = self._changes_count
+
+        new_log._entries.append((version, changes))
+        new_log._changes_count += len(changes)
+
+        while new_log._changes_count > self.max_changes:
+            # clients which know the map at the version the dropped entry led to can still be served
+            new_log.base_version, dropped_changes = new_log._entries.popleft()
+            new_log._changes_count -= len(dropped_changes)
+
+        return new_log
+
+    def changes_since(self, version: int) -> Union[Changes, None]:
+        """
+        Merge all changes made after a given version.
+
+        :param version: version the client knows
+        :return: changes, or None if the changes are not known (e.g., because the version is too old)
+        """
+
+        if version < self.base_version or version > self.version:
+            return None
+
+        merged_changes = {}
+
+        for entry_version, changes in self._entries:
+            if entry_version > version:
+                merged_changes.update(changes)
+
+        return merged_changes
@@ -0,0 +1,144 @@
+import os
+import sys
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+try:
+    import resource
+
+except ImportError:
+    resource = None
+
+from . import non_db_ext
+from .analytics import MAX_TOP_LIMIT, analytics, top_names, used_names
+from .compiled_map import compile_map, is_compiled_map
+from .map_check import RouteShadowing, check_map
+from .non_database import NonDatabase
+from .sqlite_map import build_sqlite_map, is_sqlite_map
+
+
+cli = AppGroup("redirector", help="Maintenance commands for the redirector.")
+
+
+@cli.command("compile")
+@click.argument("source", type=click.Path(exists=True))
+@click.argument("destination", type=click.Path(dir_okay=False))
+@click.option("--format", "map_format", type=click.Choice(["binary", "sqlite"]), default="binary", show_default=True,
+              help="Format of the compiled map.")
+def compile_command(source: str, destination: str, map_format: str):
+    """
+    Validate a JSON redirections map (or a directory of shards) and compile it into a binary map which can be
+    memory-mapped by all workers, or into a SQLite map.
+    """
+
+    if map_format == "sqlite" and os.path.isfile(source) and not is_compiled_map(source) and \
+            not is_sqlite_map(source):
+        # JSON files can be converted without holding the entire map in memory
+        NonDatabase.build_sqlite_map(source, destination)
+
+        non_db = NonDatabase(destination)
+
+    else:
+        non_db = NonDatabase(source)
+
+        if map_format == "sqlite":
+            build_sqlite_map(non_db.urls_to_names.items(), destination, non_db.version, non_db.last_modified)
+        else:
+            compile_map(non_db.urls_to_names, destination)
+
+    click.echo("compiled {} names for {} URLs into {}".format(
+        len(non_db.names_to_urls), len(non_db.urls_to_names), destination
+    ))
+
+
+def _peak_memory_mib(who: int) -> float:
+    # on Linux, ru_maxrss is in KiB, on macOS in bytes
+    max_rss = resource.getrusage(who).ru_maxrss
+
+    if sys.platform == "darwin":
+        max_rss //= 1024
+
+    return max_rss / 1024
+
+
+@cli.command("check")
+@click.argument("path", type=click.Path(exists=True), required=False)
+@click.option("--processes", type=int,
+              help="Maximum number of worker processes checking the map. Defaults to the number of CPUs.")
+def check_command(path: str, processes: int):
+    """
+    Check a JSON redirections map (or a directory of shards) and report all problems at once. Defaults to the map the
+    app is configured to use.
+    """
+
+    if path is None:
+        path = non_db_ext.path
+
+        # the default map does not need to exist for the app to start
+        if not os.path.exists(path):
+            raise click.ClickException("the map {} does not exist, please pass the path of a map or set "
+                                       "REDIRECTIONS_MAP_PATH".format(path))
+
+    from .views import is_reserved_name
+
+    shadowing = RouteShadowing(current_app.url_map, is_reserved_name=is_reserved_name)
+
+    report = check_map(path, processes=processes, shadowing=shadowing)
+
+    for problem in report.problems:
+        click.echo(str(problem))
+
+    click.echo("checked {} names for {} URLs in {} file(s): {} problem(s) found".format(
+        report.names_count, report.urls_count, report.files_count, len(report.problems)
+    ))
+
+    click.echo("time: {:.2f}s (parsing: {:.2f}s)".format(report.total_seconds, report.parse_seconds))
+
+    if resource is not None:
+        click.echo("peak memory: {:.1f} MiB".format(_peak_memory_mib(resource.RUSAGE_SELF)))
+
+        if report.processes:
+            click.echo("peak memory of the largest of {} worker processes: {:.1f} MiB".format(
+                report.processes, _peak_memory_mib(resource.RUSAGE_CHILDREN)
+            ))
+
+    if report.problems:
+        sys.exit(1)
+
+
+def _require_analytics():
+    if not analytics.enabled:
+        raise click.ClickException("hit analytics are disabled, please set ANALYTICS_DB")
+
+
+@cli.command("top")
+@click.option("--limit", default=20, show_default=True, type=click.IntRange(1, MAX_TOP_LIMIT),
+              help="Maximum number of names to show.")
+@click.option("--days", type=int, help="Only count the hits of the last DAYS days.")
+@click.option("--kind", type=click.Choice(["static", "dynamic"]), help="Only show names of this kind.")
+def top_command(limit: int, days: int, kind: str):
+    """
+    Show the most used names.
+    """
+
+    _require_analytics()
+
+    for entry in top_names(analytics.path, limit=limit, days=days, kind=kind):
+        click.echo("{hits:>10}  {kind:<8} {name}  (last used: {last_used})".format(**entry))
+
+
+@cli.command("unused")
+@click.option("--days", type=int, help="Only consider the hits of the last DAYS days.")
+def unused_command(days: int):
+    """
+    Show the static names which have not been used, e.g., to prune the map.
+    """
+
+    _require_analytics()
+
+    used = used_names(analytics.path, days=days)
+
+    for name in sorted(set(non_db_ext.non_db.names_to_urls) - used):
+        click.echo(name)
@@ -0,0 +1,109 @@
+from array import array
+from bisect import bisect_left
+from collections.abc import ItemsView, Mapping
+from typing import Iterator, Tuple
+
+
+class CompactMap:
+    """
+    Compact in-memory representation of a map. Instead of two dicts, the data is held in tuples and arrays: every URL
+    is stored once and referenced by its index, the names of a URL are stored in a tuple which can be handed out
+    without copying. Lookups use binary searches on sorted tuples, which is a little slower than a dict lookup, but
+    saves most of the overhead dicts have per entry.
+    """
+
+    def __init__(self, urls_to_names: Mapping):
+        """
+        :param urls_to_names: validated data (see :meth:`NonDatabase.load_data`)
+        """
+
+        # URLs in their original order, the index in this tuple is used as an ID
+        self.urls: Tuple[str, ...] = tuple(urls_to_names)
+
+        # the names of every URL, indexed by URL ID
+        self.names: Tuple[Tuple[str, ...], ...] = tuple(tuple(names) for names in urls_to_names.values())
+
+        self.names_count = sum(len(names) for names in self.names)
+
+        # all names in sorted order, along with the ID of the URL they are assigned to
+        names_and_url_ids = sorted((name, url_id) for url_id, names in enumerate(self.names) for name in names)
+        self._sorted_names = tuple(name for name, _ in names_and_url_ids)
+        self._sorted_names_url_ids = array("I", (url_id for _, url_id in names_and_url_ids))
+        del names_and_url_ids
+
+        # all URL IDs, sorted by URL, for reverse lookups
+        self._sorted_url_ids = array("I", sorted(range(len(self.urls)), key=self.urls.__getitem__))
+
+        self.urls_to_names = _URLsToNamesView(self)
+        self.names_to_urls = _NamesToURLsView(self)
+
+    def find_url_id_for_name(self, name: str) -> int:
+        """
+        :raises KeyError: if the name is not known
+        """
+
+        index = bisect_left(self._sorted_names, name)
+
+        if index == len(self._sorted_names) or self._sorted_names[index] != name:
+            raise KeyError(name)
+
+        return self._sorted_names_url_ids[index]
+
+    def find_url_id(self, url: str) -> int:
+        """
+        :raises KeyError: if the URL is not known
+        """
+
+        # bisect does not support key functions before Python 3.10, so we have to implement the binary search here
+        low, high = 0, len(self._sorted_url_ids)
+
+        while low < high:
+            middle = (low + high) // 2
+
+            if self.urls[self._sorted_url_ids[middle]] < url:
+                low = middle + 1
+            else:
+                high = middle
+
+        if low == len(self._sorted_url_ids) or self.urls[self._sorted_url_ids[low]] != url:
+            raise KeyError(url)
+
+        return self._sorted_url_ids[low]
+
+
+class _URLsToNamesView(Mapping):
+    def __init__(self, compact_map: CompactMap):
+        self._map = compact_map
+
+    def __getitem__(self, url: str) -> Tuple[str, ...]:
+        return self._map.names[self._map.find_url_id(url)]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._map.urls)
+
+    def __len__(self) -> int:
+        return len(self._map.urls)
+
+    def items(self):
+        return _URLsToNamesItemsView(self)
+
+
+class _URLsToNamesItemsView(ItemsView):
+    def __iter__(self):
+        # avoid looking up every URL again
+        return zip(self._mapping._map.urls, self._mapping._map.names)
+
+
+class _NamesToURLsView(Mapping):
+    def __init__(self, compact_map: CompactMap):
+        self._map = compact_map
+
+    def __getitem__(self, name: str) -> str:
+        return self._map.urls[self._map.find_url_id_for_name(name)]
+
+    def __iter__(self) -> Iterator[str]:
+        for names in self._map.names:
+            yield from names
+
+    def __len__(self) -> int:
+        return self._map.names_count
@@ -0,0 +1,334 @@
+import mmap
+import os
+import struct
+import zlib
+from collections.abc import ItemsView, Mapping
+from typing import Dict, List, Iterator, Tuple
+
+from .trie import is_rule
+
+
+# every compiled map starts with this magic, which allows for detecting the format of a map file cheaply
+# the last byte is the version of the format, which must be incremented whenever the format changes
+MAGIC = b"RDRMAP\x00\x02"
+
+# header: magic, number of names, number of URLs, offset of URL records, offset and number of slots of the names hash
+# table, offset and number of slots of the URLs hash table, offset and number of rule records
+_header = struct.Struct("<8sQQQQQQQQQ")
+
+# strings are stored length-prefixed, encoded as UTF-8
+_string_length = struct.Struct("<I")
+
+# URL record: offset of URL string, offset of the list of name string offsets, number of names
+_url_record = struct.Struct("<QQQ")
+
+# names hash table slot: offset of name string (0 marks an empty slot), index of URL record
+_name_slot = struct.Struct("<QQ")
+
+# URLs hash table slot: index of URL record plus one (0 marks an empty slot)
+_url_slot = struct.Struct("<Q")
+
+# offsets of names in a URL's list of names
+_offset = struct.Struct("<Q")
+
+# rule record: offset of name string, index of URL record
+# the rules are stored separately, so the trie resolving them can be built without decoding the entire map
+_rule_record = struct.Struct("<QQ")
+
+
+def _hash(data: bytes) -> int:
+    # Python's hash() is randomized per process, therefore we need a stable hash function
+    # CRC32 is implemented in C and good enough for a hash table
+    return zlib.crc32(data)
+
+
+def _table_size(n: int) -> int:
+    # keep the load factor at 50% at most to keep the probe sequences short
+    size = 1
+
+    while size < 2 * n:
+        size *= 2
+
+    return size
+
+
+def is_compiled_map(filename: str) -> bool:
+    """
+    Check whether a file contains a compiled map.
+
+    :param filename: path of the file to check
+    :return: whether the file contains a compiled map
+    """
+
+    with open(filename, "rb") as f:
+        # maps compiled in other versions of the format are detected as well, so they can be rejected with a
+        # meaningful error message
+        return f.read(len(MAGIC))[:-1] == MAGIC[:-1]
+
+
+def compile_map(urls_to_names: Dict[str, List[str]], filename: str):
+    """
+    Compiles a URLs-to-names mapping into a binary file which can be memory-mapped by :class:`CompiledMap`.
+
+    The map is not validated. Please validate it before, e.g., by loading it into a :class:`NonDatabase`.
+
+    The file is written to a temporary file first, then moved into place atomically. This way, processes reloading the
+    map never see a partially written file.
+
+    :param urls_to_names: data to compile
+    :param filename: path of the resulting file
+    """
+
+    blob = bytearray()
+
+    # offsets are relative to the start of the file, the strings follow the header directly
+    # as the header is not empty, offset 0 can be used to mark empty slots
+    base = _header.size
+
+    def add_string(s: str) -> int:
+        offset = base + len(blob)
+
+        encoded = s.encode()
+        blob.extend(_string_length.pack(len(encoded)))
+        blob.extend(encoded)
+
+        return offset
+
+    url_offsets = []
+    names_list_offsets = []
+
+    # name offset and hash, URL index for every name
+    names = []
+
+    # name offset and URL index for every rule
+    rules = []
+
+    for url_index, (url, url_names) in enumerate(urls_to_names.items()):
+        url_offsets.append(add_string(url))
+
+        name_offsets = []
+
+        for name in url_names:
+            name_offset = add_string(name)
+            name_offsets.append(name_offset)
+            names.append((name_offset, _hash(name.encode()), url_index))
+
+            if is_rule(name):
+                rules.append((name_offset, url_index))
+
+        names_list_offsets.append(base + len(blob))
+
+        for name_offset in name_offsets:
+            blob.extend(_offset.pack(name_offset))
+
+    url_records_offset = base + len(blob)
+
+    for url_offset, names_list_offset, url_names in zip(url_offsets, names_list_offsets, urls_to_names.values()):
+        blob.extend(_url_record.pack(url_offset, names_list_offset, len(url_names)))
+
+    name_slots = _table_size(len(names))
+    name_table = [(0, 0)] * name_slots
+
+    for name_offset, name_hash, url_index in names:
+        slot = name_hash % name_slots
+
+        while name_table[slot][0] != 0:
+            slot = (slot + 1) % name_slots
+
+        name_table[slot] = (name_offset, url_index)
+
+    name_table_offset = base + len(blob)
+
+    for name_offset, url_index in name_table:
+        blob.extend(_name_slot.pack(name_offset, url_index))
+
+    url_slots = _table_size(len(urls_to_names))
+    url_table = [0] * url_slots
+
+    for url_index, url in enumerate(urls_to_names.keys()):
+        slot = _hash(url.encode()) % url_slots
+
+        while url_table[slot] != 0:
+            slot = (slot + 1) % url_slots
+
+        url_table[slot] = url_index + 1
+
+    url_table_offset = base + len(blob)
+
+    for entry in url_table:
+        blob.extend(_url_slot.pack(entry))
+
+    rules_offset = base + len(blob)
+
+    for name_offset, url_index in rules:
+        blob.extend(_rule_record.pack(name_offset, url_index))
+
+    header = _header.pack(
+        MAGIC, len(names), len(urls_to_names), url_records_offset,
+        name_table_offset, name_slots, url_table_offset, url_slots, rules_offset, len(rules)
+    )
+
+    tmp_filename = "{}.tmp{}".format(filename, os.getpid())
+
+    try:
+        with open(tmp_filename, "wb") as f:
+            f.write(header)
+            f.write(blob)
+
+        os.replace(tmp_filename, filename)
+
+    except BaseException:
+        if os.path.exists(tmp_filename):
+            os.unlink(tmp_filename)
+
+        raise
+
+
+class CompiledMap:
+    """
+    Read-only, memory-mapped view on a compiled map file. As the file is mapped read-only, all processes using the same
+    file share the same physical memory pages. Lookups only decode the entries they need.
+    """
+
+    def __init__(self, filename: str):
+        with open(filename, "rb") as f:
+            # the mapping stays valid after closing the file
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+            self.stat = os.fstat(f.fileno())
+
+        magic = self._mm[:len(MAGIC)]
+
+        if magic[:-1] != MAGIC[:-1]:
+            raise ValueError("{} is not a compiled map".format(filename))
+
+        # the header of other versions of the format might be shorter
+        if magic != MAGIC:
+            raise ValueError("{} has been compiled for a different format version, please compile it again".format(
+                filename
+            ))
+
+        (_, self.names_count, self.urls_count, self._url_records_offset, self._name_table_offset, self._name_slots,
+         self._url_table_offset, self._url_slots, self._rules_offset, self.rules_count) = \
+            _header.unpack_from(self._mm, 0)
+
+        self.urls_to_names = _URLsToNamesView(self)
+        self.names_to_urls = _NamesToURLsView(self)
+
+    def _read_string_bytes(self, offset: int) -> bytes:
+        length, = _string_length.unpack_from(self._mm, offset)
+        start = offset + _string_length.size
+        return self._mm[start:start + length]
+
+    def _read_string(self, offset: int) -> str:
+        return self._read_string_bytes(offset).decode()
+
+    def _url_record(self, url_index: int):
+        return _url_record.unpack_from(self._mm, self._url_records_offset + url_index * _url_record.size)
+
+    def url_at(self, url_index: int) -> str:
+        url_offset, _, _ = self._url_record(url_index)
+        return self._read_string(url_offset)
+
+    def names_at(self, url_index: int) -> List[str]:
+        _, names_list_offset, names_count = self._url_record(url_index)
+
+        return [
+            self._read_string(_offset.unpack_from(self._mm, names_list_offset + i * _offset.size)[0])
+            for i in range(names_count)
+        ]
+
+    def rules(self) -> List[Tuple[str, str]]:
+        """
+        :return: names of all rules along with their URLs (see :class:`redirector.trie.NameTrie`)
+        """
+
+        rules = []
+
+        for i in range(self.rules_count):
+            name_offset, url_index = _rule_record.unpack_from(self._mm, self._rules_offset + i * _rule_record.size)
+            rules.append((self._read_string(name_offset), self.url_at(url_index)))
+
+        return rules
+
+    def find_url_index_for_name(self, name: str) -> int:
+        """
+        :raises KeyError: if the name is not known
+        """
+
+        encoded = name.encode()
+        slot = _hash(encoded) % self._name_slots
+
+        while True:
+            name_offset, url_index = _name_slot.unpack_from(self._mm, self._name_table_offset + slot * _name_slot.size)
+
+            if name_offset == 0:
+                raise KeyError(name)
+
+            if self._read_string_bytes(name_offset) == encoded:
+                return url_index
+
+            slot = (slot + 1) % self._name_slots
+
+    def find_url_index(self, url: str) -> int:
+        """
+        :raises KeyError: if the URL is not known
+        """
+
+        encoded = url.encode()
+        slot = _hash(encoded) % self._url_slots
+
+        while True:
+            entry, = _url_slot.unpack_from(self._mm, self._url_table_offset + slot * _url_slot.size)
+
+            if entry == 0:
+                raise KeyError(url)
+
+            url_offset, _, _ = self._url_record(entry - 1)
+
+            if self._read_string_bytes(url_offset) == encoded:
+                return entry - 1
+
+            slot = (slot + 1) % self._url_slots
+
+
+class _URLsToNamesView(Mapping):
+    def __init__(self, compiled_map: CompiledMap):
+        self._map = compiled_map
+
+    def __getitem__(self, url: str) -> List[str]:
+        return self._map.names_at(self._map.find_url_index(url))
+
+    def __iter__(self) -> Iterator[str]:
+        for url_index in range(self._map.urls_count):
+            yield self._map.url_at(url_index)
+
+    def __len__(self) -> int:
+        return self._map.urls_count
+
+    def items(self):
+        return _URLsToNamesItemsView(self)
+
+
+class _URLsToNamesItemsView(ItemsView):
+    def __iter__(self):
+        # avoid looking up every URL again
+        compiled_map = self._mapping._map
+
+        for url_index in range(compiled_map.urls_count):
+            yield compiled_map.url_at(url_index), compiled_map.names_at(url_index)
+
+
+class _NamesToURLsView(Mapping):
+    def __init__(self, compiled_map: CompiledMap):
+        self._map = compiled_map
+
+    def __getitem__(self, name: str) -> str:
+        return self._map.url_at(self._map.find_url_index_for_name(name))
+
+    def __iter__(self) -> Iterator[str]:
+        for url_index in range(self._map.urls_count):
+            yield from self._map.names_at(url_index)
+
+    def __len__(self) -> int:
+        return self._map.names_count
@@ -1,6 +1,19 @@
-from flask import Blueprint
+import functools
+import threading
+import time
+from collections import Counter
+
+from flask import Blueprint, current_app, redirect, request
+from werkzeug.exceptions import GatewayTimeout, HTTPException, ServiceUnavailable
 
 from . import cache as _cache
+from .analytics import analytics
+from .cache_lock import acquire_lock, release_lock
+from .callback_guard import CallbackUnavailable, callback_guard
+from .metrics import metrics
+from .refresh import refresh_scheduler
+from .single_flight import FlightTimeout, SingleFlight
+from .tiered_cache import tiered_cache
 
 dynamic_redirects_bp = Blueprint("dynamic_redirects", __name__)
 
@@ -9,13 +22,231 @@ dynamic_redirects_bp = Blueprint("dynamic_redirects", __name__)
 dynamic_routes = []
 
 
-def dynamic_redirect(route, timeout=300):
-    def actual_decorator(f):
-        print(route, f)
+# concurrent cache misses for the same value are coalesced into a single callback call
+single_flight = SingleFlight()
+
+# counters about the dynamic redirections, see get_stats()
+# they are incremented by many request threads at once, and += is not atomic
+stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _count(name: str):
+    with _stats_lock:
+        stats[name] += 1
+
+
+def _count_miss(route: str, result: str):
+    # reported as a metric as well, so that the numbers of all worker processes are merged
+    metrics.inc("redirector_dynamic_misses_total", (("route", route), ("result", result)))
+
+
+def _wait_for_value(key: str, lock_key: str, timeout: float):
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        value = _cache.get(key)
+
+        # the other process might have failed to compute the value, in that case we need to try ourselves
+        if value is not None or _cache.get(lock_key) is None:
+            return value
+
+        time.sleep(0.05)
+
+    return None
+
+
+def _compute_once_across_processes(key: str, compute, route: str, wait_until: float = None):
+    lock_key = "{}/lock".format(key)
+    lock_timeout = int(current_app.config["DYNAMIC_REDIRECTS_LOCK_TIMEOUT"])
+
+    # only one process gets the lock, other processes wait for the value to show up in the cache
+    token = acquire_lock(lock_key, lock_timeout)
+
+    if token is None:
+        # the request must not wait for the other process longer than it would wait for the callback
+        wait_timeout = lock_timeout if wait_until is None else min(lock_timeout, wait_until - time.monotonic())
+        value = _wait_for_value(key, lock_key, wait_timeout)
+
+        if value is not None:
+            # number of cache misses which have been resolved by waiting for another process to compute the value
+            _count("remote_coalesced")
+            _count_miss(route, "remote_coalesced")
+            return value
+
+        if wait_until is not None and time.monotonic() >= wait_until:
+            raise CallbackUnavailable(route, "timeout", "value of {} has not been computed by another process in "
+                                                        "time".format(key))
+
+        # the other process has failed to compute the value, or is taking too long, in the latter case we compute the
+        # value without holding the lock
+        token = acquire_lock(lock_key, lock_timeout)
+
+    try:
+        if token is not None:
+            # another process might have stored the value and released the lock right before we have taken it
+            value = _cache.get(key)
+
+            if value is not None:
+                _count("remote_coalesced")
+                _count_miss(route, "remote_coalesced")
+                return value
+
+        _count_miss(route, "computed")
+        return compute()
+
+    finally:
+        if token is not None:
+            release_lock(lock_key, token)
+
+
+def get_stats() -> dict:
+    """
+    :return: counters about the dynamic redirections
+    """
+
+    with _stats_lock:
+        result = dict(stats)
+
+    result.update(computed=single_flight.computed, coalesced=single_flight.coalesced)
+    result.setdefault("remote_coalesced", 0)
+    result.setdefault("served_last_good", 0)
+    result.setdefault("served_fallback_url", 0)
+    result.update(tiered_cache.get_stats())
+    result.update(callback_guard.get_stats())
+    return result
+
+
+def _make_cached_view(route, callback, timeout, deadline=None, fallback_url=None):
+    route_labels = (("route", route),)
+    # labels by the tier which has answered the lookup, None meaning that the value was not cached in any tier
+    labels = {
+        "l1": (("route", route), ("tier", "l1"), ("result", "hit")),
+        "l2": (("route", route), ("tier", "l2"), ("result", "hit")),
+        None: (("route", route), ("tier", "l2"), ("result", "miss")),
+    }
+    l1_miss_labels = (("route", route), ("tier", "l1"), ("result", "miss"))
+
+    # runs the callback with a deadline and a circuit breaker, also used for refreshing values in the background
+    def guarded_callback(**kwargs):
+        return callback_guard.call(route, callback, kwargs, deadline)
+
+    def fall_back(key, e):
+        # if the value has expired anyway, e.g., because a background refresh took too long, or the upstream service is
+        # unavailable, we rather serve the last good value than an error
+        value = refresh_scheduler.last_good_value(key)
+
+        if value is None:
+            value = _cache.get("{}/last-good".format(key))
 
-        # this syntax might be awkward, but it works
-        cached_f = _cache.cached(timeout=timeout)(f)
-        dynamic_redirects_bp.route(route)(cached_f)
+        if value is not None:
+            _count("served_last_good")
+            metrics.inc("redirector_dynamic_fallbacks_total", (("route", route), ("source", "last_good")))
+            return value
+
+        url = fallback_url or callback_guard.fallback_url
+
+        if url is not None:
+            _count("served_fallback_url")
+            metrics.inc("redirector_dynamic_fallbacks_total", (("route", route), ("source", "fallback_url")))
+            return redirect(url)
+
+        if isinstance(e, CallbackUnavailable):
+            if e.reason == "timeout":
+                raise GatewayTimeout(str(e)) from e
+
+            raise ServiceUnavailable(str(e)) from e
+
+        raise e
+
+    @functools.wraps(callback)
+    def cached_view(**kwargs):
+        key = "dynamic/{}".format(request.path)
+
+        analytics.record("dynamic", request.path)
+
+        value, tier = tiered_cache.lookup(key)
+
+        # every lookup which is not answered by the first tier is a miss there
+        if tier != "l1" and tiered_cache.size > 0:
+            metrics.inc("redirector_dynamic_cache_requests_total", l1_miss_labels)
+
+        metrics.inc("redirector_dynamic_cache_requests_total", labels[tier])
+
+        if value is not None:
+            refresh_scheduler.hit(key)
+            return value
+
+        def compute():
+            start = time.perf_counter()
+
+            try:
+                value = guarded_callback(**kwargs)
+
+            finally:
+                metrics.observe("redirector_dynamic_callback_duration_seconds", time.perf_counter() - start,
+                                route_labels)
+
+            tiered_cache.set(key, value, timeout)
+
+            # kept without expiry in the shared cache, so every process can fall back to it if the callback fails
+            _cache.set("{}/last-good".format(key), value, timeout=0)
+
+            # have the value refreshed in the background before it expires
+            refresh_scheduler.track(key, request.path, kwargs, guarded_callback, timeout, value)
+
+            return value
+
+        # requests waiting for a computation of another thread or process give up after the deadline of the route
+        wait_timeout = deadline if deadline is not None else callback_guard.deadline
+        wait_until = time.monotonic() + wait_timeout
+
+        # whether this request runs the computation, rather than sharing the result of one which is running already
+        leader = []
+
+        def compute_once():
+            leader.append(True)
+            return _compute_once_across_processes(key, compute, route, wait_until)
+
+        try:
+            # concurrent misses in this process share a single computation, which in turn coordinates with other
+            # processes through the cache
+            return single_flight.do(key, compute_once, wait_timeout)
+
+        except HTTPException:
+            # deliberate answers of the callback (e.g., abort(404)) are passed on, they are not a failure
+            raise
+
+        except FlightTimeout as e:
+            return fall_back(key, CallbackUnavailable(route, "timeout", str(e)))
+
+        except Exception as e:
+            return fall_back(key, e)
+
+        finally:
+            if not leader:
+                _count_miss(route, "coalesced")
+
+    return cached_view
+
+
+def dynamic_redirect(route, timeout=300, deadline=None, fallback_url=None):
+    """
+    Register a callback for a dynamic redirection.
+
+    Coroutine functions are run on a shared event loop, so that many upstream lookups can be in flight at once (e.g.,
+    when using a threaded WSGI server). Regular functions are run on a bounded pool of threads. Either way, the
+    callback is given up on after ``deadline`` seconds (see :class:`~redirector.callback_guard.CallbackGuard`).
+
+    :param route: route of the redirection
+    :param timeout: seconds for which the result is cached
+    :param deadline: seconds the callback may take, defaults to ``DYNAMIC_REDIRECTS_CALLBACK_TIMEOUT``
+    :param fallback_url: URL redirected to if the callback fails and there is no last good value, defaults to
+        ``DYNAMIC_REDIRECTS_FALLBACK_URL``
+    """
+
+    def actual_decorator(f):
+        dynamic_redirects_bp.route(route)(_make_cached_view(route, f, timeout, deadline, fallback_url))
 
         # remember route for later
         dynamic_routes.append(route)
@@ -0,0 +1,109 @@
+import re
+import time
+from typing import Callable, Iterable
+
+from flask import Flask
+from werkzeug.exceptions import HTTPException
+
+from . import non_db_ext
+from .analytics import analytics
+from .metrics import metrics
+from .responses import get_static_redirect_responses
+from .views import is_reserved_name
+
+
+class StaticRedirectsFastPath:
+    """
+    WSGI middleware which answers requests for static redirections straight from the non-database, bypassing Flask's
+    routing, request context setup and exception handling. All other requests (e.g., the index page, the API, dynamic
+    redirections or static files) as well as requests for unknown names are passed on to the Flask app.
+    """
+
+    def __init__(self, app: Flask, wsgi_app: Callable):
+        """
+        :param app: Flask app, its URL map must be complete already
+        :param wsgi_app: WSGI app to pass all other requests to
+        """
+
+        self.app = app
+        self.wsgi_app = wsgi_app
+
+        # paths of other rules which consist of a single segment, and would therefore be handled by the shortener
+        self._reserved_paths = set()
+
+        # if there are rules with variable parts which may match a single segment, we have to ask the router
+        self._needs_routing_check = False
+
+        for rule in app.url_map.iter_rules():
+            if rule.endpoint == "redirector.shortener":
+                continue
+
+            # variable parts can only match a single segment, unless they use the path converter, which cannot be
+            # matched completely to a single segment if there are any other / in the rule
+            if re.sub(r"<[^>]*>", "x", rule.rule).count("/") != 1:
+                continue
+
+            if rule.arguments:
+                self._needs_routing_check = True
+            else:
+                self._reserved_paths.add(rule.rule)
+
+    def _is_shortener_request(self, environ: dict, path: str) -> bool:
+        if path in self._reserved_paths:
+            return False
+
+        if self._needs_routing_check:
+            adapter = self.app.url_map.bind_to_environ(environ)
+
+            try:
+                endpoint, _ = adapter.match()
+            except HTTPException:
+                return False
+
+            return endpoint == "redirector.shortener"
+
+        return True
+
+    def __call__(self, environ: dict, start_response: Callable) -> Iterable[bytes]:
+        if environ["REQUEST_METHOD"] in ("GET", "HEAD"):
+            path = environ.get("PATH_INFO", "")
+
+            # according to PEP 3333, the path is decoded as latin-1, so we need to transcode non-ASCII characters
+            try:
+                path = path.encode("latin-1").decode()
+            except UnicodeError:
+                path = ""
+
+            name = path[1:]
+
+            # the same rules as in the shortener view apply here
+            if name and "/" not in name and not is_reserved_name(name) and self._is_shortener_request(environ, path):
+                start = time.perf_counter()
+
+                responses = get_static_redirect_responses(self.app, non_db_ext.non_db)
+
+                try:
+                    key, headers = responses.match_name(name)
+
+                except KeyError:
+                    # unknown names are handled by Flask, which renders the error page
+                    pass
+
+                else:
+                    headers.append(("Content-Length", "0"))
+                    start_response(responses.status, headers)
+
+                    # the same metrics as for the shortener view are recorded
+                    if metrics.per_name_hits:
+                        metrics.inc("redirector_name_hits_total", (("name", key),))
+
+                    analytics.record("static", key)
+
+                    metrics.observe("redirector_request_duration_seconds", time.perf_counter() - start,
+                                    (("endpoint", "shortener"),))
+                    metrics.inc("redirector_requests_total",
+                                (("endpoint", "shortener"), ("status", responses.status[:3])))
+
+                    return []
+
+        return self.wsgi_app(environ, start_response)
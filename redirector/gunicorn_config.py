@@ -0,0 +1,15 @@
+# Gunicorn configuration for running the redirector with a preloaded app:
+#
+#     gunicorn --preload -c python:redirector.gunicorn_config "redirector:create_app()"
+#
+# if you use a configuration file of your own, import post_fork from this module in it
+
+
+def post_fork(server, worker):
+    """
+    Restart the background threads of the app which are not started lazily (i.e., the map reloader) in a new worker.
+    """
+
+    from . import non_db_ext
+
+    non_db_ext.post_fork()
@@ -0,0 +1,455 @@
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Callable, Dict, List, Tuple, Union
+from urllib.parse import urlsplit, urlunsplit
+
+from werkzeug.exceptions import MethodNotAllowed, NotFound
+from werkzeug.routing import Map, RequestRedirect
+
+from .non_database import NonDatabase
+from .responses import is_plain_uri, to_uri
+from .sharded_map import list_shards
+from .streaming_loader import MapLoadError, iter_map_entries, locate_all
+from .trie import NameTrie, is_rule
+
+
+# number of entries checked at once by a worker process
+CHUNK_SIZE = 10000
+
+_default_ports = {"http": 80, "https": 443}
+
+_percent_escape = re.compile(r"%[0-9a-fA-F]{2}")
+
+_non_empty_path = re.compile(r"[^:/?#]+://[^/?#]*/")
+
+
+def normalize_url(url: str) -> str:
+    """
+    Normalize a URL, so that URLs which point to the same resource are equal. Non-ASCII characters are converted like
+    in the Location headers of redirections, scheme and host name are converted to lowercase, default ports and empty
+    queries and fragments are removed, an empty path is replaced by ``/``, and percent escapes are converted to
+    uppercase.
+    """
+
+    # most URLs are normalized already, splitting them takes a lot longer than checking that
+    if is_plain_uri(url) and "%" not in url and _non_empty_path.match(url):
+        return url
+
+    try:
+        parts = urlsplit(to_uri(url))
+        port = parts.port
+
+    except ValueError:
+        # not a valid URL, nothing to normalize
+        return url
+
+    scheme = parts.scheme.lower()
+
+    # user names and passwords are case-sensitive
+    userinfo, at, host = parts.netloc.rpartition("@")
+    netloc = userinfo + at + host.lower()
+
+    if port is not None and port == _default_ports.get(scheme):
+        netloc = netloc.rsplit(":", 1)[0]
+
+    path = _percent_escape.sub(lambda match: match.group(0).upper(), parts.path) or "/"
+
+    return urlunsplit((scheme, netloc, path, parts.query, parts.fragment))
+
+
+class Problem:
+    """
+    A problem found in a map file.
+    """
+
+    __slots__ = ("kind", "message", "filename", "pos", "lineno", "colno")
+
+    def __init__(self, kind: str, message: str, filename: str, pos: int):
+        """
+        :param kind: kind of the problem, e.g., ``name_collision``
+        :param message: description of the problem
+        :param filename: file containing the problem
+        :param pos: character offset of the entry containing the problem
+        """
+
+        self.kind = kind
+        self.message = message
+        self.filename = filename
+        self.pos = pos
+
+        # computed for all problems at once, as that requires reading the file
+        self.lineno: Union[int, None] = None
+        self.colno: Union[int, None] = None
+
+    def __str__(self):
+        return "{}:{}:{}: {}: {}".format(self.filename, self.lineno, self.colno, self.kind, self.message)
+
+
+class CheckReport:
+    """
+    Result of :func:`check_map`.
+    """
+
+    def __init__(self):
+        self.problems: List[Problem] = []
+
+        self.files_count = 0
+        self.names_count = 0
+        self.urls_count = 0
+
+        # number of worker processes which have been used, 0 if the calling process has checked everything itself
+        self.processes = 0
+
+        # time needed to parse the files (for sharded maps, this includes validating the names and normalizing the URLs
+        # in the worker processes), and to check them entirely (including parsing), in seconds
+        self.parse_seconds = 0.0
+        self.total_seconds = 0.0
+
+
+class RouteShadowing:
+    """
+    Finds names which cannot be used, because requests for them are handled by other routes than the shortener (e.g.,
+    the API or dynamic redirections).
+    """
+
+    def __init__(self, url_map: Map, shortener_endpoint: str = "redirector.shortener",
+                 is_reserved_name: Union[Callable[[str], bool], None] = None):
+        """
+        :param url_map: URL map of the app
+        :param shortener_endpoint: endpoint of the view handling static redirections
+        :param is_reserved_name: function checking whether a name is reserved by the shortener itself
+        """
+
+        self._adapter = url_map.bind("localhost")
+        self._shortener_endpoint = shortener_endpoint
+        self._is_reserved_name = is_reserved_name
+
+        # paths of other rules without variable parts, which can be looked up directly
+        self._static_paths = set()
+
+        # static beginnings of the other rules, only names starting like one of them need to be routed
+        prefixes = set()
+
+        for rule in url_map.iter_rules():
+            if rule.endpoint == shortener_endpoint:
+                continue
+
+            if rule.arguments:
+                prefixes.add(rule.rule.split("<", 1)[0])
+            else:
+                self._static_paths.add(rule.rule)
+
+        self._prefixes = tuple(prefixes)
+
+    def __call__(self, name: str) -> Union[str, None]:
+        """
+        :return: description of the reason why the name cannot be used, or None if it can be used
+        """
+
+        if self._is_reserved_name is not None and self._is_reserved_name(name):
+            return "name {} is reserved".format(name)
+
+        path = "/" + name
+
+        # paths are routed with and without trailing slash, as rules ending with a slash redirect to the rule
+        if path not in self._static_paths and path + "/" not in self._static_paths and \
+                not (path + "/").startswith(self._prefixes):
+            return None
+
+        try:
+            rule, _ = self._adapter.match(path, method="GET", return_rule=True)
+
+        except RequestRedirect as e:
+            return "name {} is redirected to {}".format(name, e.new_url)
+
+        except MethodNotAllowed:
+            return "name {} is used by a route which does not allow GET requests".format(name)
+
+        except NotFound:
+            return None
+
+        if rule.endpoint == self._shortener_endpoint:
+            return None
+
+        return "name {} is shadowed by route {}".format(name, rule.rule)
+
+
+def _check_entries(entries: List[Tuple[str, List[str]]]) -> Tuple[List[Tuple[int, str, str]], List[str]]:
+    # validates the names and normalizes the URLs of entries, independently of all other entries, so that this can be
+    # run by worker processes
+    invalid_names = []
+    normalized_urls = []
+
+    for i, (url, names) in enumerate(entries):
+        for name in names:
+            try:
+                NonDatabase._validate_name(name, url)
+
+            except ValueError as e:
+                invalid_names.append((i, name, str(e)))
+
+        normalized_urls.append(normalize_url(url))
+
+    return invalid_names, normalized_urls
+
+
+def _check_file(filename: str) -> tuple:
+    # parses and checks an entire file, so that the shards of a sharded map can be parsed by worker processes
+    # returns the entries, the message and position of a syntax error (if any), and the result of _check_entries
+    entries = []
+    syntax_error = None
+
+    with open(filename, "r") as f:
+        try:
+            for url, names, pos in iter_map_entries(f, filename):
+                entries.append((url, names, pos))
+
+        except MapLoadError as e:
+            syntax_error = (e.msg, e.pos, e.lineno, e.colno)
+
+    return entries, syntax_error, _check_entries([(url, names) for url, names, _ in entries])
+
+
+class _Entry:
+    __slots__ = ("filename", "url", "names", "pos")
+
+    def __init__(self, filename: str, url: str, names: List[str], pos: int):
+        self.filename = filename
+        self.url = url
+        self.names = names
+        self.pos = pos
+
+
+def _add_syntax_problem(report: CheckReport, filename: str, message: str, pos: int, lineno: int, colno: int):
+    # the position is known already, the rest of the file cannot be parsed anyway
+    problem = Problem("syntax", message, filename, pos)
+    problem.lineno, problem.colno = lineno, colno
+    report.problems.append(problem)
+
+
+def _submit_chunks(filename: str, executor: Union[ProcessPoolExecutor, None], report: CheckReport) -> list:
+    # parses a single file in the calling process, while the chunks of entries are checked by the worker processes
+    # returns the entries of every chunk along with the result of the check, or a future of it
+    entries: List[_Entry] = []
+    chunks = []
+
+    def submit(chunk_entries):
+        args = [(entry.url, entry.names) for entry in chunk_entries]
+
+        if executor is None:
+            chunks.append((chunk_entries, _check_entries(args)))
+        else:
+            chunks.append((chunk_entries, executor.submit(_check_entries, args)))
+
+    with open(filename, "r") as f:
+        try:
+            for url, names, pos in iter_map_entries(f, filename):
+                entries.append(_Entry(filename, url, names, pos))
+
+                if len(entries) % CHUNK_SIZE == 0:
+                    submit(entries[-CHUNK_SIZE:])
+
+        except MapLoadError as e:
+            _add_syntax_problem(report, filename, e.msg, e.pos, e.lineno, e.colno)
+
+    remaining = len(entries) % CHUNK_SIZE
+
+    if remaining:
+        submit(entries[-remaining:])
+
+    return chunks
+
+
+def _check_shards(filenames: List[str], executor: Union[ProcessPoolExecutor, None], report: CheckReport) -> list:
+    # every shard is parsed and checked by a worker process on its own, the calling process only merges the results
+    if executor is None:
+        file_results = [_check_file(filename) for filename in filenames]
+    else:
+        file_results = list(executor.map(_check_file, filenames))
+
+    results = []
+
+    for filename, (entries, syntax_error, result) in zip(filenames, file_results):
+        if syntax_error is not None:
+            _add_syntax_problem(report, filename, *syntax_error)
+
+        results.append(([_Entry(filename, url, names, pos) for url, names, pos in entries], result))
+
+    return results
+
+
+def check_map(path: str, processes: Union[int, None] = None,
+              shadowing: Union[Callable[[str], Union[str, None]], None] = None) -> CheckReport:
+    """
+    Check a map file (or a directory of shards) for all problems at once, instead of stopping at the first one like
+    loading the map does.
+
+    A single file is parsed by the calling process in a single pass. Meanwhile, the names are validated and the URLs
+    are normalized by a pool of worker processes, in chunks of :data:`CHUNK_SIZE` entries. The shards of a sharded map
+    are parsed and checked by the worker processes entirely, one shard per task. Everything that requires looking at all
+    entries (e.g., finding name collisions) is done by the calling process.
+
+    The following problems are reported:
+
+    - ``syntax``: a file is not valid JSON or does not follow the map format, the rest of the file cannot be checked
+    - ``invalid_name``: a name would be rejected when loading the map
+    - ``name_collision``: a name is used for more than one URL
+    - ``duplicate_url``: a URL is defined more than once (in a single file, the later definition replaces the earlier
+      one, in sharded maps, this is an error)
+    - ``similar_urls``: URLs only differ in their normalization (see :func:`normalize_url`), e.g., the case of the host
+      name, so they should likely be merged
+    - ``ambiguous_rules``: a pattern rule is ambiguous with another one defined before it (see
+      :class:`redirector.trie.NameTrie`)
+    - ``shadowed_name``: a name cannot be used, as it is reserved or handled by another route (see
+      :class:`RouteShadowing`)
+
+    :param path: path of the map file or directory
+    :param processes: maximum number of worker processes, defaults to the number of CPUs, 1 disables the pool
+    :param shadowing: function returning the reason why a name cannot be used, or None if it can be used
+    :return: report
+    """
+
+    start = time.perf_counter()
+
+    report = CheckReport()
+
+    sharded = os.path.isdir(path)
+
+    if sharded:
+        filenames = sorted(list_shards(path))
+    else:
+        filenames = [path]
+
+    report.files_count = len(filenames)
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    # a single shard cannot be split up, so there is no point in more processes than shards
+    if sharded:
+        processes = min(processes, len(filenames))
+
+    executor = None
+
+    if processes > 1:
+        # like for sharded maps, forking a process which might run other threads is not safe
+        executor = ProcessPoolExecutor(processes, mp_context=get_context("spawn"))
+        report.processes = processes
+
+    try:
+        if sharded:
+            results = _check_shards(filenames, executor, report)
+            report.parse_seconds = time.perf_counter() - start
+
+        else:
+            chunks = _submit_chunks(path, executor, report)
+            report.parse_seconds = time.perf_counter() - start
+
+            results = [
+                (chunk_entries, result if executor is None else result.result()) for chunk_entries, result in chunks
+            ]
+
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    def add_problem(kind, message, entry):
+        report.problems.append(Problem(kind, message, entry.filename, entry.pos))
+
+    # entries by URL, like the map, later definitions within the same file replace earlier ones
+    urls_to_entries: Dict[str, _Entry] = {}
+    names_to_entries: Dict[str, _Entry] = {}
+    normalized_urls: Dict[str, _Entry] = {}
+
+    for chunk_entries, (invalid_names, chunk_normalized_urls) in results:
+        # invalid names are only reported once, they would be rejected anyway
+        skipped_names = set()
+
+        for i, name, message in invalid_names:
+            add_problem("invalid_name", message, chunk_entries[i])
+            skipped_names.add((i, name))
+
+        for i, (entry, normalized_url) in enumerate(zip(chunk_entries, chunk_normalized_urls)):
+            previous = urls_to_entries.get(entry.url)
+
+            if previous is not None:
+                if previous.filename == entry.filename:
+                    add_problem("duplicate_url", "URL {} is defined more than once, only the last definition is used"
+                                .format(entry.url), entry)
+
+                    for name in previous.names:
+                        if names_to_entries.get(name) is previous:
+                            del names_to_entries[name]
+
+                else:
+                    add_problem("duplicate_url", "URL {} is defined in both {} and {}".format(
+                        entry.url, previous.filename, entry.filename
+                    ), entry)
+
+            urls_to_entries[entry.url] = entry
+
+            for name in entry.names:
+                if (i, name) in skipped_names:
+                    continue
+
+                other = names_to_entries.get(name)
+
+                if other is not None:
+                    message = "Name collision: {} is used for (at least) both URLs {} and {}".format(
+                        name, other.url, entry.url
+                    )
+                    add_problem("name_collision", message, entry)
+                    continue
+
+                names_to_entries[name] = entry
+
+            other = normalized_urls.setdefault(normalized_url, entry)
+
+            if other.url != entry.url:
+                add_problem("similar_urls", "URLs {} and {} only differ in normalization".format(other.url, entry.url),
+                            entry)
+
+    # rules are added one by one, so all ambiguous rules are found, not only the first one like when loading the map
+    trie = NameTrie()
+
+    for name, entry in names_to_entries.items():
+        if not is_rule(name):
+            continue
+
+        try:
+            trie.add(name, entry.url)
+
+        except ValueError as e:
+            add_problem("ambiguous_rules", str(e), entry)
+
+    if shadowing is not None:
+        for name, entry in names_to_entries.items():
+            message = shadowing(name)
+
+            if message is not None:
+                add_problem("shadowed_name", message, entry)
+
+    report.names_count = len(names_to_entries)
+    report.urls_count = len(urls_to_entries)
+
+    # the lines and columns of all problems are computed at once, reading every file only once
+    for filename in filenames:
+        problems = [problem for problem in report.problems if problem.filename == filename and problem.lineno is None]
+
+        if not problems:
+            continue
+
+        with open(filename, "r") as f:
+            positions = locate_all(f, [problem.pos for problem in problems])
+
+        for problem in problems:
+            _, problem.lineno, problem.colno = positions[problem.pos]
+
+    report.problems.sort(key=lambda problem: (problem.filename, problem.pos))
+
+    report.total_seconds = time.perf_counter() - start
+
+    return report
@@ -0,0 +1,509 @@
+import atexit
+import functools
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from typing import Dict, List, Tuple, Union
+
+from flask import Flask
+from werkzeug.exceptions import HTTPException
+
+from .async_support import BackgroundThread
+from .util import file_lock, parse_flag
+
+
+logger = logging.getLogger(__name__)
+
+
+# labels are stored as tuples of (name, value) pairs, so they can be used as dict keys
+Labels = Tuple[Tuple[str, str], ...]
+Key = Tuple[str, Labels]
+
+# upper bounds of the latency histogram buckets in seconds, the last bucket (+Inf) is implicit
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# file in the shared directory holding the values of processes which have exited, and the lock guarding it
+AGGREGATE_FILENAME = "aggregate.json"
+LOCK_FILENAME = "aggregate.lock"
+
+
+class _ThreadValues:
+    """
+    Metric values recorded by a single thread. Only the owning thread writes to these, so no locking is needed.
+    """
+
+    __slots__ = ("counters", "histograms")
+
+    def __init__(self):
+        self.counters: Dict[Key, float] = {}
+
+        # key -> bucket counts (including the +Inf bucket), followed by the sum and the count of the observed values
+        self.histograms: Dict[Key, List[float]] = {}
+
+
+def _merge(target: _ThreadValues, counters: Dict[Key, float], histograms: Dict[Key, List[float]]):
+    for key, value in counters.items():
+        target.counters[key] = target.counters.get(key, 0) + value
+
+    for key, values in histograms.items():
+        target_values = target.histograms.get(key)
+
+        if target_values is None:
+            target.histograms[key] = list(values)
+        else:
+            for i, value in enumerate(values):
+                target_values[i] += value
+
+
+class Metrics:
+    """
+    Collects counters and histograms with as little overhead as possible.
+
+    Every thread records its values in its own storage, so the hot path does not need any locks. The values of all
+    threads are only merged when the metrics are collected.
+
+    WSGI servers like Gunicorn run multiple worker processes. To merge their values, every process regularly writes
+    its values to a file in a shared directory (``METRICS_DIR``), and all files are merged when the metrics are
+    collected. Like in the multiprocess mode of prometheus_client, the files of processes which have exited are folded
+    into an aggregate file, so that counters never decrease while the server is running. The directory is only cleared
+    when the server starts anew.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+        # values of all threads which have recorded anything, along with the threads
+        self._threads: List[Tuple[threading.Thread, _ThreadValues]] = []
+        self._lock = threading.Lock()
+
+        # values of threads which have terminated
+        self._retired = _ThreadValues()
+
+        self.directory: Union[str, None] = None
+        self.flush_interval = 5.0
+        self.per_name_hits = True
+
+        # the file this process writes its values to, which must not be inherited by forked processes
+        self._filename: Union[str, None] = None
+        self._thread = BackgroundThread(self._run, "redirector-metrics-flush")
+
+        self._atexit_registered = False
+
+        # values recorded before forking (e.g., when preloading the app) must not be counted by every worker
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self.reset)
+
+    def init_app(self, app: Flask):
+        app.config.setdefault("METRICS_DIR", None)
+        app.config.setdefault("METRICS_FLUSH_INTERVAL", "5")
+        app.config.setdefault("METRICS_PER_NAME_HITS", True)
+
+        self.directory = app.config["METRICS_DIR"]
+        self.flush_interval = float(app.config["METRICS_FLUSH_INTERVAL"])
+        self.per_name_hits = parse_flag(app.config["METRICS_PER_NAME_HITS"])
+
+        if self.directory is not None:
+            self._clear_previous_run()
+
+            # the last values of every process would be lost otherwise, the handler is inherited by forked processes
+            if not self._atexit_registered:
+                atexit.register(self._flush_at_exit)
+                self._atexit_registered = True
+
+    def reset(self):
+        """
+        Discard all recorded values of this process.
+        """
+
+        self._local = threading.local()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._retired = _ThreadValues()
+        self._filename = None
+
+    def _values(self) -> _ThreadValues:
+        try:
+            return self._local.values
+
+        except AttributeError:
+            values = _ThreadValues()
+            self._local.values = values
+
+            with self._lock:
+                self._threads.append((threading.current_thread(), values))
+
+            if self.directory is not None:
+                self._thread.ensure_started()
+
+            return values
+
+    def inc(self, name: str, labels: Labels = (), amount: float = 1):
+        """
+        Increment a counter.
+
+        :param name: name of the metric
+        :param labels: labels of the metric as a tuple of (name, value) pairs
+        :param amount: amount to increment the counter by
+        """
+
+        counters = self._values().counters
+        key = (name, labels)
+
+        counters[key] = counters.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, labels: Labels = ()):
+        """
+        Record a value in a histogram.
+
+        :param name: name of the metric
+        :param value: observed value, e.g., a duration in seconds
+        :param labels: labels of the metric as a tuple of (name, value) pairs
+        """
+
+        histograms = self._values().histograms
+        key = (name, labels)
+
+        try:
+            values = histograms[key]
+
+        except KeyError:
+            values = histograms[key] = [0] * (len(BUCKETS) + 3)
+
+        # the counts are stored per bucket, the cumulative counts are computed when rendering
+        values[bisect_left(BUCKETS, value)] += 1
+        values[-2] += value
+        values[-1] += 1
+
+    def snapshot(self) -> _ThreadValues:
+        """
+        :return: merged values of all threads of this process
+        """
+
+        result = _ThreadValues()
+
+        with self._lock:
+            alive = []
+
+            for thread, values in self._threads:
+                # copying the dicts is atomic, so the owning thread may keep writing to them
+                counters, histograms = values.counters.copy(), values.histograms.copy()
+                histograms = {key: list(bucket_values) for key, bucket_values in histograms.items()}
+
+                if thread.is_alive():
+                    alive.append((thread, values))
+                    _merge(result, counters, histograms)
+
+                else:
+                    # some servers start a thread per request, so we must not keep the values of every thread
+                    _merge(self._retired, counters, histograms)
+
+            self._threads = alive
+
+            _merge(result, self._retired.counters, self._retired.histograms)
+
+        return result
+
+    def flush(self):
+        """
+        Write the values of this process to the shared directory.
+        """
+
+        if self._filename is None:
+            # process IDs may be reused, so we add a random suffix to make sure we never overwrite another process's
+            # file
+            self._filename = os.path.join(self.directory, "{}-{}.json".format(os.getpid(), uuid.uuid4().hex[:8]))
+
+        _write_values(self._filename, self.snapshot())
+
+    def collect(self) -> _ThreadValues:
+        """
+        :return: merged values of all processes writing to the shared directory, or of this process only if there is
+            no shared directory
+        """
+
+        if self.directory is None:
+            return self.snapshot()
+
+        # make sure our own values are up to date
+        self.flush()
+
+        aggregate_filename = os.path.join(self.directory, AGGREGATE_FILENAME)
+
+        # the lock makes sure that the values of exited processes are folded into the aggregate only once, and that
+        # they are never counted twice while this happens
+        with file_lock(os.path.join(self.directory, LOCK_FILENAME)):
+            aggregate = _read_values(aggregate_filename)
+            result = _ThreadValues()
+            exited = []
+
+            for filename in glob.glob(os.path.join(self.directory, "*.json")):
+                if filename == aggregate_filename:
+                    continue
+
+                values = _read_values(filename)
+
+                if values is None:
+                    continue
+
+                _merge(result, values.counters, values.histograms)
+
+                if not _is_alive(_pid_of(filename)):
+                    exited.append((filename, values))
+
+            if aggregate is None:
+                aggregate = _ThreadValues()
+
+            else:
+                _merge(result, aggregate.counters, aggregate.histograms)
+
+            if exited:
+                # the values of workers which have exited (e.g., after a restart) must still be counted, but their
+                # files would pile up otherwise
+                for _, values in exited:
+                    _merge(aggregate, values.counters, values.histograms)
+
+                _write_values(aggregate_filename, aggregate, process_group=_read_process_group(aggregate_filename))
+
+                for filename, _ in exited:
+                    _remove_file(filename)
+
+        return result
+
+    def _clear_previous_run(self):
+        # all processes of a server (e.g., the Gunicorn master and its workers) share a process group, so files of
+        # another process group have been left behind by a previous run of the server
+        process_group = _process_group()
+
+        if process_group is None:
+            return
+
+        aggregate_filename = os.path.join(self.directory, AGGREGATE_FILENAME)
+
+        with file_lock(os.path.join(self.directory, LOCK_FILENAME)):
+            if _read_process_group(aggregate_filename) == process_group:
+                return
+
+            for filename in glob.glob(os.path.join(self.directory, "*.json")):
+                if filename == aggregate_filename or not _is_alive(_pid_of(filename)):
+                    _remove_file(filename)
+
+            _write_values(aggregate_filename, _ThreadValues(), process_group=process_group)
+
+    def _flush_at_exit(self):
+        # processes which have never recorded anything (e.g., a master process) do not need a file
+        if self.directory is None or not (self._threads or self._retired.counters or self._retired.histograms):
+            return
+
+        try:
+            self.flush()
+
+        except Exception:
+            logger.exception("failed to write metrics")
+
+    def render(self) -> str:
+        """
+        :return: all metrics in the Prometheus text exposition format
+        """
+
+        values = self.collect()
+
+        lines = []
+
+        for name, samples in _group_by_name(values.counters).items():
+            lines.append("# TYPE {} counter".format(name))
+
+            for labels, value in samples:
+                lines.append("{}{} {}".format(name, _format_labels(labels), _format_value(value)))
+
+        for name, samples in _group_by_name(values.histograms).items():
+            lines.append("# TYPE {} histogram".format(name))
+
+            for labels, bucket_values in samples:
+                cumulative_count = 0
+
+                for upper_bound, count in zip(BUCKETS + ("+Inf",), bucket_values[:-2]):
+                    cumulative_count += count
+                    lines.append("{}_bucket{} {}".format(
+                        name, _format_labels(labels + (("le", str(upper_bound)),)), _format_value(cumulative_count)
+                    ))
+
+                lines.append("{}_sum{} {}".format(name, _format_labels(labels), _format_value(bucket_values[-2])))
+                lines.append("{}_count{} {}".format(name, _format_labels(labels), _format_value(bucket_values[-1])))
+
+        return "\n".join(lines) + "\n"
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+
+            try:
+                self.flush()
+
+            except Exception:
+                # the thread must keep running, otherwise the values of this process would silently become stale
+                logger.exception("failed to write metrics")
+
+
+def _pid_of(filename: str) -> Union[int, None]:
+    # files are named <pid>-<random suffix>.json, see Metrics.flush()
+    try:
+        return int(os.path.basename(filename).split("-", 1)[0])
+
+    except ValueError:
+        return None
+
+
+def _is_alive(pid: Union[int, None]) -> bool:
+    # files of unknown processes are kept, as are all files on systems on which we cannot check processes safely
+    if pid is None or os.name != "posix":
+        return True
+
+    try:
+        os.kill(pid, 0)
+
+    except ProcessLookupError:
+        return False
+
+    # the process exists, but belongs to another user
+    except PermissionError:
+        return True
+
+    return True
+
+
+def _process_group() -> Union[int, None]:
+    if not hasattr(os, "getpgrp"):
+        return None
+
+    return os.getpgrp()
+
+
+def _read_values(filename: str) -> Union[_ThreadValues, None]:
+    try:
+        with open(filename) as f:
+            data = json.load(f)
+
+    except FileNotFoundError:
+        return None
+
+    except (OSError, ValueError):
+        # a broken file must not break the whole endpoint
+        logger.exception("failed to read metrics file %s", filename)
+        return None
+
+    # JSON does not know tuples, so the labels need to be converted back to be usable as keys
+    values = _ThreadValues()
+    values.counters = {(name, tuple(map(tuple, labels))): value for name, labels, value in data["counters"]}
+    values.histograms = {
+        (name, tuple(map(tuple, labels))): bucket_values for name, labels, bucket_values in data["histograms"]
+    }
+
+    return values
+
+
+def _read_process_group(filename: str) -> Union[int, None]:
+    try:
+        with open(filename) as f:
+            return json.load(f).get("process_group")
+
+    except (OSError, ValueError):
+        return None
+
+
+def _write_values(filename: str, values: _ThreadValues, process_group: Union[int, None] = None):
+    data = {
+        "counters": [[name, labels, value] for (name, labels), value in values.counters.items()],
+        "histograms": [[name, labels, bucket_values] for (name, labels), bucket_values in values.histograms.items()],
+    }
+
+    if process_group is not None:
+        data["process_group"] = process_group
+
+    # write atomically, so that readers never see a partially written file
+    tmp_filename = filename + ".tmp"
+
+    with open(tmp_filename, "w") as f:
+        json.dump(data, f)
+
+    os.replace(tmp_filename, filename)
+
+
+def _remove_file(filename: str):
+    try:
+        os.unlink(filename)
+
+    # another process might have removed it already
+    except FileNotFoundError:
+        pass
+
+
+def _group_by_name(values: dict) -> Dict[str, list]:
+    grouped = {}
+
+    for (name, labels), value in sorted(values.items()):
+        grouped.setdefault(name, []).append((labels, value))
+
+    return grouped
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+
+    return "{{{}}}".format(",".join('{}="{}"'.format(name, _escape_label_value(value)) for name, value in labels))
+
+
+def _format_value(value: float) -> str:
+    if float(value).is_integer():
+        return str(int(value))
+
+    return repr(float(value))
+
+
+# global metrics instance, like the other extensions
+metrics = Metrics()
+
+
+def instrument(endpoint: str):
+    """
+    Decorator recording the number of requests by status code and the latency of a view.
+
+    :param endpoint: value of the endpoint label
+    """
+
+    duration_labels = (("endpoint", endpoint),)
+
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            status = 500
+
+            try:
+                response = f(*args, **kwargs)
+
+                # views may return strings as well as response objects
+                status = getattr(response, "status_code", 200)
+
+                return response
+
+            except HTTPException as e:
+                status = e.code
+                raise
+
+            finally:
+                metrics.observe("redirector_request_duration_seconds", time.perf_counter() - start, duration_labels)
+                metrics.inc("redirector_requests_total", (("endpoint", endpoint), ("status", str(status))))
+
+        return wrapper
+
+    return decorator
@@ -1,9 +1,27 @@
-import json
+import io
+import logging
+import os
+import signal
+import threading
+import time
 import warnings
-from typing import Union, List
+from typing import Callable, Dict, Union, List, Sequence, Tuple
 
 from flask import Flask
 
+from .change_log import ChangeLog, compute_changes
+from .compact_map import CompactMap
+from .compiled_map import CompiledMap, is_compiled_map
+from .sqlite_map import FORMAT_VERSION as SQLITE_FORMAT_VERSION, SqliteMap, build_sqlite_map, is_sqlite_map, read_meta
+from .sharded_map import Shard, directory_signature, is_shard_directory, load_shards, merge_shards
+from .snapshot import file_digest, load_snapshot, write_snapshot
+from .trie import NameTrie, is_rule, validate_rule
+from .streaming_loader import MapLoadError, iter_map_entries, locate
+from .util import file_lock, parse_flag
+
+
+logger = logging.getLogger(__name__)
+
 
 class NonDatabase:
     """
@@ -11,7 +29,12 @@ class NonDatabase:
     for looking up in both directions.
     """
 
-    def __init__(self, filename_or_data: Union[str, dict, None] = None):
+    # ways to store the data of map files, see :meth:`load_data`
+    BACKENDS = ("memory", "sqlite")
+
+    def __init__(self, filename_or_data: Union[str, dict, None] = None, compact: bool = False,
+                 change_log_size: int = 10000, load_processes: Union[int, None] = None, backend: str = "memory",
+                 cache_size: int = 100000, snapshot_dir: Union[str, None] = None):
         """
         Hybrid constructor. Can either initialize an empty non-database into which one can later load the data, or
         alternatively the data (or a string to the data) can be passed directly, saving one call.
@@ -19,11 +42,40 @@ class NonDatabase:
         For more information on the data structure, please refer to :meth:`load_data`.
 
         :param filename_or_data: Path of file or data
+        :param compact: store the data in a compact representation (see :class:`redirector.compact_map.CompactMap`)
+        :param change_log_size: maximum number of changes kept in the change log
+        :param load_processes: maximum number of processes parsing the shards of a sharded map in parallel
+        :param backend: how to store the data of map files, either ``memory`` or ``sqlite``
+        :param cache_size: maximum number of names cached in memory by the ``sqlite`` backend
+        :param snapshot_dir: directory in which validated snapshots of JSON map files are stored, None disables them
         """
 
+        if backend not in self.BACKENDS:
+            raise ValueError("invalid backend: {}".format(backend))
+
+        self.compact = compact
+        self.change_log_size = change_log_size
+        self.load_processes = load_processes
+        self.backend = backend
+        self.cache_size = cache_size
+        self.snapshot_dir = snapshot_dir
+
+        # data derived from the map (e.g., precomputed responses) can be stored here by other components
+        # as a new instance is created whenever the map is reloaded, this data never outlives the map it belongs to
+        self.derived: dict = {}
+
+        # identifies the loaded data, e.g., to key cached data derived from the map, increases with every reload
+        # for files, this is the modification time in nanoseconds, so the same file loaded in different processes
+        # results in the same version
+        self.version: int = 0
+
+        # time at which the loaded data has last been modified, as a UNIX timestamp
+        self.last_modified: Union[float, None] = None
+
         # we store the mapping twice
         # this adds memory overhead, however reduces runtime overhead significantly
         # given the amount of names this redirector typically has to handle, this is an acceptable trade-off
+        # for very large maps, a compiled map can be used, which is shared between all processes
 
         # URLs-to-names mapping, can be used to lookup all names assigned to a URL
         self.urls_to_names: dict = {}
@@ -31,10 +83,24 @@ class NonDatabase:
         # names-to-URLs mapping, can be used to lookup the URL assigned to a name
         self.names_to_urls: dict = {}
 
+        # prefix rules (e.g., gh/*) and pattern rules (e.g., release/<version>), which are stored in the mappings like
+        # all other names, but are matched through a trie
+        self.prefix_rules = NameTrie()
+
+        # SQLite map the data is read from, if any, which allows for answering queries without loading the entire map
+        self.sqlite_map: Union[SqliteMap, None] = None
+
+        # changes made to the map over a series of reloads, see :meth:`continue_change_log`
+        self.change_log = ChangeLog(self.version, change_log_size)
+
+        # shards of a sharded map by path, kept so that unchanged shards need not be parsed again on reloads
+        # these only contain the URLs of the shards (see :meth:`redirector.sharded_map.Shard.strip`)
+        self.shards: Union[Dict[str, Shard], None] = None
+
         if filename_or_data is not None:
             self.load_data(filename_or_data)
 
-    def load_data(self, filename_or_data: Union[str, dict]):
+    def load_data(self, filename_or_data: Union[str, dict], previous: Union["NonDatabase", None] = None):
         """
         This method loads the data into the internal storage. It can be used to initialize and later re-initialize the
         non-database instance.
@@ -42,68 +108,451 @@ class NonDatabase:
         The expected data structure is a mapping of URLs to the short names the redirector shall react on. It's the
         reverse of the many-to-one names-to-URL mapping the system usually works with.
 
-        :param filename_or_data: either a path to a JSON file which should be loaded, or the data directly
+        Alternatively, the path may point to a compiled map (see :func:`redirector.compiled_map.compile_map`). Such
+        maps have been validated on compilation already and are memory-mapped read-only, so that all processes using
+        the same file share the same memory.
+
+        The path may also point to a directory of JSON files (called shards), each of which follows the format above.
+        The shards are parsed in parallel, and merged into a single map. Every name and URL may only be defined in a
+        single shard.
+
+        With the ``sqlite`` backend, JSON files are converted into a SQLite database next to the file (with the
+        extension ``.sqlite`` appended) unless it is up to date already, and only the entries which are looked up are
+        loaded into memory (see :class:`redirector.sqlite_map.SqliteMap`). Paths pointing to such databases directly
+        are detected automatically, regardless of the backend.
+
+        If a snapshot directory is configured, the validated data of JSON files is stored there, keyed by the hash of
+        the file's contents (see :mod:`redirector.snapshot`). Loading the same file again (e.g., in another process, or
+        after a restart) then skips parsing and validating it.
+
+        :param filename_or_data: either a path to a JSON file or a directory of JSON files which should be loaded, or
+            the data directly
+        :param previous: non-database previously loaded from the same directory, whose unchanged shards are reused
         """
 
         if isinstance(filename_or_data, dict):
-            self.urls_to_names = filename_or_data
+            urls_to_names = filename_or_data
+            last_modified = time.time()
+            version = int(last_modified * 1e9)
+
+        elif is_shard_directory(filename_or_data):
+            if self.backend == "sqlite":
+                raise ValueError("the sqlite backend does not support sharded maps, please build a SQLite map with "
+                                 "flask redirector compile --format sqlite")
+
+            previous_shards, previous_urls_to_names = None, None
+
+            if previous is not None:
+                previous_shards, previous_urls_to_names = previous.shards, previous.urls_to_names
+
+            shards = load_shards(
+                filename_or_data, self._load_file, previous_shards, self.load_processes, previous_urls_to_names
+            )
+            urls_to_names, names_to_urls, rules = merge_shards(shards)
+
+            self._set_data(urls_to_names, names_to_urls, rules)
+
+            # removing a shard changes the modification time of the directory, but not of any of the remaining shards
+            version = max([os.stat(filename_or_data).st_mtime_ns] + [s.signature[0] for s in shards.values()])
+            self._set_version(version, version / 1e9)
+
+            # keeping the parsed shards would defeat the purpose of the compact representation, so all shards are parsed
+            # again on reloads
+            # otherwise, only the URLs of each shard are kept, their entries can be found in the merged map
+            if not self.compact:
+                self.shards = {filename: shard.strip() for filename, shard in shards.items()}
+
+            return
+
+        elif is_sqlite_map(filename_or_data):
+            self._load_sqlite_map(filename_or_data)
+            return
+
+        elif is_compiled_map(filename_or_data):
+            compiled_map = CompiledMap(filename_or_data)
+
+            self.urls_to_names = compiled_map.urls_to_names
+            self.names_to_urls = compiled_map.names_to_urls
+            self.prefix_rules = NameTrie.from_rules(compiled_map.rules())
+            self.sqlite_map = None
+            self._set_version(compiled_map.stat.st_mtime_ns, compiled_map.stat.st_mtime)
+
+            return
+
+        elif self.backend == "sqlite":
+            sqlite_filename = filename_or_data + ".sqlite"
+
+            self._update_sqlite_map(filename_or_data, sqlite_filename)
+            self._load_sqlite_map(sqlite_filename)
+
+            return
+
+        elif self.snapshot_dir is not None:
+            urls_to_names, names_to_urls, rules, stat = self._load_file_with_snapshot(filename_or_data)
+
+            self._set_data(urls_to_names, names_to_urls, rules)
+            self._set_version(stat.st_mtime_ns, stat.st_mtime)
+
+            return
 
         else:
-            with open(filename_or_data, "r") as f:
-                self.urls_to_names = json.load(f)
+            # files are parsed and validated entry by entry, building both mappings directly
+            # this keeps the peak memory usage low, and allows for reporting the position of errors in the file
+            urls_to_names, names_to_urls, stat = self._load_file(filename_or_data)
+
+            self._set_data(urls_to_names, names_to_urls)
+            self._set_version(stat.st_mtime_ns, stat.st_mtime)
+
+            return
 
         # this call also performs a validity check on all names (e.g., ensuring that no / is contained)
-        self.names_to_urls = self._build_reverse_map(self.urls_to_names)
+        # we assign the attributes only after the check has passed, so a broken map never leaves the instance in an
+        # inconsistent state
+        names_to_urls = self._build_reverse_map(urls_to_names)
+
+        self._set_data(urls_to_names, names_to_urls)
+        self._set_version(version, last_modified)
+
+    def _set_version(self, version: int, last_modified: float):
+        self.version = version
+        self.last_modified = last_modified
+
+        # the history of the previously loaded data does not apply to the new data
+        self.change_log = ChangeLog(version, self.change_log_size)
+
+    def continue_change_log(self, previous: "NonDatabase"):
+        """
+        Continue the change log of the non-database this instance replaces, recording the changes between both.
+
+        This also makes sure the version increases monotonically, even if the map file's modification time does not
+        (e.g., because an older file has been restored).
+
+        :param previous: non-database this instance replaces
+        """
+
+        if self.version <= previous.version:
+            self.version = previous.version + 1
+
+        changes = compute_changes(previous.names_to_urls, self.names_to_urls)
+        self.change_log = previous.change_log.extend(self.version, changes)
+
+    def _set_data(self, urls_to_names: dict, names_to_urls: dict, rules: Union[List[Tuple[str, str]], None] = None):
+        if rules is None:
+            self.prefix_rules = NameTrie.from_map(urls_to_names)
+        else:
+            self.prefix_rules = NameTrie.from_rules(rules)
+
+        self.sqlite_map = None
+
+        if self.compact:
+            # the reverse map is only needed for validation, dropping it early reduces the peak memory usage
+            names_to_urls.clear()
+
+            compact_map = CompactMap(urls_to_names)
+
+            self.urls_to_names = compact_map.urls_to_names
+            self.names_to_urls = compact_map.names_to_urls
+
+        else:
+            self.urls_to_names = urls_to_names
+            self.names_to_urls = names_to_urls
+
+    def _load_sqlite_map(self, filename: str):
+        sqlite_map = SqliteMap(filename, self.cache_size)
+
+        self.urls_to_names = sqlite_map.urls_to_names
+        self.names_to_urls = sqlite_map.names_to_urls
+        self.prefix_rules = NameTrie.from_rules(sqlite_map.rules())
+        self.sqlite_map = sqlite_map
+        self._set_version(sqlite_map.version, sqlite_map.last_modified)
+
+    @staticmethod
+    def _is_sqlite_map_up_to_date(source: str, filename: str) -> bool:
+        stat = os.stat(source)
+        meta = read_meta(filename)
+
+        return meta.get("format_version") == SQLITE_FORMAT_VERSION and \
+            (meta.get("source_mtime_ns"), meta.get("source_size")) == (stat.st_mtime_ns, stat.st_size)
+
+    @classmethod
+    def _update_sqlite_map(cls, source: str, filename: str):
+        # all processes using the same source share the same database, so it only needs to be built once
+        if cls._is_sqlite_map_up_to_date(source, filename):
+            return
+
+        # all workers notice a change at about the same time, only one of them should build the database
+        with file_lock(filename + ".lock"):
+            # another process might have built it while we were waiting for the lock
+            if cls._is_sqlite_map_up_to_date(source, filename):
+                return
+
+            cls.build_sqlite_map(source, filename)
+
+    @classmethod
+    def build_sqlite_map(cls, source: str, filename: str):
+        """
+        Convert a JSON map file into a SQLite map (see :func:`redirector.sqlite_map.build_sqlite_map`). The file is
+        parsed and validated entry by entry, so the map is never held in memory entirely.
+
+        :param source: path of the JSON file
+        :param filename: path of the resulting SQLite map
+        :raises ValueError: if the map is not valid
+        """
+
+        with open(source, "r") as f:
+            # the stat result is obtained before reading, so a concurrent modification results in a newer version
+            stat = os.fstat(f.fileno())
+
+            # position of the entry which is being inserted, needed to report the position of errors
+            last_pos = 0
+
+            def entries():
+                nonlocal last_pos
+
+                for url, names, pos in iter_map_entries(f, source):
+                    last_pos = pos
+                    yield url, names
+
+            try:
+                build_sqlite_map(
+                    entries(), filename, stat.st_mtime_ns, stat.st_mtime, (stat.st_mtime_ns, stat.st_size),
+                    cls._validate_name
+                )
+
+            except MapLoadError:
+                raise
+
+            except ValueError as e:
+                with open(source, "r") as error_f:
+                    position = locate(error_f, last_pos)
+
+                raise MapLoadError(str(e), source, position) from e
+
+    def _load_file_with_snapshot(self, filename: str):
+        with open(filename, "rb") as f:
+            # the stat result is obtained before reading, so a concurrent modification results in a newer version
+            stat = os.fstat(f.fileno())
+            digest = file_digest(f)
+
+            data = load_snapshot(self.snapshot_dir, filename, digest)
+
+            if data is not None:
+                return data + (stat,)
+
+            # the contents which have been hashed must be parsed, so the file must not be opened again
+            f.seek(0)
+            urls_to_names, names_to_urls = self._parse_file(io.TextIOWrapper(f), filename)
+
+        rules = [(name, url) for name, url in names_to_urls.items() if is_rule(name)]
+
+        write_snapshot(self.snapshot_dir, filename, digest, (urls_to_names, names_to_urls, rules))
+
+        return urls_to_names, names_to_urls, rules, stat
+
+    @classmethod
+    def _load_file(cls, filename: str):
+        with open(filename, "r") as f:
+            # the stat result is obtained before reading, so a concurrent modification results in a newer version
+            stat = os.fstat(f.fileno())
+
+            urls_to_names, names_to_urls = cls._parse_file(f, filename)
+
+        return urls_to_names, names_to_urls, stat
+
+    @classmethod
+    def _parse_file(cls, f, filename: str):
+        urls_to_names = {}
+        names_to_urls = {}
+
+        for url, names, pos in iter_map_entries(f, filename):
+            # like json.load, we let later entries for the same URL replace earlier ones
+            if url in urls_to_names:
+                for name in urls_to_names[url]:
+                    del names_to_urls[name]
+
+            try:
+                cls._add_names(names_to_urls, url, names)
+
+            except ValueError as e:
+                with open(filename, "r") as error_f:
+                    position = locate(error_f, pos)
+
+                raise MapLoadError(str(e), filename, position) from e
+
+            urls_to_names[url] = names
+
+        return urls_to_names, names_to_urls
+
+    @classmethod
+    def _validate_name(cls, name: str, url: str):
+        # names may consist of multiple segments separated by /, like paths, but there must not be any empty segments
+        if "" in name.split("/"):
+            raise ValueError("names must not be empty, start or end with a / or contain empty segments: {}".format(
+                name
+            ))
+
+        validate_rule(name, url)
 
     @classmethod
-    def _validate_name(cls, name):
-        if "/" in name:
-            raise ValueError("/ character is not allowed in names")
+    def _add_names(cls, reverse_map: dict, url: str, names: List[str]):
+        for name in names:
+            # due to the way the input data mapping is constructed (i.e., mapping URLs to names), names might be
+            # specified more than once
+            # this is however not in order, the names need to be unique
+            # therefore, on load, we need to make sure there are no collisions
+            if name in reverse_map:
+                raise ValueError("Name collision: {} is used for (at least) both URLs {} and {}".format(
+                    name, reverse_map[name], url
+                ))
+
+            # call name checker to make sure the names are valid
+            cls._validate_name(name, url)
+
+            reverse_map[name] = url
 
     @classmethod
     def _build_reverse_map(cls, forward_map: dict):
         reverse_map = {}
 
         for url, names in forward_map.items():
-            for name in names:
-                # due to the way the input data mapping is constructed (i.e., mapping URLs to names), names might be
-                # specified more than once
-                # this is however not in order, the names need to be unique
-                # therefore, on load, we need to make sure there are no collisions
-                if name in reverse_map:
-                    raise ValueError("Name collision: {} is used for (at least) both URLs {} and {}".format(
-                        name, reverse_map[name], url
-                    ))
-
-                # call name checker to make sure the names are valid
-                cls._validate_name(name)
-
-                reverse_map[name] = url
+            cls._add_names(reverse_map, url, names)
 
         return reverse_map
 
     def lookup_url_for_name(self, name: str) -> str:
         """
-        Looks up a URL for a given short name.
+        Looks up a URL for a given short name. Exact names take precedence over pattern rules, which take precedence
+        over prefix rules (see :class:`redirector.trie.NameTrie`).
 
         :param name: short name
         :return: URL
         :raises KeyError: if no URL can be found
         """
 
-        return self.names_to_urls[name]
+        # the names of rules must only be matched through the trie, e.g., gh/* is the name gh/ followed by *
+        if not is_rule(name):
+            try:
+                return self.names_to_urls[name]
+
+            except KeyError:
+                pass
 
-    def lookup_names_for_url(self, url: str) -> List[str]:
+        return self.prefix_rules.lookup(name)
+
+    def match_name(self, name: str) -> Tuple[str, str]:
+        """
+        Like :meth:`lookup_url_for_name`, but also returns the key of the map entry the name has matched, i.e., the
+        name itself, or the name of the matching rule (e.g., ``gh/*``). Unlike the names, the number of keys is bounded
+        by the size of the map, so they can be used, e.g., as labels of metrics.
+
+        :param name: short name
+        :return: key of the matching map entry, and URL
+        :raises KeyError: if no URL can be found
+        """
+
+        if not is_rule(name):
+            try:
+                return name, self.names_to_urls[name]
+
+            except KeyError:
+                pass
+
+        return self.prefix_rules.match(name)
+
+    def lookup_names_for_url(self, url: str) -> Sequence[str]:
         """
         Returns the list of names assigned to a URL. Read-only.
 
         :param url: URL to look up in the data
-        :return: copy of the list of names assigned to provided URL
+        :return: copy of the list of names assigned to provided URL, or an immutable tuple in compact mode
         :raises KeyError: if no URL can be found
         """
 
-        # the only way to make this really read-only is to copy the list
-        return self.urls_to_names[url].copy()
+        names = self.urls_to_names[url]
+
+        # tuples are immutable already, so they can be handed out directly
+        if isinstance(names, tuple):
+            return names
+
+        # for lists, the only way to make this really read-only is to copy the list
+        return names.copy()
+
+
+class MapReloader(threading.Thread):
+    """
+    Background thread which rebuilds the non-database whenever the map file changes or a reload is requested
+    explicitly (e.g., by a signal handler). All the expensive work happens in this thread, off the request hot path.
+    """
+
+    def __init__(self, ext: "FlaskNonDatabase", path: str, interval: Union[float, None]):
+        """
+        :param ext: extension whose non-database shall be replaced on changes
+        :param path: path of the map file or directory to watch
+        :param interval: polling interval in seconds, ``None`` disables polling (i.e., only explicit triggers work)
+        """
+
+        super().__init__(name="redirector-map-reloader", daemon=True)
+
+        self.ext = ext
+        self.path = path
+        self.interval = interval
+
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._signature = self._stat()
+
+    def _stat(self):
+        if is_shard_directory(self.path):
+            return directory_signature(self.path)
+
+        # modification time and size are a cheap and sufficiently reliable way to detect changes to the file
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+
+        return stat.st_mtime_ns, stat.st_size
+
+    def copy(self) -> "MapReloader":
+        """
+        :return: new (not yet started) reloader with the same configuration, which knows the same version of the file
+        """
+
+        reloader = MapReloader(self.ext, self.path, self.interval)
+        reloader._signature = self._signature
+        return reloader
+
+    def trigger(self):
+        """
+        Request a reload, regardless of whether the file seems to have changed. Safe to call from signal handlers.
+        """
+
+        self._wakeup.set()
+
+    def stop(self):
+        """
+        Stop the thread, and wait for a reload which is in progress to finish.
+        """
+
+        self._stopped = True
+        self._wakeup.set()
+
+        if self.is_alive() and self is not threading.current_thread():
+            self.join()
+
+    def run(self):
+        while not self._stopped:
+            forced = self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+            if self._stopped:
+                return
+
+            signature = self._stat()
+
+            if forced or signature != self._signature:
+                self._signature = signature
+                self.ext.reload()
 
 
 class FlaskNonDatabase:
@@ -119,29 +568,193 @@ class FlaskNonDatabase:
         # initialized
         self._non_db: Union[NonDatabase, None] = None
 
+        # path the current non-database has been loaded from, used for reloading
+        self._path: Union[str, None] = None
+
+        self.reloader: Union[MapReloader, None] = None
+
+        # options passed to every non-database instance created by this extension
+        self._non_db_options = {}
+
+        # the app the extension has been initialized for, needed to run the load callbacks from the reloader thread
+        self._app: Union[Flask, None] = None
+
+        self._load_callbacks: List[Callable[[Flask, NonDatabase], None]] = []
+
+        # reload mode of the running reloader, needed to restart it in forked worker processes (see post_fork())
+        self._reload_mode: Union[str, None] = None
+
         if app is not None:
             self.init_app(app)
 
     def init_app(self, app: Flask):
-        self._non_db = NonDatabase()
+        # the extension might be initialized more than once (e.g., when creating many apps in tests), the reloader of
+        # the previous app must not keep running alongside the new one
+        if self.reloader is not None:
+            self.reloader.stop()
+            self.reloader = None
+            self._reload_mode = None
+
+        self._app = app
 
         app.config.setdefault("REDIRECTIONS_MAP_PATH", None)
+        app.config.setdefault("REDIRECTIONS_MAP_RELOAD", None)
+        app.config.setdefault("REDIRECTIONS_MAP_RELOAD_INTERVAL", "5")
+        app.config.setdefault("REDIRECTIONS_MAP_COMPACT", False)
+        app.config.setdefault("REDIRECTIONS_CHANGE_LOG_SIZE", "10000")
+        app.config.setdefault("REDIRECTIONS_MAP_LOAD_PROCESSES", None)
+        app.config.setdefault("REDIRECTIONS_MAP_BACKEND", "memory")
+        app.config.setdefault("REDIRECTIONS_MAP_CACHE_SIZE", "100000")
+        app.config.setdefault("REDIRECTIONS_MAP_SNAPSHOT_DIR", None)
+
+        load_processes = app.config["REDIRECTIONS_MAP_LOAD_PROCESSES"]
+
+        self._non_db_options = {
+            "compact": parse_flag(app.config["REDIRECTIONS_MAP_COMPACT"]),
+            "change_log_size": int(app.config["REDIRECTIONS_CHANGE_LOG_SIZE"]),
+            "load_processes": int(load_processes) if load_processes else None,
+            "backend": app.config["REDIRECTIONS_MAP_BACKEND"],
+            "cache_size": int(app.config["REDIRECTIONS_MAP_CACHE_SIZE"]),
+            "snapshot_dir": app.config["REDIRECTIONS_MAP_SNAPSHOT_DIR"] or None,
+        }
+
+        self._non_db = NonDatabase(**self._non_db_options)
 
         path = app.config["REDIRECTIONS_MAP_PATH"]
 
         if path is None:
+            self._path = "redirects.json"
+
             try:
-                self._non_db.load_data("redirects.json")
+                self._non_db.load_data(self._path)
 
             except FileNotFoundError:
                 warnings.warn("no redirections database path specified and redirects.json not found, "
                               "no static redirections available")
         else:
+            self._path = path
             self._non_db.load_data(path)
 
+        for callback in self._load_callbacks:
+            callback(app, self._non_db)
+
+        reload_mode = app.config["REDIRECTIONS_MAP_RELOAD"]
+
+        if reload_mode:
+            self._start_reloader(reload_mode, float(app.config["REDIRECTIONS_MAP_RELOAD_INTERVAL"]))
+
+    def _start_reloader(self, mode: str, interval: float):
+        if mode == "watch":
+            reloader = MapReloader(self, self._path, interval)
+
+        elif mode == "sighup":
+            reloader = MapReloader(self, self._path, None)
+
+        else:
+            raise ValueError("invalid reload mode: {}".format(mode))
+
+        self._reload_mode = mode
+        self._run_reloader(reloader)
+
+    def _handle_sighup(self, signum, frame):
+        if self.reloader is not None:
+            self.reloader.trigger()
+
+    def _run_reloader(self, reloader: MapReloader):
+        if self._reload_mode == "sighup":
+            try:
+                signal.signal(signal.SIGHUP, self._handle_sighup)
+            except ValueError:
+                # signal handlers can only be installed from the main thread
+                warnings.warn("could not install SIGHUP handler, map will not be reloaded")
+                self.reloader = None
+                return
+
+        self.reloader = reloader
+        reloader.start()
+
+    def post_fork(self):
+        """
+        Restart the reloader in a worker process which has been forked from the process the app has been created in
+        (e.g., with ``gunicorn --preload``), as threads do not survive forking. In ``sighup`` mode, the signal handler
+        is installed again, since the server might have reset the signal handlers of its workers.
+
+        This must be called from the main thread of the worker, e.g., from Gunicorn's ``post_fork`` hook (see
+        :mod:`redirector.gunicorn_config`). It is not done automatically after every fork, as not every forked process
+        is a worker (e.g., processes started by :mod:`subprocess` or :mod:`multiprocessing`).
+        """
+
+        # nothing to do if the reloader is running in this process already
+        if self.reloader is None or self.reloader.is_alive():
+            return
+
+        self._run_reloader(self.reloader.copy())
+
+    def reload(self) -> bool:
+        """
+        Build a fresh non-database from the map file (or directory) and swap it in. The new instance is only published
+        once it is fully built and validated, therefore concurrent requests either see the old or the new map, but
+        never a half-built one. If the new map is broken (e.g., contains collisions), the last good map is kept.
+
+        :return: whether the new map has been swapped in
+        """
+
+        try:
+            # for sharded maps, only the shards which have changed are parsed again
+            non_db = NonDatabase(**self._non_db_options)
+            non_db.load_data(self._path, self._non_db)
+
+            # allow clients to fetch only the changes made by this reload
+            non_db.continue_change_log(self._non_db)
+
+            for callback in self._load_callbacks:
+                callback(self._app, non_db)
+
+        except (OSError, ValueError) as e:
+            logger.error("failed to reload redirections map %s, keeping last good map: %s", self._path, e)
+            return False
+
+        except Exception:
+            # e.g., a load callback has failed, this must not kill the reloader thread, or reloading would stop for good
+            logger.exception("failed to reload redirections map %s, keeping last good map", self._path)
+            return False
+
+        # assigning an attribute is atomic, so there is no need for any locking here
+        self._non_db = non_db
+
+        logger.info("reloaded redirections map %s", self._path)
+
+        return True
+
+    def on_load(self, callback: Callable[[Flask, NonDatabase], None]):
+        """
+        Register a callback which is called with every newly loaded non-database, before it is published. This allows
+        for precomputing data derived from the map (see :attr:`NonDatabase.derived`) off the request hot path.
+
+        If the extension has been initialized already, the callback is called for the current non-database right away.
+
+        :param callback: callable accepting the app and the non-database
+        """
+
+        self._load_callbacks.append(callback)
+
+        if self._non_db is not None:
+            callback(self._app, self._non_db)
+
     @property
     def non_db(self):
         if self._non_db is None:
             raise RuntimeError("extension has not been initialized yet")
 
         return self._non_db
+
+    @property
+    def path(self) -> str:
+        """
+        :return: path the map is loaded from, which might not exist if no path has been configured
+        """
+
+        if self._path is None:
+            raise RuntimeError("extension has not been initialized yet")
+
+        return self._path
@@ -0,0 +1,233 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict, Union
+
+from flask import Flask
+
+from . import cache
+from .async_support import BackgroundThread
+from .cache_lock import acquire_lock, release_lock
+from .tiered_cache import tiered_cache
+from .util import parse_flag
+
+
+logger = logging.getLogger(__name__)
+
+
+class RefreshEntry:
+    """
+    Everything needed to recompute a cached dynamic redirection outside of a request.
+    """
+
+    __slots__ = ("key", "path", "view_args", "callback", "timeout", "value", "refresh_at", "last_hit", "last_refresh")
+
+    def __init__(self, key: str, path: str, view_args: dict, callback: Callable, timeout: float, value, now: float):
+        self.key = key
+        self.path = path
+        self.view_args = view_args
+        self.callback = callback
+        self.timeout = timeout
+
+        # last good value
+        self.value = value
+
+        self.refresh_at = now
+        self.last_hit = now
+        self.last_refresh = now
+
+
+class RefreshScheduler:
+    """
+    Re-runs the callbacks of dynamic redirections shortly before their cached values expire, so that visitors never
+    have to wait for the upstream service (stale-while-revalidate). The cached value keeps being served while a refresh
+    is in flight. If a refresh fails, the last good value keeps being served, and the refresh is retried later.
+
+    Only values which have been requested since the last refresh are refreshed, others are left to expire.
+    """
+
+    def __init__(self):
+        self.app: Union[Flask, None] = None
+
+        self.enabled = False
+
+        # seconds before the expiry at which a value is refreshed, also used as the retry interval
+        self.margin = 10.0
+
+        self._entries: Dict[str, RefreshEntry] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+        self._thread = BackgroundThread(self._run, "redirector-refresh-scheduler")
+
+    def init_app(self, app: Flask):
+        app.config.setdefault("DYNAMIC_REDIRECTS_REFRESH", False)
+        app.config.setdefault("DYNAMIC_REDIRECTS_REFRESH_MARGIN", "10")
+
+        self.app = app
+        self.enabled = parse_flag(app.config["DYNAMIC_REDIRECTS_REFRESH"])
+        self.margin = float(app.config["DYNAMIC_REDIRECTS_REFRESH_MARGIN"])
+
+        with self._lock:
+            self._entries.clear()
+
+    def _margin_for(self, timeout: float) -> float:
+        # for short timeouts, refresh after half the timeout at the latest
+        return min(self.margin, timeout / 2)
+
+    def track(self, key: str, path: str, view_args: dict, callback: Callable, timeout: float, value):
+        """
+        Register a freshly computed value, so that it is refreshed before it expires.
+        """
+
+        if not self.enabled:
+            return
+
+        now = time.monotonic()
+
+        entry = RefreshEntry(key, path, view_args, callback, timeout, value, now)
+        entry.refresh_at = now + timeout - self._margin_for(timeout)
+
+        with self._lock:
+            self._entries[key] = entry
+
+        self._thread.ensure_started()
+        self._wakeup.set()
+
+    def hit(self, key: str):
+        """
+        Record that a cached value has been served.
+        """
+
+        entry = self._entries.get(key)
+
+        if entry is not None:
+            entry.last_hit = time.monotonic()
+
+    def last_good_value(self, key: str):
+        """
+        :return: last good value for a key, or None if there is none
+        """
+
+        entry = self._entries.get(key)
+
+        if entry is None:
+            return None
+
+        return entry.value
+
+    def _refreshed_key(self, entry: RefreshEntry) -> str:
+        return "{}/refreshed".format(entry.key)
+
+    def refresh(self, entry: RefreshEntry) -> bool:
+        """
+        Recompute a value and store it in the cache. If that fails, the last good value is stored again.
+
+        Every process refreshes the values it has computed, but like cache misses, refreshes are coordinated through
+        the cache backend, so only one process calls the callback per refresh. The other processes skip the refresh,
+        and pick up the refreshed value from the cache.
+
+        :return: whether the value has been recomputed by this process
+        """
+
+        now = time.monotonic()
+
+        # the callback might need the request context, and the cache needs the app context
+        with self.app.test_request_context(entry.path):
+            lock_key = "{}/lock".format(entry.key)
+            token = None
+
+            # the marker is set for the time until the next refresh is due, the lock while the value is recomputed
+            if cache.get(self._refreshed_key(entry)) is None:
+                token = acquire_lock(lock_key, int(self.app.config["DYNAMIC_REDIRECTS_LOCK_TIMEOUT"]))
+
+            if token is None:
+                value = cache.get(entry.key)
+
+                if value is not None:
+                    entry.value = value
+
+                # check again soon, in case the other process fails
+                entry.refresh_at = now + self._margin_for(entry.timeout)
+
+                return False
+
+            entry.last_refresh = now
+
+            try:
+                value = entry.callback(**entry.view_args)
+
+            except Exception:
+                logger.exception("failed to refresh dynamic redirection %s, serving last good value", entry.path)
+
+                tiered_cache.set(entry.key, entry.value, entry.timeout)
+                entry.refresh_at = now + self._margin_for(entry.timeout)
+
+                return False
+
+            else:
+                tiered_cache.set(entry.key, value, entry.timeout)
+
+                next_refresh_in = entry.timeout - self._margin_for(entry.timeout)
+                cache.set(self._refreshed_key(entry), True, timeout=max(1, int(next_refresh_in)))
+
+            finally:
+                release_lock(lock_key, token)
+
+        entry.value = value
+        entry.refresh_at = now + next_refresh_in
+
+        return True
+
+    def refresh_due(self, now: Union[float, None] = None) -> float:
+        """
+        Refresh all values which are due.
+
+        :param now: current time as returned by :func:`time.monotonic`
+        :return: time at which the next refresh is due
+        """
+
+        if now is None:
+            now = time.monotonic()
+
+        with self._lock:
+            entries = list(self._entries.values())
+
+        next_refresh_at = now + self.margin
+
+        for entry in entries:
+            if entry.refresh_at > now:
+                next_refresh_at = min(next_refresh_at, entry.refresh_at)
+                continue
+
+            # values nobody has asked for since the last refresh are left to expire
+            if entry.last_hit < entry.last_refresh:
+                with self._lock:
+                    if self._entries.get(entry.key) is entry:
+                        del self._entries[entry.key]
+
+                continue
+
+            self.refresh(entry)
+            next_refresh_at = min(next_refresh_at, entry.refresh_at)
+
+        return next_refresh_at
+
+    def _run(self):
+        while True:
+            # notifications arriving while refreshing must not get lost, so they are only discarded before refreshing
+            self._wakeup.clear()
+
+            try:
+                next_refresh_at = self.refresh_due()
+
+            except Exception:
+                # the scheduler must keep running, otherwise values would silently stop being refreshed
+                logger.exception("failed to refresh dynamic redirections")
+                next_refresh_at = time.monotonic() + self.margin
+
+            self._wakeup.wait(max(0.0, next_refresh_at - time.monotonic()))
+
+
+# global scheduler instance, like the other extensions
+refresh_scheduler = RefreshScheduler()
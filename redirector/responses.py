@@ -0,0 +1,384 @@
+import datetime
+import gzip
+import hashlib
+import io
+import json as stdlib_json
+import os
+import re
+import threading
+import time
+from typing import Iterable, List, Tuple, Union
+
+from flask import Flask, json
+from werkzeug.urls import iri_to_uri
+from werkzeug.wsgi import FileWrapper
+
+try:
+    import brotli
+
+except ImportError:
+    brotli = None
+
+from .non_database import NonDatabase
+from .util import file_lock
+
+
+Header = Tuple[str, str]
+
+# characters which are valid in the path, query and fragment of URIs, and are not quoted by iri_to_uri
+_uri_chars = r"\-A-Za-z0-9._~!$&'()*+,/:;=@%"
+
+# URLs which iri_to_uri returns unchanged (ASCII only, a lowercase host name, no port or credentials, and no characters
+# which need quoting), converting the URLs of large maps with iri_to_uri takes several seconds
+_plain_uri = re.compile(
+    r"https?://[a-z0-9-]+(?:\.[a-z0-9-]+)*\.?(?:/[" + _uri_chars + r"]*)?(?:\?[" + _uri_chars + r"?]+)?"
+    r"(?:#[" + _uri_chars + r"?#]+)?"
+)
+
+
+def is_plain_uri(url: str) -> bool:
+    """
+    :return: whether :func:`werkzeug.urls.iri_to_uri` would return the URL unchanged
+    """
+
+    return _plain_uri.fullmatch(url) is not None
+
+
+def to_uri(url: str) -> str:
+    """
+    Convert a URL, which may contain any Unicode characters (i.e., an IRI), into a URI, like
+    :func:`werkzeug.urls.iri_to_uri`.
+    """
+
+    if is_plain_uri(url):
+        return url
+
+    return iri_to_uri(url)
+
+
+class StaticRedirectResponses:
+    """
+    Status line and headers of the responses for static redirections. These only depend on the map and the
+    configuration, so they can be computed once per map instead of once per request.
+
+    For maps held in dicts, the Location headers are computed eagerly for all URLs. Compact and compiled maps are meant
+    to keep the memory usage low, therefore the headers are computed on demand for those.
+    """
+
+    def __init__(self, non_db: NonDatabase, max_age: Union[str, int, None]):
+        """
+        :param non_db: non-database to compute the responses for
+        :param max_age: value of ``STATIC_REDIRECTIONS_MAX_AGE``
+        """
+
+        self.non_db = non_db
+
+        # the raw value is kept to detect configuration changes
+        self.max_age = max_age
+
+        # depending on the configuration, we either return a "permanent" redirect with a small cache timeout, or a
+        # "temporary" one
+        max_age = int(max_age) if max_age else 0
+
+        if max_age > 0:
+            self.status = "301 MOVED PERMANENTLY"
+            self._extra_headers = [("Cache-Control", "max-age={}".format(max_age))]
+
+        else:
+            self.status = "302 FOUND"
+            self._extra_headers = []
+
+        self._location_headers = None
+
+        if isinstance(non_db.urls_to_names, dict):
+            self._location_headers = {url: self._make_location_header(url) for url in non_db.urls_to_names}
+
+    @staticmethod
+    def _make_location_header(url: str) -> Header:
+        return "Location", to_uri(url)
+
+    def headers_for_name(self, name: str) -> List[Header]:
+        """
+        Look up the headers of the redirect response for a name.
+
+        :param name: short name
+        :return: headers, a new list which may be modified by the caller
+        :raises KeyError: if the name is not known
+        """
+
+        return self.match_name(name)[1]
+
+    def match_name(self, name: str) -> Tuple[str, List[Header]]:
+        """
+        Like :meth:`headers_for_name`, but also returns the key of the map entry the name has matched (see
+        :meth:`redirector.non_database.NonDatabase.match_name`).
+
+        :param name: short name
+        :return: key of the matching map entry, and headers, a new list which may be modified by the caller
+        :raises KeyError: if the name is not known
+        """
+
+        key, url = self.non_db.match_name(name)
+
+        location_header = None
+
+        # the URLs of prefix rules depend on the name, so they are not precomputed
+        if self._location_headers is not None:
+            location_header = self._location_headers.get(url)
+
+        if location_header is None:
+            location_header = self._make_location_header(url)
+
+        return key, [location_header] + self._extra_headers
+
+
+def compute_static_redirect_responses(app: Flask, non_db: NonDatabase) -> StaticRedirectResponses:
+    """
+    Compute the responses for a non-database and store them in its derived data.
+
+    Can be registered as a load callback of :class:`redirector.non_database.FlaskNonDatabase`.
+    """
+
+    responses = StaticRedirectResponses(non_db, app.config["STATIC_REDIRECTIONS_MAX_AGE"])
+    non_db.derived[StaticRedirectResponses] = responses
+    return responses
+
+
+def get_static_redirect_responses(app: Flask, non_db: NonDatabase) -> StaticRedirectResponses:
+    """
+    Get the precomputed responses for a non-database. They are recomputed if the configuration has changed.
+    """
+
+    responses = non_db.derived.get(StaticRedirectResponses)
+
+    if responses is None or responses.max_age != app.config["STATIC_REDIRECTIONS_MAX_AGE"]:
+        responses = compute_static_redirect_responses(app, non_db)
+
+    return responses
+
+
+class SerializedMap:
+    """
+    The map serialized as JSON for the HTTP API, along with precompressed variants and validators for conditional
+    requests. Serializing large maps is expensive, so this is done only once per map.
+    """
+
+    def __init__(self, non_db: NonDatabase):
+        # compiled maps provide a read-only mapping instead of a dict, which cannot be serialized directly
+        self.body: bytes = json.dumps(dict(non_db.urls_to_names)).encode()
+
+        # the ETag only depends on the data, so that it is the same in all processes
+        # the compressed variants are semantically equivalent, so they share a weak ETag
+        self.etag = hashlib.sha1(self.body).hexdigest()
+
+        # empty non-databases have never been modified, so we use the current time for those
+        last_modified = non_db.last_modified if non_db.last_modified is not None else time.time()
+        self.last_modified = datetime.datetime.fromtimestamp(last_modified, datetime.timezone.utc)
+
+        # content encoding -> body
+        self.encoded_bodies = {
+            "gzip": self._gzip(self.body),
+        }
+
+        if brotli is not None:
+            self.encoded_bodies["br"] = brotli.compress(self.body)
+
+    @staticmethod
+    def _gzip(data: bytes) -> bytes:
+        # the timestamp is set to a fixed value, so that all processes produce the same bytes
+        buffer = io.BytesIO()
+
+        with gzip.GzipFile(fileobj=buffer, mode="wb", compresslevel=9, mtime=0) as f:
+            f.write(data)
+
+        return buffer.getvalue()
+
+    @property
+    def encodings(self) -> List[str]:
+        """
+        :return: content encodings of the precompressed variants
+        """
+
+        return list(self.encoded_bodies)
+
+    def get_body(self, encoding: Union[str, None] = None) -> Union[bytes, Iterable[bytes]]:
+        """
+        :param encoding: content encoding, or None for the uncompressed body
+        :return: the body
+        """
+
+        if encoding is None:
+            return self.body
+
+        return self.encoded_bodies[encoding]
+
+
+class SerializedMapFiles:
+    """
+    The map serialized like :class:`SerializedMap`, for maps stored in a SQLite database. The JSON and its precompressed
+    variants are written once to files next to the database, entry by entry, and streamed from there, so the map is
+    never loaded into memory. The files are shared by all processes which use the same database.
+    """
+
+    # number of entries serialized at once
+    batch_size = 1000
+
+    # size of the chunks in which the files are streamed
+    chunk_size = 64 * 1024
+
+    def __init__(self, non_db: NonDatabase):
+        self.sqlite_map = non_db.sqlite_map
+
+        # the files are named after the version, so that maps which are replaced while they are served do not mix
+        self.path = "{}.{}.json".format(self.sqlite_map.filename, self.sqlite_map.version)
+
+        # content encoding -> path
+        self.encoded_paths = {
+            "gzip": self.path + ".gz",
+        }
+
+        if brotli is not None:
+            self.encoded_paths["br"] = self.path + ".br"
+
+        # the files are the same in all processes, so the ETag can be derived from the version instead of the data
+        self.etag = hashlib.sha1("sqlite-map-{}".format(self.sqlite_map.version).encode()).hexdigest()
+
+        last_modified = non_db.last_modified if non_db.last_modified is not None else time.time()
+        self.last_modified = datetime.datetime.fromtimestamp(last_modified, datetime.timezone.utc)
+
+        self._ensure_files()
+
+    @property
+    def encodings(self) -> List[str]:
+        """
+        :return: content encodings of the precompressed variants
+        """
+
+        return list(self.encoded_paths)
+
+    def get_body(self, encoding: Union[str, None] = None) -> Iterable[bytes]:
+        """
+        :param encoding: content encoding, or None for the uncompressed body
+        :return: the body, in chunks read from the file
+        """
+
+        path = self.path if encoding is None else self.encoded_paths[encoding]
+
+        try:
+            f = open(path, "rb")
+
+        except FileNotFoundError:
+            # the files of outdated versions are removed when a newer version is serialized
+            self._ensure_files()
+            f = open(path, "rb")
+
+        # the file is opened right away, so that the body is complete even if the file is removed meanwhile
+        return FileWrapper(f, self.chunk_size)
+
+    def _paths(self) -> List[str]:
+        return [self.path] + list(self.encoded_paths.values())
+
+    def _ensure_files(self):
+        if all(os.path.exists(path) for path in self._paths()):
+            return
+
+        # the other processes wait for the one which serializes the map, and then use its files
+        with file_lock(self.sqlite_map.filename + ".json.lock"):
+            if not all(os.path.exists(path) for path in self._paths()):
+                self._write_files()
+                self._remove_outdated_files()
+
+    def _write_files(self):
+        tmp_suffix = ".tmp{}".format(os.getpid())
+        tmp_paths = [path + tmp_suffix for path in self._paths()]
+
+        try:
+            with open(tmp_paths[0], "wb") as plain, open(tmp_paths[1], "wb") as gzip_file:
+                # the file name and timestamp are omitted, so that the data does not depend on the process
+                with gzip.GzipFile(filename="", fileobj=gzip_file, mode="wb", compresslevel=9, mtime=0) as gzipped:
+                    brotli_file = open(tmp_paths[2], "wb") if brotli is not None else None
+                    compressor = brotli.Compressor() if brotli is not None else None
+
+                    try:
+                        for data in self._serialize():
+                            plain.write(data)
+                            gzipped.write(data)
+
+                            if compressor is not None:
+                                brotli_file.write(compressor.process(data))
+
+                        if compressor is not None:
+                            brotli_file.write(compressor.finish())
+
+                    finally:
+                        if brotli_file is not None:
+                            brotli_file.close()
+
+            # the uncompressed file is moved last, since the others are only checked if it exists
+            for tmp_path, path in reversed(list(zip(tmp_paths, self._paths()))):
+                os.replace(tmp_path, path)
+
+        except BaseException:
+            for tmp_path in tmp_paths:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+
+            raise
+
+    def _serialize(self) -> Iterable[bytes]:
+        # produces the same JSON as json.dumps(dict(urls_to_names)) with the default separators, in the order of the
+        # database
+        parts = ["{"]
+
+        for i, (url, names) in enumerate(self.sqlite_map.urls_to_names.items()):
+            parts.append("{}{}: {}".format(", " if i else "", stdlib_json.dumps(url), stdlib_json.dumps(list(names))))
+
+            if len(parts) >= self.batch_size:
+                yield "".join(parts).encode()
+                parts = []
+
+        parts.append("}")
+        yield "".join(parts).encode()
+
+    def _remove_outdated_files(self):
+        directory, filename = os.path.split(os.path.abspath(self.sqlite_map.filename))
+        current = {os.path.basename(path) for path in self._paths()}
+        pattern = re.compile(re.escape(filename) + r"\.\d+\.json(?:\.gz|\.br)?")
+
+        for entry in os.listdir(directory):
+            if pattern.fullmatch(entry) and entry not in current:
+                try:
+                    os.unlink(os.path.join(directory, entry))
+
+                except FileNotFoundError:
+                    pass
+
+
+_serialized_map_lock = threading.Lock()
+
+
+def get_serialized_map(non_db: NonDatabase) -> Union[SerializedMap, SerializedMapFiles]:
+    """
+    Get the serialized map for a non-database. It is computed on first use, since it is only needed by clients of the
+    API. Maps stored in a SQLite database are serialized to files (see :class:`SerializedMapFiles`).
+
+    Requires an app context.
+    """
+
+    serialized_map = non_db.derived.get(SerializedMap)
+
+    if serialized_map is None:
+        # concurrent requests should not serialize the same map more than once
+        with _serialized_map_lock:
+            serialized_map = non_db.derived.get(SerializedMap)
+
+            if serialized_map is None:
+                if non_db.sqlite_map is not None:
+                    serialized_map = SerializedMapFiles(non_db)
+
+                else:
+                    serialized_map = SerializedMap(non_db)
+
+                non_db.derived[SerializedMap] = serialized_map
+
+    return serialized_map
@@ -0,0 +1,192 @@
+import threading
+from array import array
+from collections import defaultdict
+from typing import Dict, Iterable, List, Sequence, Set, Tuple, Union
+
+from flask import Flask
+
+from .non_database import NonDatabase
+from .sqlite_map import SqliteMap
+
+
+# separates the URL and names of an entry, and marks the beginning and end, so that strings shorter than three
+# characters also produce trigrams
+# names cannot contain control characters in practice, so the separator cannot be confused with the actual data
+_SEPARATOR = "\x00"
+
+
+def _trigrams(strings: Sequence[str]) -> Set[str]:
+    # joining the strings first is a lot faster than computing the trigrams of every string on its own
+    # the trigrams spanning two strings are not needed, but do not cause any harm either
+    text = "{0}{1}{0}".format(_SEPARATOR, _SEPARATOR.join(strings).lower())
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _query_trigrams(query: str) -> Set[str]:
+    # queries may match anywhere within a string, so they must not be padded
+    return {query[i:i + 3] for i in range(len(query) - 2)}
+
+
+class SearchIndex:
+    """
+    Trigram index over the URLs and names of a map, which allows for case-insensitive substring searches without
+    scanning the entire map.
+
+    Every URL is identified by its position in the map. For every trigram, the index stores the sorted positions of all
+    URLs which contain the trigram in the URL itself or in one of their names. A search intersects the lists of the
+    query's trigrams, and verifies the remaining candidates.
+    """
+
+    def __init__(self, non_db: NonDatabase):
+        self.non_db = non_db
+
+        # URLs in map order, the position in this tuple is used as an ID
+        self.urls: Tuple[str, ...] = tuple(non_db.urls_to_names)
+
+        # the trigram index is rather expensive, so it is only built once the first search is made
+        self._postings: Dict[str, array] = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.urls)
+
+    def _build_postings(self) -> Dict[str, array]:
+        postings = defaultdict(lambda: array("I"))
+
+        for url_id, (url, names) in enumerate(self.non_db.urls_to_names.items()):
+            for trigram in _trigrams([url, *names]):
+                postings[trigram].append(url_id)
+
+        return dict(postings)
+
+    @property
+    def postings(self) -> Dict[str, array]:
+        if self._postings is None:
+            with self._lock:
+                if self._postings is None:
+                    self._postings = self._build_postings()
+
+        return self._postings
+
+    def _candidates(self, query: str) -> Iterable[int]:
+        postings = self.postings
+
+        trigrams = _query_trigrams(query)
+
+        if not trigrams:
+            # for queries shorter than three characters, we look for the query in the (comparably small) set of
+            # trigrams instead
+            url_ids = set()
+
+            for trigram, url_ids_for_trigram in postings.items():
+                if query in trigram:
+                    url_ids.update(url_ids_for_trigram)
+
+            return sorted(url_ids)
+
+        # start with the shortest list to keep the intermediate sets small
+        lists = sorted((postings.get(trigram, ()) for trigram in trigrams), key=len)
+
+        url_ids = set(lists[0])
+
+        for url_ids_for_trigram in lists[1:]:
+            if not url_ids:
+                break
+
+            url_ids.intersection_update(url_ids_for_trigram)
+
+        return sorted(url_ids)
+
+    def search(self, query: str) -> List[int]:
+        """
+        Search for URLs which contain the query, or have a name which contains the query. Case-insensitive.
+
+        :param query: search query
+        :return: IDs of the matching URLs, in map order
+        """
+
+        query = query.lower()
+
+        if not query:
+            return list(range(len(self.urls)))
+
+        result = []
+
+        # trigrams only narrow down the candidates, e.g., a URL matching "abc" and "bcd" does not necessarily contain
+        # "abcd", so the candidates need to be checked
+        for url_id in self._candidates(query):
+            url = self.urls[url_id]
+
+            if query in url.lower() or any(query in name.lower() for name in self.non_db.urls_to_names[url]):
+                result.append(url_id)
+
+        return result
+
+    def entries(self, url_ids: Iterable[int]) -> List[Tuple[str, Sequence[str]]]:
+        """
+        :return: URLs and their names for the given IDs
+        """
+
+        return [(self.urls[url_id], self.non_db.urls_to_names[self.urls[url_id]]) for url_id in url_ids]
+
+
+class SqliteSearchIndex:
+    """
+    Same interface as :class:`SearchIndex` for maps stored in a SQLite database, which answers searches with queries
+    instead of building an index in memory, so the map never needs to be loaded entirely.
+    """
+
+    def __init__(self, sqlite_map: SqliteMap):
+        self.sqlite_map = sqlite_map
+
+    def __len__(self):
+        return self.sqlite_map.urls_count
+
+    def search(self, query: str) -> List[int]:
+        """
+        Search for URLs which contain the query, or have a name which contains the query. Case-insensitive.
+
+        :param query: search query
+        :return: IDs of the matching URLs, in map order
+        """
+
+        query = query.lower()
+
+        if not query:
+            return list(range(len(self)))
+
+        return self.sqlite_map.search_urls(query)
+
+    def entries(self, url_ids: Iterable[int]) -> List[Tuple[str, Sequence[str]]]:
+        """
+        :return: URLs and their names for the given IDs
+        """
+
+        urls = self.sqlite_map.find_urls(list(url_ids))
+
+        return [(url, self.sqlite_map.urls_to_names[url]) for url in urls]
+
+
+def compute_search_index(app: Flask, non_db: NonDatabase) -> Union[SearchIndex, SqliteSearchIndex]:
+    """
+    Create the search index for a non-database and store it in its derived data.
+
+    Can be registered as a load callback of :class:`redirector.non_database.FlaskNonDatabase`.
+    """
+
+    if non_db.sqlite_map is not None:
+        search_index = SqliteSearchIndex(non_db.sqlite_map)
+    else:
+        search_index = SearchIndex(non_db)
+
+    non_db.derived[SearchIndex] = search_index
+    return search_index
+
+
+def get_search_index(app: Flask, non_db: NonDatabase) -> Union[SearchIndex, SqliteSearchIndex]:
+    search_index = non_db.derived.get(SearchIndex)
+
+    if search_index is None:
+        search_index = compute_search_index(app, non_db)
+
+    return search_index
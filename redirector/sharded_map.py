@@ -0,0 +1,210 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from collections.abc import Mapping
+from typing import Callable, Dict, List, Tuple, Union
+
+from .trie import is_rule
+
+
+# modification time in nanoseconds and size, a cheap and sufficiently reliable way to detect changes to a file
+Signature = Tuple[int, int]
+
+
+class Shard:
+    """
+    A single JSON file of a sharded map, parsed and validated on its own.
+
+    Once merged, the mappings of a shard are contained in the merged map, so keeping them would store every entry
+    twice. Shards which are kept to be reused on reloads are therefore stripped down to the URLs they define (see
+    :meth:`strip`), and their mappings are restored from the merged map when needed (see :meth:`restore`).
+    """
+
+    __slots__ = ("filename", "signature", "urls_to_names", "names_to_urls", "urls", "rules")
+
+    def __init__(self, filename: str, signature: Signature, urls_to_names: Union[dict, None],
+                 names_to_urls: Union[dict, None], rules: Union[List[Tuple[str, str]], None] = None,
+                 urls: Union[Tuple[str, ...], None] = None):
+        self.filename = filename
+        self.signature = signature
+        self.urls_to_names = urls_to_names
+        self.names_to_urls = names_to_urls
+
+        # URLs defined by a stripped shard, the strings are shared with the merged map, so this costs one reference each
+        self.urls = urls
+
+        # rules are rare, so collecting them per shard saves scanning all names of the merged map for them
+        if rules is None:
+            rules = [(name, url) for name, url in names_to_urls.items() if is_rule(name)]
+
+        self.rules: List[Tuple[str, str]] = rules
+
+    def strip(self) -> "Shard":
+        """
+        :return: copy of the shard which only keeps its signature, rules and the URLs it defines
+        """
+
+        return Shard(self.filename, self.signature, None, None, self.rules, tuple(self.urls_to_names))
+
+    def restore(self, merged_urls_to_names: Mapping) -> "Shard":
+        """
+        Rebuild the mappings of a stripped shard. The shard has been validated when it was loaded, so this is a lot
+        cheaper than parsing it again.
+
+        :param merged_urls_to_names: URLs-to-names mapping of the map the shard has been merged into
+        :return: copy of the shard including its mappings
+        """
+
+        urls_to_names = {url: merged_urls_to_names[url] for url in self.urls}
+        names_to_urls = {name: url for url, names in urls_to_names.items() for name in names}
+
+        return Shard(self.filename, self.signature, urls_to_names, names_to_urls, self.rules)
+
+
+def is_shard_directory(path) -> bool:
+    return isinstance(path, str) and os.path.isdir(path)
+
+
+def list_shards(directory: str) -> Dict[str, Signature]:
+    """
+    :param directory: directory containing the shards
+    :return: paths of all shards in the directory, along with their signatures
+    """
+
+    shards = {}
+
+    for entry in os.scandir(directory):
+        # hidden files are skipped, so that editors' temporary files or files which are about to be moved into place
+        # atomically are not picked up
+        if entry.name.startswith(".") or not entry.name.endswith(".json") or not entry.is_file():
+            continue
+
+        stat = entry.stat()
+        shards[entry.path] = (stat.st_mtime_ns, stat.st_size)
+
+    return shards
+
+
+def directory_signature(directory: str) -> Union[Tuple, None]:
+    """
+    :return: value which changes whenever a shard is added, removed or modified, or None if the directory is missing
+    """
+
+    try:
+        return tuple(sorted(list_shards(directory).items()))
+    except OSError:
+        return None
+
+
+def _load_shard(load_file: Callable, filename: str) -> Shard:
+    urls_to_names, names_to_urls, stat = load_file(filename)
+    return Shard(filename, (stat.st_mtime_ns, stat.st_size), urls_to_names, names_to_urls)
+
+
+def load_shards(directory: str, load_file: Callable, previous: Union[Dict[str, Shard], None] = None,
+                processes: Union[int, None] = None,
+                previous_urls_to_names: Union[Mapping, None] = None) -> Dict[str, Shard]:
+    """
+    Load all shards in a directory. Shards which have not changed since they have been loaded previously are reused.
+    The other ones are parsed in parallel by a pool of worker processes.
+
+    :param directory: directory containing the shards
+    :param load_file: function parsing and validating a single file (see :meth:`NonDatabase._load_file`), must be
+        picklable
+    :param previous: previously loaded shards, which may have been stripped (see :meth:`Shard.strip`)
+    :param processes: maximum number of worker processes, defaults to the number of CPUs, 1 disables the pool
+    :param previous_urls_to_names: merged map of the previously loaded shards, needed to restore stripped shards
+    :return: shards by path
+    """
+
+    if previous is None:
+        previous = {}
+
+    shards = {}
+    changed_filenames = []
+
+    for filename, signature in list_shards(directory).items():
+        previous_shard = previous.get(filename)
+
+        if previous_shard is not None and previous_shard.signature == signature:
+            if previous_shard.urls_to_names is None:
+                previous_shard = previous_shard.restore(previous_urls_to_names)
+
+            shards[filename] = previous_shard
+        else:
+            changed_filenames.append(filename)
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    processes = min(processes, len(changed_filenames))
+
+    if processes <= 1:
+        for filename in changed_filenames:
+            shards[filename] = _load_shard(load_file, filename)
+
+    else:
+        # this is usually called from the reloader thread, and forking a process with multiple threads is not safe
+        with ProcessPoolExecutor(processes, mp_context=get_context("spawn")) as executor:
+            loaded_shards = executor.map(_load_shard, [load_file] * len(changed_filenames), changed_filenames)
+
+            for shard in loaded_shards:
+                shards[shard.filename] = shard
+
+    return shards
+
+
+def _find_collision(shards: Dict[str, Shard], shard: Shard, attribute: str) -> Tuple[str, Shard]:
+    # only called once a collision is known to exist, so speed does not matter here
+    for key in getattr(shard, attribute):
+        for other_shard in shards.values():
+            if key in getattr(other_shard, attribute):
+                return key, other_shard
+
+    raise AssertionError("no collision found")
+
+
+def merge_shards(shards: Dict[str, Shard]) -> Tuple[dict, dict, List[Tuple[str, str]]]:
+    """
+    Merge shards into a single map. Every name and every URL may only be defined in one shard.
+
+    :param shards: shards to merge
+    :return: URLs-to-names and names-to-URLs mappings, and the rules (see :class:`redirector.trie.NameTrie`)
+    :raises ValueError: if a name or URL is defined in more than one shard
+    """
+
+    urls_to_names = {}
+    names_to_urls = {}
+    rules = []
+
+    # updating the dicts is a lot faster than inserting the entries one by one, and collisions can be detected by
+    # comparing the sizes
+    merged_shards = {}
+
+    for filename in sorted(shards):
+        shard = shards[filename]
+
+        names_count = len(names_to_urls)
+        names_to_urls.update(shard.names_to_urls)
+
+        if len(names_to_urls) != names_count + len(shard.names_to_urls):
+            name, other_shard = _find_collision(merged_shards, shard, "names_to_urls")
+
+            raise ValueError("Name collision: {} is used for (at least) both URLs {} ({}) and {} ({})".format(
+                name, other_shard.names_to_urls[name], other_shard.filename, shard.names_to_urls[name], filename
+            ))
+
+        urls_count = len(urls_to_names)
+        urls_to_names.update(shard.urls_to_names)
+
+        if len(urls_to_names) != urls_count + len(shard.urls_to_names):
+            url, other_shard = _find_collision(merged_shards, shard, "urls_to_names")
+
+            raise ValueError("URL collision: {} is defined in both {} and {}".format(
+                url, other_shard.filename, filename
+            ))
+
+        rules += shard.rules
+        merged_shards[filename] = shard
+
+    return urls_to_names, names_to_urls, rules
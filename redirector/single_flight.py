@@ -0,0 +1,82 @@
+import threading
+from typing import Callable, Dict, Union
+
+
+class FlightTimeout(Exception):
+    """
+    Raised if the running computation a caller waits for has not finished in time.
+    """
+
+
+class _Flight:
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Makes sure a computation runs only once at a time per key within a process. Callers asking for a key which is being
+    computed already wait for the running computation and share its result (or exception).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: Dict[str, _Flight] = {}
+
+        # number of computations which have actually been run
+        self.computed = 0
+
+        # number of callers which have shared the result of a running computation
+        self.coalesced = 0
+
+    def do(self, key: str, fn: Callable, timeout: Union[float, None] = None):
+        """
+        Run fn, unless a computation for the key is running already, in which case its result is returned.
+
+        :param key: key identifying the computation
+        :param fn: computation
+        :param timeout: seconds to wait for a running computation, raises :class:`FlightTimeout` if it has not finished
+            by then, None waits indefinitely
+        :return: result of the computation
+        """
+
+        with self._lock:
+            flight = self._flights.get(key)
+
+            if flight is None:
+                flight = _Flight()
+                self._flights[key] = flight
+                self.computed += 1
+                leader = True
+
+            else:
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            if not flight.done.wait(timeout):
+                raise FlightTimeout("computation of {} has not finished within {} seconds".format(key, timeout))
+
+            if flight.error is not None:
+                raise flight.error
+
+            return flight.value
+
+        try:
+            flight.value = fn()
+
+        except BaseException as e:
+            flight.error = e
+            raise
+
+        finally:
+            with self._lock:
+                del self._flights[key]
+
+            flight.done.set()
+
+        return flight.value
@@ -0,0 +1,113 @@
+import hashlib
+import logging
+import os
+import pickle
+from typing import List, Tuple, Union
+
+
+logger = logging.getLogger(__name__)
+
+
+# format of the snapshots, must be incremented whenever their contents or the validation rules change
+FORMAT_VERSION = 2
+
+# size of the chunks read while hashing a file
+_CHUNK_SIZE = 1024 * 1024
+
+# URLs-to-names mapping, names-to-URLs mapping, and rules
+SnapshotData = Tuple[dict, dict, List[Tuple[str, str]]]
+
+
+def file_digest(f) -> str:
+    """
+    :param f: file opened in binary mode, which is read from the current position to the end
+    :return: SHA-256 hash of the file's contents
+    """
+
+    digest = hashlib.sha256()
+
+    for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+        digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def _prefix(source: str) -> str:
+    # snapshots of different map files may share the same directory
+    return hashlib.sha256(os.path.abspath(source).encode()).hexdigest()[:16]
+
+
+def snapshot_path(directory: str, source: str, digest: str) -> str:
+    """
+    :param directory: directory containing the snapshots
+    :param source: path of the map file
+    :param digest: hash of the map file's contents (see :func:`file_digest`)
+    :return: path of the snapshot of the map file with the given contents
+    """
+
+    return os.path.join(directory, "{}-{}.pickle".format(_prefix(source), digest))
+
+
+def load_snapshot(directory: str, source: str, digest: str) -> Union[SnapshotData, None]:
+    """
+    Load the snapshot of a map file, if there is one for its current contents.
+
+    :return: the validated data, or None if there is no usable snapshot
+    """
+
+    path = snapshot_path(directory, source, digest)
+
+    try:
+        with open(path, "rb") as f:
+            format_version, data = pickle.load(f)
+
+    except FileNotFoundError:
+        return None
+
+    except Exception as e:
+        # a broken snapshot is not a problem, the map is just loaded from the source
+        logger.warning("could not load snapshot %s, ignoring it: %s", path, e)
+        return None
+
+    if format_version != FORMAT_VERSION:
+        return None
+
+    return data
+
+
+def write_snapshot(directory: str, source: str, digest: str, data: SnapshotData):
+    """
+    Store the validated data of a map file, so that other processes (and future starts) can skip parsing and
+    validating the file. Snapshots of previous contents of the same file are removed.
+
+    The snapshot is written to a temporary file first, then moved into place atomically, so other processes never
+    read a partially written snapshot. Errors are logged, but not raised, as the snapshot is just an optimization.
+    """
+
+    path = snapshot_path(directory, source, digest)
+    tmp_path = "{}.tmp{}".format(path, os.getpid())
+
+    try:
+        os.makedirs(directory, exist_ok=True)
+
+        with open(tmp_path, "wb") as f:
+            pickle.dump((FORMAT_VERSION, data), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.replace(tmp_path, path)
+
+        prefix = "{}-".format(_prefix(source))
+
+        for entry in os.scandir(directory):
+            if entry.name.startswith(prefix) and entry.name.endswith(".pickle") and entry.path != path:
+                try:
+                    os.unlink(entry.path)
+
+                # another process might have removed it already
+                except FileNotFoundError:
+                    pass
+
+    except OSError as e:
+        logger.warning("could not write snapshot %s: %s", path, e)
+
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
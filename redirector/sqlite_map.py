@@ -0,0 +1,385 @@
+import functools
+import os
+import sqlite3
+import threading
+from collections.abc import ItemsView, Mapping
+from typing import Callable, Iterable, Iterator, List, Sequence, Tuple, Union
+from urllib.request import pathname2url
+
+from .trie import is_rule
+
+
+# every SQLite database starts with this header
+MAGIC = b"SQLite format 3\x00"
+
+# format of the database, must be incremented whenever the schema or the validation rules change
+FORMAT_VERSION = 2
+
+_schema = """
+CREATE TABLE meta (
+    key TEXT PRIMARY KEY,
+    value
+);
+
+CREATE TABLE urls (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE names (
+    name TEXT PRIMARY KEY,
+    url_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    is_rule INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+# number of rows fetched at once when iterating over the map
+_FETCH_SIZE = 1000
+
+
+def is_sqlite_map(filename: str) -> bool:
+    """
+    Check whether a file contains a SQLite map.
+
+    :param filename: path of the file to check
+    :return: whether the file contains a SQLite map
+    """
+
+    with open(filename, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def build_sqlite_map(entries: Iterable[Tuple[str, List[str]]], filename: str, version: int, last_modified: float,
+                     source_signature: Union[Tuple[int, int], None] = None,
+                     validate_name: Union[Callable[[str, str], None], None] = None):
+    """
+    Write a map into a SQLite database which can be opened by :class:`SqliteMap`. The entries are inserted one by one,
+    so the map never needs to be held in memory entirely.
+
+    The database is written to a temporary file first, then moved into place atomically. This way, processes reloading
+    the map never see a partially written file.
+
+    :param entries: URLs and their names, like JSON map files, later entries for the same URL replace earlier ones
+    :param filename: path of the resulting file
+    :param version: version of the map (see :attr:`NonDatabase.version`)
+    :param last_modified: time at which the map has last been modified
+    :param source_signature: modification time in nanoseconds and size of the file the map has been built from, used
+        to detect whether the database is up to date
+    :param validate_name: function checking a name and its URL, must raise a :class:`ValueError` for invalid names
+    :raises ValueError: if a name is used for more than one URL, or is invalid
+    """
+
+    tmp_filename = "{}.tmp{}".format(filename, os.getpid())
+
+    if os.path.exists(tmp_filename):
+        os.unlink(tmp_filename)
+
+    connection = sqlite3.connect(tmp_filename)
+
+    try:
+        # the file is only used once it is complete, so there is no need for crash safety while it is built
+        connection.execute("PRAGMA journal_mode=OFF")
+        connection.execute("PRAGMA synchronous=OFF")
+        connection.executescript(_schema)
+
+        for url, names in entries:
+            row = connection.execute("SELECT id FROM urls WHERE url = ?", (url,)).fetchone()
+
+            if row is None:
+                url_id = connection.execute("INSERT INTO urls (url) VALUES (?)", (url,)).lastrowid
+
+            else:
+                url_id = row[0]
+                connection.execute("DELETE FROM names WHERE url_id = ?", (url_id,))
+
+            for position, name in enumerate(names):
+                if validate_name is not None:
+                    validate_name(name, url)
+
+                try:
+                    connection.execute(
+                        "INSERT INTO names (name, url_id, position, is_rule) VALUES (?, ?, ?, ?)",
+                        (name, url_id, position, is_rule(name))
+                    )
+
+                except sqlite3.IntegrityError:
+                    other_url, = connection.execute(
+                        "SELECT url FROM urls JOIN names ON names.url_id = urls.id WHERE name = ?", (name,)
+                    ).fetchone()
+
+                    raise ValueError("Name collision: {} is used for (at least) both URLs {} and {}".format(
+                        name, other_url, url
+                    ))
+
+        # creating the indices after inserting the data is a lot faster than updating them for every row
+        connection.execute("CREATE INDEX names_by_url ON names (url_id, position)")
+        connection.execute("CREATE INDEX rules ON names (is_rule) WHERE is_rule")
+
+        names_count, = connection.execute("SELECT COUNT(*) FROM names").fetchone()
+        urls_count, = connection.execute("SELECT COUNT(*) FROM urls").fetchone()
+
+        meta = {
+            "format_version": FORMAT_VERSION,
+            "version": version,
+            "last_modified": last_modified,
+            "names_count": names_count,
+            "urls_count": urls_count,
+        }
+
+        if source_signature is not None:
+            meta["source_mtime_ns"], meta["source_size"] = source_signature
+
+        connection.executemany("INSERT INTO meta (key, value) VALUES (?, ?)", meta.items())
+        connection.commit()
+
+        connection.close()
+        os.replace(tmp_filename, filename)
+
+    except BaseException:
+        connection.close()
+
+        if os.path.exists(tmp_filename):
+            os.unlink(tmp_filename)
+
+        raise
+
+
+def read_meta(filename: str) -> dict:
+    """
+    :return: metadata of a SQLite map, or an empty dict if the file does not exist or is not a valid SQLite map
+    """
+
+    try:
+        connection = _connect(filename)
+
+        try:
+            return dict(connection.execute("SELECT key, value FROM meta"))
+
+        finally:
+            connection.close()
+
+    except sqlite3.Error:
+        return {}
+
+
+def _connect(filename: str) -> sqlite3.Connection:
+    # the file is never modified in place, only replaced atomically, so it can be treated as immutable, which saves
+    # locking the file for every query
+    uri = "file:{}?mode=ro&immutable=1".format(pathname2url(os.path.abspath(filename)))
+    connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+    # SQLite's own lower() only handles ASCII characters, searches need to be case-insensitive like str.lower()
+    connection.create_function("py_lower", 1, str.lower)
+
+    return connection
+
+
+class SqliteMap:
+    """
+    Read-only view on a map stored in a SQLite database. Only the entries which are looked up are loaded into memory,
+    so the memory usage does not depend on the size of the map.
+
+    To keep the latency of frequently used names close to that of a dict lookup, the URLs of the most recently used
+    names are kept in an LRU cache.
+    """
+
+    def __init__(self, filename: str, cache_size: int = 100000):
+        """
+        :param filename: path of the database
+        :param cache_size: maximum number of names whose URLs are cached
+        """
+
+        self.filename = filename
+
+        # a single connection is shared by all threads, which is fine as the queries are short, and most lookups are
+        # answered by the cache anyway
+        # connections must not be used across forks, so we need to check whether the connection belongs to the current
+        # process
+        self._lock = threading.Lock()
+        self._connection: Union[sqlite3.Connection, None] = None
+        self._connection_pid: Union[int, None] = None
+
+        meta = dict(self._query_all("SELECT key, value FROM meta"))
+
+        if meta.get("format_version") != FORMAT_VERSION:
+            raise ValueError("{} has been built for a different format version, please rebuild it".format(filename))
+
+        self.version: int = meta["version"]
+        self.last_modified: float = meta["last_modified"]
+        self.names_count: int = meta["names_count"]
+        self.urls_count: int = meta["urls_count"]
+
+        # exceptions are not cached, so unknown names never evict known ones
+        self.find_url_for_name = functools.lru_cache(maxsize=cache_size)(self._find_url_for_name)
+
+        self.urls_to_names = _URLsToNamesView(self)
+        self.names_to_urls = _NamesToURLsView(self)
+
+    def _get_connection(self) -> sqlite3.Connection:
+        # must be called with the lock held
+        if self._connection_pid != os.getpid():
+            self._connection = _connect(self.filename)
+            self._connection_pid = os.getpid()
+
+        return self._connection
+
+    def _query_all(self, query: str, parameters: tuple = ()) -> list:
+        with self._lock:
+            return self._get_connection().execute(query, parameters).fetchall()
+
+    def _query_iter(self, query: str) -> Iterator[tuple]:
+        with self._lock:
+            cursor = self._get_connection().execute(query)
+
+        while True:
+            # the lock is only held while fetching, so that iterating over the entire map does not block lookups
+            with self._lock:
+                rows = cursor.fetchmany(_FETCH_SIZE)
+
+            if not rows:
+                return
+
+            yield from rows
+
+    def _find_url_for_name(self, name: str) -> str:
+        rows = self._query_all("SELECT url FROM names JOIN urls ON urls.id = names.url_id WHERE name = ?", (name,))
+
+        if not rows:
+            raise KeyError(name)
+
+        return rows[0][0]
+
+    def has_name(self, name: str) -> bool:
+        # bypasses the cache, e.g., so that comparing two maps does not evict the frequently used names
+        return bool(self._query_all("SELECT 1 FROM names WHERE name = ?", (name,)))
+
+    def find_names_for_url(self, url: str) -> Tuple[str, ...]:
+        """
+        :raises KeyError: if the URL is not known
+        """
+
+        rows = self._query_all(
+            "SELECT name FROM urls LEFT JOIN names ON names.url_id = urls.id WHERE url = ? ORDER BY position", (url,)
+        )
+
+        if not rows:
+            raise KeyError(url)
+
+        return tuple(name for name, in rows if name is not None)
+
+    def search_urls(self, query: str) -> List[int]:
+        """
+        Search for URLs which contain the query, or have a name which contains the query. Case-insensitive.
+
+        The URLs are never deleted, only added, so their IDs are consecutive, and the position of a URL in the map is
+        its ID minus one.
+
+        :param query: search query, must be lowercase
+        :return: positions of the matching URLs in the map
+        """
+
+        # this scans the entire database, which is acceptable as the rendered search results are cached
+        rows = self._query_all(
+            "SELECT id - 1 FROM urls WHERE instr(py_lower(url), ?) OR id IN "
+            "(SELECT url_id FROM names WHERE instr(py_lower(name), ?)) ORDER BY id",
+            (query, query)
+        )
+
+        return [position for position, in rows]
+
+    def find_urls(self, positions: Sequence[int]) -> List[str]:
+        """
+        :param positions: positions of URLs in the map (see :meth:`search_urls`)
+        :return: URLs at the given positions
+        :raises KeyError: if there is no URL at one of the positions
+        """
+
+        urls = {}
+
+        # SQLite limits the number of parameters per query
+        for i in range(0, len(positions), _FETCH_SIZE):
+            chunk = positions[i:i + _FETCH_SIZE]
+
+            urls.update(self._query_all(
+                "SELECT id - 1, url FROM urls WHERE id IN ({})".format(", ".join("?" * len(chunk))),
+                tuple(position + 1 for position in chunk)
+            ))
+
+        return [urls[position] for position in positions]
+
+    def rules(self) -> List[Tuple[str, str]]:
+        """
+        :return: names of all rules along with their URLs (see :class:`redirector.trie.NameTrie`)
+        """
+
+        return self._query_all("SELECT name, url FROM names JOIN urls ON urls.id = names.url_id WHERE is_rule")
+
+
+class _URLsToNamesView(Mapping):
+    def __init__(self, sqlite_map: SqliteMap):
+        self._map = sqlite_map
+
+    def __getitem__(self, url: str) -> Tuple[str, ...]:
+        return self._map.find_names_for_url(url)
+
+    def __iter__(self) -> Iterator[str]:
+        for url, in self._map._query_iter("SELECT url FROM urls ORDER BY id"):
+            yield url
+
+    def __len__(self) -> int:
+        return self._map.urls_count
+
+    def items(self):
+        return _URLsToNamesItemsView(self)
+
+
+class _URLsToNamesItemsView(ItemsView):
+    def __iter__(self):
+        # a single query for the entire map, the names of every URL are consecutive rows
+        rows = self._mapping._map._query_iter(
+            "SELECT url, name FROM urls LEFT JOIN names ON names.url_id = urls.id ORDER BY urls.id, position"
+        )
+
+        current_url, names = None, []
+
+        for url, name in rows:
+            if url != current_url:
+                if current_url is not None:
+                    yield current_url, tuple(names)
+
+                current_url, names = url, []
+
+            if name is not None:
+                names.append(name)
+
+        if current_url is not None:
+            yield current_url, tuple(names)
+
+
+class _NamesToURLsView(Mapping):
+    def __init__(self, sqlite_map: SqliteMap):
+        self._map = sqlite_map
+
+    def __getitem__(self, name: str) -> str:
+        return self._map.find_url_for_name(name)
+
+    def __contains__(self, name) -> bool:
+        return self._map.has_name(name)
+
+    def __iter__(self) -> Iterator[str]:
+        for name, in self._map._query_iter("SELECT name FROM names ORDER BY url_id, position"):
+            yield name
+
+    def __len__(self) -> int:
+        return self._map.names_count
+
+    def items(self):
+        return _NamesToURLsItemsView(self)
+
+
+class _NamesToURLsItemsView(ItemsView):
+    def __iter__(self):
+        return self._mapping._map._query_iter(
+            "SELECT name, url FROM names JOIN urls ON urls.id = names.url_id ORDER BY url_id, position"
+        )
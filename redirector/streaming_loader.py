@@ -0,0 +1,283 @@
+import json
+import re
+from typing import IO, Dict, Iterable, Iterator, List, Tuple
+
+
+# lines and columns are counted starting at 1, like the json module does
+Position = Tuple[int, int, int]
+
+_whitespace = re.compile(r"[ \t\n\r]*")
+_colon = re.compile(r"[ \t\n\r]*:[ \t\n\r]*")
+_delimiter = re.compile(r"[ \t\n\r]*([,}])")
+
+
+class MapLoadError(ValueError):
+    """
+    Raised when a map file cannot be loaded. Carries the position in the file at which the problem was detected.
+    """
+
+    def __init__(self, msg: str, filename: str, position: Position):
+        self.msg = msg
+        self.filename = filename
+        self.pos, self.lineno, self.colno = position
+
+        # not using super() here, as subclasses might mix in other ValueError subclasses with different signatures
+        ValueError.__init__(self, "{}: {}: line {} column {} (char {})".format(
+            filename, msg, self.lineno, self.colno, self.pos
+        ))
+
+    def __reduce__(self):
+        return self.__class__, (self.msg, self.filename, (self.pos, self.lineno, self.colno))
+
+
+class MapSyntaxError(MapLoadError, json.JSONDecodeError):
+    """
+    Raised when a map file does not contain valid JSON. For compatibility, this is a :class:`json.JSONDecodeError`.
+    """
+
+    # JSONDecodeError's own attributes which we cannot provide, as we never hold the entire document
+    doc = None
+
+
+class _Reader:
+    """
+    Holds a window of the file's contents and keeps track of the absolute position of the window's start.
+    """
+
+    def __init__(self, f: IO[str], filename: str, chunk_size: int):
+        self.f = f
+        self.filename = filename
+        self.chunk_size = chunk_size
+
+        self.buf = ""
+        self.eof = False
+
+        # absolute position of the first character in the buffer
+        self.offset = 0
+
+        # line and column are tracked with a cursor which only moves forward, so every character is inspected only once
+        self._cursor = 0
+        self._line = 1
+        self._column = 1
+
+    def read_more(self, idx: int) -> int:
+        """
+        Drop everything before idx from the buffer and read the next chunk.
+
+        :return: idx translated to the new buffer
+        """
+
+        if self.eof:
+            return idx
+
+        chunk = self.f.read(self.chunk_size)
+
+        if not chunk:
+            self.eof = True
+            return idx
+
+        self._advance_cursor(idx)
+        self._cursor = 0
+        self.offset += idx
+
+        self.buf = self.buf[idx:] + chunk
+
+        return 0
+
+    def _advance_cursor(self, idx: int):
+        newlines = self.buf.count("\n", self._cursor, idx)
+
+        if newlines:
+            self._line += newlines
+            self._column = idx - self.buf.rfind("\n", self._cursor, idx)
+
+        else:
+            self._column += idx - self._cursor
+
+        self._cursor = idx
+
+    def position(self, idx: int) -> Position:
+        """
+        Calculate the position of a character in the buffer. Positions must be requested in ascending order.
+        """
+
+        self._advance_cursor(idx)
+        return self.offset + idx, self._line, self._column
+
+    def skip_whitespace(self, idx: int) -> int:
+        while True:
+            idx = _whitespace.match(self.buf, idx).end()
+
+            if idx < len(self.buf) or self.eof:
+                return idx
+
+            idx = self.read_more(idx)
+
+    def expect(self, idx: int, characters: str, description: str) -> Tuple[int, str]:
+        idx = self.skip_whitespace(idx)
+
+        if idx >= len(self.buf) or self.buf[idx] not in characters:
+            raise self.syntax_error(description, idx)
+
+        return idx + 1, self.buf[idx]
+
+    def decode_value(self, decoder: json.JSONDecoder, idx: int) -> Tuple[object, int, int]:
+        """
+        Decode the next value, reading more data as needed.
+
+        :return: value, start and end of the value in the buffer
+        """
+
+        idx = self.skip_whitespace(idx)
+
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.buf, idx)
+                return value, idx, end
+
+            except json.JSONDecodeError as e:
+                # the value might just be incomplete, in that case we need to read more data and try again
+                if self.eof:
+                    raise self.syntax_error(e.msg, e.pos) from None
+
+                idx = self.read_more(idx)
+
+    def syntax_error(self, msg: str, idx: int) -> MapSyntaxError:
+        return MapSyntaxError(msg, self.filename, self.position(idx))
+
+
+def locate(f: IO[str], pos: int, chunk_size: int = 1024 * 1024) -> Position:
+    """
+    Calculate line and column of a character in a file. Used to report errors found while processing the entries
+    yielded by :func:`iter_map_entries`, which only tracks the character offsets to save time.
+
+    :param f: file to read from, must be positioned at the beginning
+    :param pos: character offset
+    :return: position of the character
+    """
+
+    return locate_all(f, [pos], chunk_size)[pos]
+
+
+def locate_all(f: IO[str], positions: Iterable[int], chunk_size: int = 1024 * 1024) -> Dict[int, Position]:
+    """
+    Calculate lines and columns of many characters in a file at once, reading the file only once.
+
+    :param f: file to read from, must be positioned at the beginning
+    :param positions: character offsets
+    :return: positions of the characters by offset
+    """
+
+    result = {}
+
+    line = 1
+    column = 1
+    offset = 0
+
+    for pos in sorted(set(positions)):
+        remaining = pos - offset
+
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+
+            if not chunk:
+                break
+
+            remaining -= len(chunk)
+            offset += len(chunk)
+
+            newlines = chunk.count("\n")
+
+            if newlines:
+                line += newlines
+                column = len(chunk) - chunk.rfind("\n")
+
+            else:
+                column += len(chunk)
+
+        result[pos] = (pos, line, column)
+
+    return result
+
+
+def iter_map_entries(f: IO[str], filename: str, chunk_size: int = 1024 * 1024) -> Iterator[Tuple[str, List[str], int]]:
+    """
+    Parses a map file incrementally, yielding one URL and its names at a time. This way, the entire file never has to
+    be held in memory. Only the structure of the data is checked, the names are not validated.
+
+    :param f: file to read from
+    :param filename: name of the file, used in error messages
+    :param chunk_size: amount of characters read at once
+    :return: iterator yielding URL, names and the character offset of the entry in the file (see :func:`locate`)
+    :raises MapSyntaxError: if the file does not contain valid JSON
+    :raises MapLoadError: if the data does not follow the expected structure
+    """
+
+    reader = _Reader(f, filename, chunk_size)
+    decoder = json.JSONDecoder()
+    scan_once = decoder.scan_once
+
+    idx, _ = reader.expect(0, "{", "Expecting value")
+
+    idx = reader.skip_whitespace(idx)
+
+    if reader.buf[idx:idx + 1] == "}":
+        idx += 1
+
+    else:
+        while True:
+            # fast path: the entire entry is in the buffer and well-formed, so it can be parsed with a few calls into C
+            # code
+            buf = reader.buf
+
+            try:
+                idx = _whitespace.match(buf, idx).end()
+                url, end = scan_once(buf, idx)
+                end = _colon.match(buf, end).end()
+                names, end = scan_once(buf, end)
+                delimiter_match = _delimiter.match(buf, end)
+                delimiter = delimiter_match.group(1)
+                end = delimiter_match.end()
+
+                if type(url) is not str:
+                    raise ValueError
+
+            except (StopIteration, AttributeError, ValueError):
+                # the entry might just be incomplete, or not well-formed, in which case we use the slow path, which
+                # reads more data as needed and reports errors properly
+                pos, url, names, delimiter, end = _parse_entry_slowly(reader, decoder, idx)
+
+            else:
+                pos = reader.offset + idx
+
+            if type(names) is not list or not all(type(name) is str for name in names):
+                raise MapLoadError("Expecting list of names for URL {}".format(url), filename, reader.position(idx))
+
+            yield url, names, pos
+
+            idx = end
+
+            if delimiter == "}":
+                break
+
+    idx = reader.skip_whitespace(idx)
+
+    if idx < len(reader.buf):
+        raise reader.syntax_error("Extra data", idx)
+
+
+def _parse_entry_slowly(reader: _Reader, decoder: json.JSONDecoder, idx: int):
+    idx = reader.skip_whitespace(idx)
+
+    if reader.buf[idx:idx + 1] != "\"":
+        raise reader.syntax_error("Expecting property name enclosed in double quotes", idx)
+
+    # the start of the entry stays in the buffer while the key is decoded, afterwards it might be dropped
+    url, start, end = reader.decode_value(decoder, idx)
+    pos = reader.offset + start
+
+    end, _ = reader.expect(end, ":", "Expecting ':' delimiter")
+    names, _, end = reader.decode_value(decoder, end)
+    end, delimiter = reader.expect(end, ",}", "Expecting ',' delimiter")
+
+    return pos, url, names, delimiter, end
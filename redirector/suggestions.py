@@ -0,0 +1,118 @@
+from array import array
+from collections import Counter, defaultdict
+from typing import Dict, List, Union
+
+from flask import Flask
+
+from .metrics import metrics
+from .non_database import NonDatabase
+from .search import _trigrams
+from .trie import is_rule
+
+
+# minimum similarity (Sørensen-Dice coefficient of the trigrams) of names suggested for an unknown name
+MIN_SIMILARITY = 0.5
+
+# number of candidates whose similarity is computed per requested suggestion
+CANDIDATES_PER_SUGGESTION = 10
+
+
+class NameSuggestions:
+    """
+    Trigram index over the names of a map, which is used to find names similar to an unknown name, e.g., to suggest
+    the name the user most likely meant to type.
+
+    For every trigram, the index stores the sorted IDs of all names containing it. To find similar names, the number of
+    trigrams each name shares with the unknown name is counted, starting with the rarest trigram. Common trigrams are
+    shared by lots of names, so the number of IDs visited per lookup is limited by a budget. Once the budget is
+    exhausted, the remaining trigrams are skipped. The names sharing the most trigrams counted so far are then compared
+    to the unknown name directly. The suggestions may therefore be incomplete, but the time needed per lookup is bounded
+    regardless of the size of the map and the name looked up.
+    """
+
+    def __init__(self, non_db: NonDatabase):
+        # rules match many different names, suggesting them does not make much sense
+        self.names: List[str] = [name for name in non_db.names_to_urls if not is_rule(name)]
+
+        postings = defaultdict(lambda: array("I"))
+
+        for name_id, name in enumerate(self.names):
+            for trigram in _trigrams([name]):
+                postings[trigram].append(name_id)
+
+        self._postings: Dict[str, array] = dict(postings)
+
+    def suggest(self, name: str, limit: int = 5, budget: int = 50000) -> List[str]:
+        """
+        Find the names most similar to a given name. Case-insensitive.
+
+        :param name: name to find similar names for
+        :param limit: maximum number of suggestions
+        :param budget: maximum number of name IDs to visit
+        :return: similar names, the most similar one first
+        """
+
+        trigrams = _trigrams([name])
+
+        # start with the rarest trigrams, which are the most selective ones
+        lists = sorted((self._postings[trigram] for trigram in trigrams if trigram in self._postings), key=len)
+
+        shared_trigrams = Counter()
+
+        for name_ids in lists:
+            if len(name_ids) > budget:
+                metrics.inc("redirector_suggestions_budget_exhausted_total")
+                break
+
+            budget -= len(name_ids)
+            shared_trigrams.update(name_ids)
+
+        # if the budget has been exhausted, the counts are incomplete, so the similarity of the most promising
+        # candidates is computed from their actual trigrams
+        scored_names = []
+
+        for name_id, _ in shared_trigrams.most_common(CANDIDATES_PER_SUGGESTION * limit):
+            candidate = self.names[name_id]
+            candidate_trigrams = _trigrams([candidate])
+
+            similarity = 2 * len(trigrams & candidate_trigrams) / (len(trigrams) + len(candidate_trigrams))
+
+            if similarity >= MIN_SIMILARITY:
+                scored_names.append((-similarity, candidate))
+
+        scored_names.sort()
+
+        return [suggested_name for _, suggested_name in scored_names[:limit]]
+
+
+def compute_name_suggestions(app: Flask, non_db: NonDatabase) -> Union[NameSuggestions, None]:
+    """
+    Create the suggestions index for a non-database and store it in its derived data, unless suggestions are disabled
+    or the map is stored in a SQLite database.
+
+    Can be registered as a load callback of :class:`redirector.non_database.FlaskNonDatabase`.
+    """
+
+    if int(app.config["SUGGESTIONS_LIMIT"]) <= 0:
+        return None
+
+    # the index would have to hold all names in memory, which is what the SQLite backend is meant to avoid
+    if non_db.sqlite_map is not None:
+        return None
+
+    suggestions = NameSuggestions(non_db)
+    non_db.derived[NameSuggestions] = suggestions
+    return suggestions
+
+
+def get_name_suggestions(app: Flask, non_db: NonDatabase) -> Union[NameSuggestions, None]:
+    """
+    :return: suggestions index of the non-database, or None if suggestions are disabled
+    """
+
+    suggestions = non_db.derived.get(NameSuggestions)
+
+    if suggestions is None:
+        suggestions = compute_name_suggestions(app, non_db)
+
+    return suggestions
@@ -0,0 +1,244 @@
+import os
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from typing import Tuple, Union
+
+from flask import Flask
+from werkzeug.wrappers import Response
+
+from . import cache
+
+
+# key of the counter which is incremented in the shared cache whenever a value is written
+EPOCH_KEY = "dynamic/epoch"
+
+# seconds between two checks whether another process has written a value
+EPOCH_CHECK_INTERVAL = 1.0
+
+
+def version_key(key: str) -> str:
+    """
+    :return: key of the version of a value, which changes whenever the value is written
+    """
+
+    return "{}/version".format(key)
+
+
+class _FrozenResponse:
+    """
+    Immutable copy of a response kept in the first tier. Response objects are mutable (e.g., by after_request hooks),
+    so every request gets a fresh response built from it, like the second tier returns a fresh copy on every lookup.
+    """
+
+    __slots__ = ("response_class", "status", "headers", "body")
+
+    def __init__(self, response: Response):
+        self.response_class = type(response)
+        self.status = response.status
+        self.body = response.get_data()
+
+        # never handed out, only copied, copying is a lot cheaper than parsing a list of headers again
+        self.headers = response.headers.copy()
+
+    def thaw(self) -> Response:
+        return self.response_class(self.body, status=self.status, headers=self.headers.copy())
+
+
+def _freeze(value):
+    # streamed responses cannot be replayed anyway, other values (e.g., strings) are immutable
+    if isinstance(value, Response) and not value.is_streamed:
+        return _FrozenResponse(value)
+
+    return value
+
+
+def _thaw(value):
+    if isinstance(value, _FrozenResponse):
+        return value.thaw()
+
+    return value
+
+
+class TieredCache:
+    """
+    Two-tier cache for the results of dynamic redirections.
+
+    The first tier (L1) is a small LRU cache in the memory of every process, whose entries expire after a few seconds.
+    It answers most requests without a round trip to the second tier (L2), the Flask-Caching backend shared by all
+    processes (e.g., Redis). Values are always written to both tiers.
+
+    Whenever a value is written, a new version is stored along with it, and a counter (the epoch) is incremented in L2.
+    Every process checks the epoch at most once per :data:`EPOCH_CHECK_INTERVAL`. Once it has changed, the versions of
+    all L1 entries are looked up at once, and only the entries whose value has been written by another process (e.g.,
+    by a background refresh) are dropped, so these values are picked up quickly while all others stay in L1.
+    """
+
+    def __init__(self):
+        # maximum number of entries and seconds after which they expire, a size of 0 disables the first tier
+        self.size = 1000
+        self.timeout = 5.0
+
+        # key -> expiry time, value, and version of the value
+        self._entries: "OrderedDict[str, Tuple[float, object, Union[str, None]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._epoch = None
+        self._next_epoch_check = 0.0
+
+        # hits and misses per tier, as well as the number of L1 entries which have been invalidated
+        self.stats = Counter()
+
+        # the lock might be held by another thread while forking
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def init_app(self, app: Flask):
+        app.config.setdefault("DYNAMIC_REDIRECTS_L1_SIZE", "1000")
+        app.config.setdefault("DYNAMIC_REDIRECTS_L1_TIMEOUT", "5")
+
+        self.size = int(app.config["DYNAMIC_REDIRECTS_L1_SIZE"])
+        self.timeout = float(app.config["DYNAMIC_REDIRECTS_L1_TIMEOUT"])
+
+        self.clear()
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    def clear(self):
+        """
+        Drop all entries of the first tier.
+        """
+
+        with self._lock:
+            self._entries.clear()
+            self._epoch = None
+            self._next_epoch_check = 0.0
+
+    def _check_epoch(self, now: float):
+        if now < self._next_epoch_check:
+            return
+
+        self._next_epoch_check = now + EPOCH_CHECK_INTERVAL
+
+        epoch = cache.get(EPOCH_KEY)
+
+        if epoch == self._epoch:
+            return
+
+        with self._lock:
+            keys = list(self._entries)
+
+        if keys:
+            versions = cache.get_many(*[version_key(key) for key in keys])
+
+            with self._lock:
+                for key, version in zip(keys, versions):
+                    entry = self._entries.get(key)
+
+                    if entry is not None and entry[2] != version:
+                        del self._entries[key]
+                        self.stats["l1_invalidations"] += 1
+
+        self._epoch = epoch
+
+    def _store(self, key: str, value, version: Union[str, None], timeout: float, now: float):
+        value = _freeze(value)
+
+        with self._lock:
+            self._entries[key] = (now + timeout, value, version)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def lookup(self, key: str) -> Tuple[object, Union[str, None]]:
+        """
+        Look up a value, trying the first tier first.
+
+        :param key: cache key
+        :return: value (or None if it is not cached) and the tier which has answered the lookup (None on misses)
+        """
+
+        if self.size > 0:
+            now = time.monotonic()
+            self._check_epoch(now)
+
+            with self._lock:
+                entry = self._entries.get(key)
+
+                if entry is not None:
+                    expires_at, value, _ = entry
+
+                    if expires_at > now:
+                        self._entries.move_to_end(key)
+                        self.stats["l1_hits"] += 1
+                        return _thaw(value), "l1"
+
+                    del self._entries[key]
+
+            self.stats["l1_misses"] += 1
+
+        if self.size > 0:
+            value, version = cache.get_many(key, version_key(key))
+        else:
+            value, version = cache.get(key), None
+
+        if value is None:
+            self.stats["l2_misses"] += 1
+            return None, None
+
+        self.stats["l2_hits"] += 1
+
+        if self.size > 0:
+            self._store(key, value, version, self.timeout, time.monotonic())
+
+        return value, "l2"
+
+    def get(self, key: str):
+        """
+        :return: cached value, or None if it is not cached
+        """
+
+        return self.lookup(key)[0]
+
+    def set(self, key: str, value, timeout: float):
+        """
+        Store a value in both tiers, and make the other processes drop it from their first tier.
+
+        :param key: cache key
+        :param value: value to store
+        :param timeout: seconds after which the value expires, 0 meaning never (like in Flask-Caching)
+        """
+
+        # random versions, unlike counters, never repeat, even if the version has expired in the meantime
+        version = uuid.uuid4().hex
+
+        cache.set_many({key: value, version_key(key): version}, timeout=timeout)
+
+        # the extension does not expose the backends' atomic increment operation
+        epoch = cache.cache.inc(EPOCH_KEY)
+
+        if self.size <= 0:
+            return
+
+        # unless other processes have written values since the last check, there is nothing to check
+        if epoch is not None and self._epoch is not None and epoch == self._epoch + 1:
+            self._epoch = epoch
+
+        # values which never expire are kept in the first tier as long as other values
+        self._store(key, value, version, min(self.timeout, timeout) if timeout else self.timeout, time.monotonic())
+
+    def get_stats(self) -> dict:
+        """
+        :return: hits and misses per tier
+        """
+
+        result = {"l1_hits": 0, "l1_misses": 0, "l2_hits": 0, "l2_misses": 0, "l1_invalidations": 0}
+        result.update(self.stats)
+        return result
+
+
+# global instance, like the other extensions
+tiered_cache = TieredCache()
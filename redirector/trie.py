@@ -0,0 +1,357 @@
+import re
+from collections.abc import Mapping
+from typing import Dict, Iterable, List, Tuple, Union
+from urllib.parse import quote
+
+
+# names ending with this suffix are prefix rules, e.g., gh/* redirects gh/<anything> to the URL followed by <anything>
+PREFIX_RULE_SUFFIX = "/*"
+
+# segments like <version> are placeholders, names containing them are pattern rules, e.g., release/<version>
+# the URL may use the same placeholders, which are replaced with the values of the segments
+_placeholder = re.compile(r"<([A-Za-z_][A-Za-z0-9_]*)>")
+
+# segments which would change the meaning of the path of the URL they are inserted into, so they must never be inserted
+DOT_SEGMENTS = (".", "..")
+
+
+def is_prefix_rule(name: str) -> bool:
+    return name.endswith(PREFIX_RULE_SUFFIX)
+
+
+def is_pattern_rule(name: str) -> bool:
+    # names must not contain < anywhere else, see validate_rule
+    return "<" in name
+
+
+def is_rule(name: str) -> bool:
+    return is_prefix_rule(name) or is_pattern_rule(name)
+
+
+def placeholder_name(segment: str) -> Union[str, None]:
+    """
+    :return: name of the placeholder if the segment is one, None otherwise
+    """
+
+    match = _placeholder.fullmatch(segment)
+
+    if match is None:
+        return None
+
+    return match.group(1)
+
+
+def validate_rule(name: str, url: str):
+    """
+    Check a name for invalid uses of the rule syntax.
+
+    :param name: name to check
+    :param url: URL assigned to the name
+    :raises ValueError: if the name or the URL are not valid
+    """
+
+    segments = name.split("/")
+
+    # * is only special as the last segment of a prefix rule, elsewhere it would be confusing
+    if "*" in segments[:-1]:
+        raise ValueError("* may only be used as the last segment of a prefix rule: {}".format(name))
+
+    placeholders = []
+
+    for segment in segments:
+        placeholder = placeholder_name(segment)
+
+        if placeholder is not None:
+            placeholders.append(placeholder)
+
+        # this way, names containing < can always be treated as pattern rules
+        elif "<" in segment or ">" in segment:
+            raise ValueError("placeholders must span entire segments and be valid identifiers: {}".format(name))
+
+    if len(set(placeholders)) != len(placeholders):
+        raise ValueError("placeholders must be unique: {}".format(name))
+
+    if placeholders and is_prefix_rule(name):
+        raise ValueError("a rule cannot contain both placeholders and a trailing *: {}".format(name))
+
+    # the rest of the path is appended to the URL, so without a trailing /, it could change the host (e.g.,
+    # https://example.org followed by @evil.com)
+    if is_prefix_rule(name) and not url.endswith("/"):
+        raise ValueError("URL {} of prefix rule {} must end with a /".format(url, name))
+
+    undefined_placeholders = set(_placeholder.findall(url)) - set(placeholders)
+
+    if undefined_placeholders:
+        raise ValueError("URL {} uses placeholders not defined by name {}: {}".format(
+            url, name, ", ".join(sorted(undefined_placeholders))
+        ))
+
+
+class _PatternRule:
+    __slots__ = ("name", "placeholders", "url_parts")
+
+    def __init__(self, name: str, url: str):
+        self.name = name
+
+        # placeholders in the order they appear in the name
+        self.placeholders = [p for p in map(placeholder_name, name.split("/")) if p is not None]
+
+        # the URL split at its placeholders, i.e., literal parts alternate with placeholder names
+        self.url_parts = _placeholder.split(url)
+
+    def build_url(self, values: List[str]) -> str:
+        # the values come from the decoded path, so they must be encoded again, otherwise they could, e.g., add a query
+        values_by_placeholder = {
+            placeholder: quote(value, safe="") for placeholder, value in zip(self.placeholders, values)
+        }
+
+        parts = list(self.url_parts)
+
+        for i in range(1, len(parts), 2):
+            parts[i] = values_by_placeholder[parts[i]]
+
+        return "".join(parts)
+
+
+class _Node:
+    __slots__ = ("children", "placeholder_child", "url", "pattern_rule")
+
+    def __init__(self):
+        # literal segments
+        self.children: Dict[str, _Node] = {}
+
+        # any segment, shared by all pattern rules with a placeholder at this position
+        self.placeholder_child: Union[_Node, None] = None
+
+        # URL of the prefix rule ending at this node, if any
+        self.url: Union[str, None] = None
+
+        # pattern rule ending at this node, if any
+        self.pattern_rule: Union[_PatternRule, None] = None
+
+
+class NameTrie:
+    """
+    Trie of the prefix and pattern rules of a map, keyed by the segments (i.e., the parts between the ``/``) of their
+    names.
+
+    Pattern rules match names with the same number of segments. At every segment, literal segments take precedence over
+    placeholders. Two rules which would both match a name are only allowed if one of them is more specific than the
+    other, i.e., has a literal segment wherever the other one has, and at least one more. Otherwise, they are rejected
+    as ambiguous. This way, the first match found by the lookup is the only sensible one.
+
+    Placeholders do not match ``.`` and ``..`` segments, and their values are percent-encoded entirely before they are
+    inserted into the URL, so they cannot change any other part of the URL.
+
+    Prefix rules are used if no pattern rule matches. The longest matching prefix wins. The rest of the name is
+    percent-encoded (except for the ``/``) before it is appended to the URL, and names containing ``.`` or ``..``
+    segments in this part do not match, so they cannot leave the path of the URL.
+
+    A lookup walks down the trie segment by segment, so the time it takes does not depend on the number of rules. If a
+    literal segment leads to a dead end, the lookup has to go back and try the placeholder instead, therefore in the
+    worst case, the time grows exponentially with the number of segments of the name (but not with the number of rules).
+    """
+
+    def __init__(self):
+        self._root = _Node()
+        self.rules_count = 0
+        self.pattern_rules_count = 0
+
+    @classmethod
+    def from_map(cls, urls_to_names: Mapping) -> "NameTrie":
+        """
+        Build a trie from all the prefix and pattern rules in a map.
+
+        :param urls_to_names: validated data (see :meth:`NonDatabase.load_data`)
+        :raises ValueError: if pattern rules are ambiguous
+        """
+
+        return cls.from_rules(
+            # this is evaluated for every single name, therefore is_rule is inlined here
+            (name, url) for url, names in urls_to_names.items() for name in names
+            if "<" in name or name.endswith(PREFIX_RULE_SUFFIX)
+        )
+
+    @classmethod
+    def from_rules(cls, rules: Iterable[Tuple[str, str]]) -> "NameTrie":
+        """
+        Build a trie from a list of rules.
+
+        :param rules: names of the rules along with their URLs
+        :raises ValueError: if pattern rules are ambiguous
+        """
+
+        trie = cls()
+
+        for name, url in rules:
+            trie.add(name, url)
+
+        return trie
+
+    def add(self, name: str, url: str):
+        """
+        Add a rule. Duplicate names are detected when the names are loaded, so they are not checked here.
+
+        :param name: name of the rule, e.g., ``gh/*`` or ``release/<version>``
+        :param url: URL of the rule
+        :raises ValueError: if the rule is ambiguous with another pattern rule
+        """
+
+        if is_prefix_rule(name):
+            node = self._root
+
+            for segment in name[:-len(PREFIX_RULE_SUFFIX)].split("/"):
+                node = node.children.setdefault(segment, _Node())
+
+            node.url = url
+
+        else:
+            segments = name.split("/")
+
+            self._check_ambiguity(name, self._root, segments, 0, False, False)
+
+            node = self._root
+
+            for segment in segments:
+                if placeholder_name(segment) is not None:
+                    if node.placeholder_child is None:
+                        node.placeholder_child = _Node()
+
+                    node = node.placeholder_child
+
+                else:
+                    node = node.children.setdefault(segment, _Node())
+
+            node.pattern_rule = _PatternRule(name, url)
+            self.pattern_rules_count += 1
+
+        self.rules_count += 1
+
+    def _check_ambiguity(self, name: str, node: _Node, segments: List[str], i: int, new_more_specific: bool,
+                         existing_more_specific: bool):
+        # visits all existing pattern rules which match at least one name the new rule matches as well
+        if i == len(segments):
+            existing_rule = node.pattern_rule
+
+            # if each rule is more specific than the other one somewhere, or they are equally specific, no rule can be
+            # preferred over the other one
+            if existing_rule is not None and new_more_specific == existing_more_specific:
+                raise ValueError("pattern rules {} and {} are ambiguous".format(existing_rule.name, name))
+
+            return
+
+        segment = segments[i]
+
+        if placeholder_name(segment) is None:
+            child = node.children.get(segment)
+
+            if child is not None:
+                self._check_ambiguity(name, child, segments, i + 1, new_more_specific, existing_more_specific)
+
+            if node.placeholder_child is not None:
+                self._check_ambiguity(name, node.placeholder_child, segments, i + 1, True, existing_more_specific)
+
+        else:
+            for child in node.children.values():
+                self._check_ambiguity(name, child, segments, i + 1, new_more_specific, True)
+
+            if node.placeholder_child is not None:
+                self._check_ambiguity(
+                    name, node.placeholder_child, segments, i + 1, new_more_specific, existing_more_specific
+                )
+
+    def _match_pattern(self, node: _Node, segments: List[str], i: int, values: List[str]) -> Union[_PatternRule, None]:
+        # on a match, the values of the placeholders are left in values
+        if i == len(segments):
+            return node.pattern_rule
+
+        segment = segments[i]
+
+        child = node.children.get(segment)
+
+        if child is not None:
+            rule = self._match_pattern(child, segments, i + 1, values)
+
+            if rule is not None:
+                return rule
+
+        # placeholders must not match empty segments, nor segments which would change the meaning of the URL's path
+        if node.placeholder_child is not None and segment and segment not in DOT_SEGMENTS:
+            values.append(segment)
+
+            rule = self._match_pattern(node.placeholder_child, segments, i + 1, values)
+
+            if rule is not None:
+                return rule
+
+            values.pop()
+
+        return None
+
+    def _longest_prefix_match(self, name: str) -> Union[Tuple[str, int], None]:
+        node = self._root
+        match = None
+        start = 0
+
+        while True:
+            end = name.find("/", start)
+
+            # a prefix is always followed by a /, so the last segment cannot be part of it
+            if end == -1:
+                return match
+
+            node = node.children.get(name[start:end])
+
+            if node is None:
+                return match
+
+            if node.url is not None:
+                match = (node.url, end + 1)
+
+            start = end + 1
+
+    def lookup(self, name: str) -> str:
+        """
+        Find the rule matching a name. Pattern rules take precedence over prefix rules.
+
+        :param name: name to look up
+        :return: URL of the matching rule, with the placeholders or the remainder of the name filled in
+        :raises KeyError: if no rule matches
+        """
+
+        return self.match(name)[1]
+
+    def match(self, name: str) -> Tuple[str, str]:
+        """
+        Like :meth:`lookup`, but also returns the name of the matching rule, e.g., to count the hits per rule rather
+        than per name.
+
+        :param name: name to look up
+        :return: name of the matching rule (e.g., ``gh/*``), and URL like :meth:`lookup`
+        :raises KeyError: if no rule matches
+        """
+
+        if not self.rules_count:
+            raise KeyError(name)
+
+        if self.pattern_rules_count:
+            values = []
+            rule = self._match_pattern(self._root, name.split("/"), 0, values)
+
+            if rule is not None:
+                return rule.name, rule.build_url(values)
+
+        match = self._longest_prefix_match(name)
+
+        if match is None:
+            raise KeyError(name)
+
+        url, remainder_start = match
+        remainder = name[remainder_start:]
+
+        # the remainder must stay within the path of the URL
+        if any(segment in DOT_SEGMENTS for segment in remainder.split("/")):
+            raise KeyError(name)
+
+        # the matched prefix includes the trailing /, so the name of the rule is the prefix followed by *
+        return name[:remainder_start] + "*", url + quote(remainder, safe="/")
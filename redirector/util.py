@@ -0,0 +1,46 @@
+import contextlib
+from typing import Union
+
+try:
+    import fcntl
+
+except ImportError:
+    fcntl = None
+
+
+def parse_flag(value: Union[str, bool, int, None]) -> bool:
+    """
+    Interpret a configuration value as a boolean flag. Values set via environment variables are always strings, so
+    values like ``"0"`` or ``"false"`` need to be treated as ``False``.
+
+    :param value: configuration value
+    :return: flag value
+    """
+
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+
+    return bool(value)
+
+
+@contextlib.contextmanager
+def file_lock(path: str):
+    """
+    Hold an exclusive lock shared by all processes on the same host, e.g., so that only one of them builds a file which
+    all of them need. Blocks until the lock has been acquired. On platforms without :mod:`fcntl`, no lock is taken.
+
+    :param path: path of the lock file, which is created if it does not exist
+    """
+
+    if fcntl is None:
+        yield
+        return
+
+    with open(path, "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+        try:
+            yield
+
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
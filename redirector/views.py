@@ -1,11 +1,22 @@
+import hashlib
+import json
+import math
 import os
-from typing import Dict, List
+from typing import Callable, Iterable, List, Sequence, Tuple
+from urllib.parse import quote
 
-from flask import Blueprint, redirect, current_app, jsonify, render_template
-from werkzeug.exceptions import NotFound
+from flask import Blueprint, Response, current_app, jsonify, render_template, request, url_for
+from werkzeug.exceptions import BadRequest, NotFound, RequestEntityTooLarge
+from werkzeug.http import http_date, is_resource_modified
 
 from . import non_db_ext, cache
-from .dynamic import dynamic_routes, dynamic_redirects_bp
+from .dynamic import dynamic_routes, dynamic_redirects_bp, get_stats as get_dynamic_stats
+from .analytics import analytics, top_names
+from .metrics import instrument, metrics
+from .non_database import NonDatabase
+from .responses import compute_static_redirect_responses, get_serialized_map, get_static_redirect_responses
+from .search import compute_search_index, get_search_index
+from .suggestions import compute_name_suggestions, get_name_suggestions
 
 this_dir = os.path.abspath(os.path.join(os.path.dirname(__file__)))
 static_folder = os.path.join(this_dir, "static")
@@ -13,9 +24,29 @@ template_folder = os.path.join(this_dir, "templates")
 
 bp = Blueprint("redirector", __name__, static_folder=static_folder, template_folder=template_folder)
 
+# precompute the redirect responses whenever a map is loaded
+non_db_ext.on_load(compute_static_redirect_responses)
+non_db_ext.on_load(compute_search_index)
+non_db_ext.on_load(compute_name_suggestions)
 
-def get_static_redirections() -> Dict[str, List[str]]:
-    return non_db_ext.non_db.urls_to_names
+
+def make_short_url(prefix: str, name: str) -> str:
+    # calling url_for for every single name is rather slow, and all names share the same prefix anyway
+    # the characters considered safe are the same werkzeug uses when building URLs
+    return prefix + quote(name, safe="!$&'()*+,/:;=@")
+
+
+def get_static_redirections(non_db: NonDatabase, url_ids: Sequence[int]) -> List[Tuple[str, List[Tuple[str, str]]]]:
+    """
+    :return: URLs along with their names and the names' redirection URLs
+    """
+
+    prefix = url_for("redirector.index")
+
+    return [
+        (url, [(name, make_short_url(prefix, name)) for name in names])
+        for url, names in get_search_index(current_app, non_db).entries(url_ids)
+    ]
 
 
 def get_dynamic_redirections() -> List[str]:
@@ -30,56 +61,304 @@ def get_dynamic_redirections() -> List[str]:
         yield route, url_for_route(route)
 
 
-@bp.route("/")
-def index():
+def render_index_page(non_db: NonDatabase, query: str, page: int) -> str:
+    search_index = get_search_index(current_app, non_db)
+
+    page_size = int(current_app.config["INDEX_PAGE_SIZE"])
+    start = (page - 1) * page_size
+
+    if query:
+        url_ids = search_index.search(query)
+        total = len(url_ids)
+        page_url_ids = url_ids[start:start + page_size]
+
+    else:
+        total = len(search_index)
+        page_url_ids = range(start, min(start + page_size, total))
+
     return render_template(
         "index.html",
-        static_redirections=get_static_redirections(),
+        static_redirections=get_static_redirections(non_db, page_url_ids),
         dynamic_redirections=get_dynamic_redirections(),
+        query=query,
+        page=page,
+        pages=max(1, math.ceil(total / page_size)),
+        total=total,
     )
 
 
+@bp.route("/")
+@instrument("index")
+def index():
+    query = request.args.get("q", "").strip()
+
+    try:
+        page = max(1, int(request.args.get("page", 1)))
+
+    except ValueError:
+        page = 1
+
+    non_db = non_db_ext.non_db
+
+    # rendering a page requires looking up all its entries, which is expensive for large maps
+    # the result only depends on the map, so we can cache it until the map changes
+    # the query is hashed, since cache backends might not support arbitrary keys
+    query_hash = hashlib.sha1("{}\n{}".format(request.script_root, query).encode()).hexdigest()
+    cache_key = "index/{}/{}/{}/{}".format(non_db.version, current_app.config["INDEX_PAGE_SIZE"], page, query_hash)
+
+    rendered = cache.get(cache_key)
+
+    if rendered is None:
+        rendered = render_index_page(non_db, query, page)
+        cache.set(cache_key, rendered, timeout=int(current_app.config["INDEX_CACHE_TIMEOUT"]))
+
+    return rendered
+
+
 @bp.route("/api/urls.json")
-@cache.cached(timeout=50)
+@instrument("api_urls")
 def api_urls():
-    return jsonify(non_db_ext.non_db.urls_to_names)
+    serialized_map = get_serialized_map(non_db_ext.non_db)
 
+    headers = {
+        "ETag": 'W/"{}"'.format(serialized_map.etag),
+        "Last-Modified": http_date(serialized_map.last_modified),
+        "Vary": "Accept-Encoding",
+    }
 
-# TODO: once / are allowed for names, change this to /<name:path>
-# TODO: there is no real point in caching this endpoint for static routes, since the lookups in the NonDatabase are
-# likely faster than working with a cache
-@bp.route("/<name>")
-def shortener(name: str):
+    # mirrors tend to poll this endpoint, so they should not have to download the data again if nothing has changed
+    if not is_resource_modified(request.environ, etag=serialized_map.etag, last_modified=serialized_map.last_modified):
+        return Response(status=304, headers=headers)
+
+    encoding = None
+
+    # prefer the encoding with the highest quality value the client accepts, brotli wins a tie
+    accepted_encodings = sorted(
+        (encoding for encoding in serialized_map.encodings if request.accept_encodings[encoding]),
+        key=lambda encoding: (request.accept_encodings[encoding], encoding == "br"),
+        reverse=True,
+    )
+
+    if accepted_encodings:
+        encoding = accepted_encodings[0]
+        headers["Content-Encoding"] = encoding
+
+    return Response(serialized_map.get_body(encoding), mimetype="application/json", headers=headers)
+
+
+@bp.route("/api/changes.json")
+def api_changes():
+    non_db = non_db_ext.non_db
+
+    try:
+        since = int(request.args["since"])
+
+    except KeyError:
+        since = None
+
+    except ValueError:
+        raise BadRequest("since must be an integer")
+
+    if since is not None:
+        changes = non_db.change_log.changes_since(since)
+
+        if changes is not None:
+            return jsonify({
+                "version": non_db.version,
+                "since": since,
+                "changes": changes,
+            })
+
+    # the client is too far behind (or starts from scratch), so it has to start over with the full map
+    # the map has been serialized already, so we just need to embed it
+    snapshot = get_serialized_map(non_db).get_body()
+    prefix = '{{"version":{},"snapshot":'.format(non_db.version).encode()
+
+    if isinstance(snapshot, bytes):
+        return Response(b"".join([prefix, snapshot, b"}"]), mimetype="application/json")
+
+    # maps stored in SQLite are streamed from a file
+    def generate():
+        try:
+            yield prefix
+            yield from snapshot
+            yield b"}"
+
+        finally:
+            snapshot.close()
+
+    return Response(generate(), mimetype="application/json")
+
+
+def get_batch(key: str) -> List[str]:
     """
-    The main redirection handling view. It does not permit ``/`` values in names as of yet.
+    Read the list of strings a batch request should be performed for from the request body.
+
+    :param key: key of the list in the JSON object sent by the client
+    :return: list of strings
+    :raises BadRequest: if the request body is not valid
+    :raises RequestEntityTooLarge: if the batch is too large
     """
 
+    data = request.get_json(silent=True)
+
+    if not isinstance(data, dict) or not isinstance(data.get(key), list) or \
+            not all(isinstance(i, str) for i in data[key]):
+        raise BadRequest("request body must be a JSON object containing a list of strings called {}".format(key))
+
+    if len(data[key]) > int(current_app.config["API_BATCH_MAX_SIZE"]):
+        raise RequestEntityTooLarge("batches may contain at most {} items".format(
+            current_app.config["API_BATCH_MAX_SIZE"]
+        ))
+
+    return data[key]
+
+
+def stream_json_object(keys: Iterable[str], lookup: Callable, chunk_size: int = 1000) -> Iterable[str]:
+    """
+    Stream a JSON object mapping keys to the results of a lookup, or null if the lookup fails with a KeyError.
+    Large objects are sent in chunks, so they neither have to be kept in memory entirely, nor does the client have to
+    wait for the last lookup before receiving the first results.
+    """
+
+    yield "{"
+
+    chunk = []
+
+    # chunks have to be separated from each other, but the first one must not start with a comma
+    separator = ""
+
+    for key in keys:
+        try:
+            value = lookup(key)
+
+        except KeyError:
+            value = None
+
+        chunk.append("{}:{}".format(json.dumps(key), json.dumps(value)))
+
+        if len(chunk) >= chunk_size:
+            yield separator + ",".join(chunk)
+            separator = ","
+            chunk = []
+
+    if chunk:
+        yield separator + ",".join(chunk)
+
+    yield "}"
+
+
+@bp.route("/api/resolve.json", methods=["POST"])
+def api_resolve():
+    names = get_batch("names")
+
+    # the response is generated after this function has returned, so we have to make sure a concurrent reload does
+    # not cause the results to come from different maps
+    non_db = non_db_ext.non_db
+
+    return Response(stream_json_object(names, non_db.lookup_url_for_name), mimetype="application/json")
+
+
+@bp.route("/api/reverse.json", methods=["POST"])
+def api_reverse():
+    urls = get_batch("urls")
+
+    non_db = non_db_ext.non_db
+
+    def lookup(url):
+        return list(non_db.lookup_names_for_url(url))
+
+    return Response(stream_json_object(urls, lookup), mimetype="application/json")
+
+
+@bp.route("/api/metrics")
+def api_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@bp.route("/api/top.json")
+def api_top():
+    if not analytics.enabled:
+        raise NotFound("hit analytics are disabled")
+
+    try:
+        limit = int(request.args.get("limit", 20))
+        days = int(request.args["days"]) if "days" in request.args else None
+
+    except ValueError:
+        raise BadRequest("limit and days must be integers")
+
+    if limit < 1:
+        raise BadRequest("limit must be at least 1")
+
+    kind = request.args.get("kind")
+
+    if kind not in (None, "static", "dynamic"):
+        raise BadRequest("kind must be static or dynamic")
+
+    return jsonify(top_names(analytics.path, limit=limit, days=days, kind=kind))
+
+
+@bp.route("/api/stats.json")
+def api_stats():
+    return jsonify({
+        "dynamic_redirects": get_dynamic_stats(),
+    })
+
+
+def is_reserved_name(name: str) -> bool:
     # The /api prefix is reserved, so if no other view handles a request like this,
     # we need to reply here accordingly
     # TODO: decide whether to decline all "/api.*" requests or only "/api"
-    if name.startswith("api"):
-        raise NotFound
+    return name.startswith("api")
 
-    try:
-        url = non_db_ext.non_db.lookup_url_for_name(name)
 
-    except KeyError:
+def render_not_found_page(non_db: NonDatabase, name: str) -> str:
+    suggestions = get_name_suggestions(current_app, non_db)
+
+    suggested_names = []
+
+    if suggestions is not None:
+        suggested_names = suggestions.suggest(
+            name, int(current_app.config["SUGGESTIONS_LIMIT"]), int(current_app.config["SUGGESTIONS_BUDGET"])
+        )
+
+    prefix = url_for("redirector.index")
+
+    return render_template(
+        "not_found.html",
+        name=name,
+        suggestions=[(suggested_name, make_short_url(prefix, suggested_name)) for suggested_name in suggested_names],
+    )
+
+
+# TODO: there is no real point in caching this endpoint for static routes, since the lookups in the NonDatabase are
+# likely faster than working with a cache
+@bp.route("/<path:name>")
+@instrument("shortener")
+def shortener(name: str):
+    """
+    The main redirection handling view. Names may contain ``/``, and prefix rules are taken into account. For unknown
+    names, similar names are suggested.
+    """
+
+    if is_reserved_name(name):
         raise NotFound
 
-    # depending on the configuration, we either return a "permanent" redirect with a small cache timeout, or a
-    # "temporary" one
-    max_age = current_app.config["STATIC_REDIRECTIONS_MAX_AGE"]
+    # status and headers only depend on the map and the configuration, so they are computed when the map is loaded
+    responses = get_static_redirect_responses(current_app, non_db_ext.non_db)
 
-    if not max_age:
-        max_age = 0
+    try:
+        key, headers = responses.match_name(name)
 
-    # make sure it's an int
-    max_age = int(max_age)
+    except KeyError:
+        # the instrumentation needs a response object to record the status
+        return Response(render_not_found_page(non_db_ext.non_db, name), status=404)
 
-    response = redirect(url, 302)
+    # names matching a rule are counted by the rule, so the number of labels is bounded by the size of the map
+    if metrics.per_name_hits:
+        metrics.inc("redirector_name_hits_total", (("name", key),))
 
-    if max_age > 0:
-        response.status_code = 301
-        response.headers["Cache-Control"] = "max-age={}".format(max_age)
+    analytics.record("static", key)
 
-    return response
+    return Response(status=responses.status, headers=headers)
@@ -0,0 +1,212 @@
+import datetime
+
+import pytest
+
+from redirector import analytics as analytics_module
+from redirector.analytics import HitAnalytics, analytics, connect, top_names, used_names
+
+from .view_fixtures import make_client
+
+
+@pytest.fixture
+def hit_analytics(tmpdir):
+    a = HitAnalytics()
+    a.path = str(tmpdir.join("analytics.db"))
+    return a
+
+
+def test_record_and_flush(hit_analytics):
+    for name in ["a", "b", "a", "a"]:
+        hit_analytics.record("static", name)
+
+    hit_analytics.record("dynamic", "/latest")
+
+    hit_analytics.flush()
+
+    # the counts must be added to the existing ones
+    hit_analytics.record("static", "b")
+    hit_analytics.flush()
+
+    assert [(entry["kind"], entry["name"], entry["hits"]) for entry in top_names(hit_analytics.path)] == [
+        ("static", "a", 3),
+        ("static", "b", 2),
+        ("dynamic", "/latest", 1),
+    ]
+
+    assert [entry["name"] for entry in top_names(hit_analytics.path, kind="dynamic")] == ["/latest"]
+    assert [entry["name"] for entry in top_names(hit_analytics.path, limit=1)] == ["a"]
+
+
+def test_days(hit_analytics):
+    old_day = (datetime.date.today() - datetime.timedelta(days=10)).isoformat()
+
+    with connect(hit_analytics.path) as connection:
+        connection.execute("INSERT INTO hits VALUES (?, 'static', 'old', 100)", [old_day])
+
+    hit_analytics.record("static", "new")
+    hit_analytics.flush()
+
+    assert [entry["name"] for entry in top_names(hit_analytics.path)] == ["old", "new"]
+    assert [entry["name"] for entry in top_names(hit_analytics.path, days=10)] == ["new"]
+    assert [entry["name"] for entry in top_names(hit_analytics.path, days=11)] == ["old", "new"]
+
+    assert used_names(hit_analytics.path) == {"old", "new"}
+    assert used_names(hit_analytics.path, days=1) == {"new"}
+
+
+def test_disabled():
+    a = HitAnalytics()
+
+    a.record("static", "a")
+
+    assert a._buffer == {}
+
+
+def test_buffer_is_bounded(hit_analytics):
+    hit_analytics.max_buffered_names = 2
+
+    # keep the background thread from flushing
+    hit_analytics._thread.ensure_started = lambda: None
+
+    for name in ["a", "b", "c", "d", "e", "a"]:
+        hit_analytics.record("static", name)
+
+    assert len(hit_analytics._buffer) == 4
+    assert hit_analytics.dropped == 1
+
+    hit_analytics.flush()
+
+    assert sum(entry["hits"] for entry in top_names(hit_analytics.path)) == 5
+
+
+def test_hits_kept_if_flush_fails(tmpdir, hit_analytics):
+    hit_analytics.record("static", "a")
+
+    # a directory cannot be opened as a database
+    path = hit_analytics.path
+    hit_analytics.path = str(tmpdir)
+
+    with pytest.raises(Exception):
+        hit_analytics.flush()
+
+    hit_analytics.path = path
+    hit_analytics.record("static", "a")
+    hit_analytics.flush()
+
+    assert top_names(hit_analytics.path)[0]["hits"] == 2
+
+
+@pytest.fixture
+def analytics_app(tmpdir, test_data):
+    app, test_client = make_client(tmpdir, test_data, config={"ANALYTICS_DB": str(tmpdir.join("analytics.db"))})
+
+    yield app, test_client
+
+    # do not let other tests write to the database
+    analytics.path = None
+
+
+@pytest.mark.parametrize("fast_path", [False, True])
+def test_hits_recorded_by_views(tmpdir, test_data, fast_path):
+    config = {"ANALYTICS_DB": str(tmpdir.join("analytics.db")), "STATIC_REDIRECTIONS_FAST_PATH": fast_path}
+    _, test_client = make_client(tmpdir, test_data, config=config)
+
+    try:
+        test_client.get("/test1")
+        test_client.get("/test2")
+        test_client.get("/test1")
+        test_client.get("/unknown")
+
+        analytics.flush()
+
+        response = test_client.get("/api/top.json")
+
+        assert response.status_code == 200
+        assert [(entry["name"], entry["hits"]) for entry in response.json] == [("test1", 2), ("test2", 1)]
+
+    finally:
+        analytics.path = None
+
+
+@pytest.mark.parametrize("fast_path", [False, True])
+def test_hits_of_rules_are_recorded_by_rule(tmpdir, fast_path):
+    data = {
+        "https://test.test": ["test1"],
+        "https://github.com/": ["gh/*"],
+        "https://dl.test/<version>": ["<version>"],
+    }
+
+    config = {"ANALYTICS_DB": str(tmpdir.join("analytics.db")), "STATIC_REDIRECTIONS_FAST_PATH": fast_path}
+    _, test_client = make_client(tmpdir, data, config=config)
+
+    try:
+        for path in ["/gh/a", "/gh/b", "/gh/c/d", "/1.0", "/2.0", "/test1"]:
+            assert test_client.get(path).status_code == 301
+
+        analytics.flush()
+
+        response = test_client.get("/api/top.json")
+
+        assert [(entry["name"], entry["hits"]) for entry in response.json] == [
+            ("gh/*", 3), ("<version>", 2), ("test1", 1)
+        ]
+
+    finally:
+        analytics.path = None
+
+
+def test_api_disabled(test_data_client):
+    assert test_data_client.get("/api/top.json").status_code == 404
+
+
+def test_api_invalid_parameters(analytics_app):
+    _, test_client = analytics_app
+
+    assert test_client.get("/api/top.json?limit=abc").status_code == 400
+    assert test_client.get("/api/top.json?kind=other").status_code == 400
+    assert test_client.get("/api/top.json?limit=0").status_code == 400
+    assert test_client.get("/api/top.json?limit=-1").status_code == 400
+
+
+def test_limit_is_capped(hit_analytics, monkeypatch):
+    monkeypatch.setattr(analytics_module, "MAX_TOP_LIMIT", 2)
+
+    for name in ["a", "b", "c"]:
+        hit_analytics.record("static", name)
+
+    hit_analytics.flush()
+
+    assert len(top_names(hit_analytics.path, limit=10)) == 2
+
+    with pytest.raises(ValueError):
+        top_names(hit_analytics.path, limit=-1)
+
+
+def test_cli(analytics_app):
+    app, test_client = analytics_app
+
+    test_client.get("/test3")
+    analytics.flush()
+
+    runner = app.test_cli_runner()
+
+    result = runner.invoke(args=["redirector", "top", "--kind", "static"])
+    assert result.exit_code == 0
+    assert "test3" in result.output
+
+    result = runner.invoke(args=["redirector", "top", "--limit", "-1"])
+    assert result.exit_code != 0
+    assert "--limit" in result.output
+
+    result = runner.invoke(args=["redirector", "unused"])
+    assert result.exit_code == 0
+    assert result.output.split() == ["test1", "test2"]
+
+
+def test_cli_disabled(test_data_client, test_data, tmpdir):
+    app, _ = make_client(tmpdir, test_data)
+
+    result = app.test_cli_runner().invoke(args=["redirector", "top"])
+
+    assert result.exit_code != 0
+    assert "ANALYTICS_DB" in result.output
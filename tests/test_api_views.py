@@ -1,3 +1,13 @@
+import gzip
+import json
+
+import pytest
+
+import redirector
+
+from .view_fixtures import make_client
+
+
 def test_urls_empty_client(empty_client):
     response = empty_client.get("/api/urls.json")
 
@@ -10,3 +20,169 @@ def test_index_with_data(test_data_client, test_data):
 
     assert response.status_code == 200
     assert response.json == test_data
+
+
+def test_stats(test_data_client):
+    response = test_data_client.get("/api/stats.json")
+
+    assert response.status_code == 200
+    assert set(response.json["dynamic_redirects"]) >= {"computed", "coalesced", "remote_coalesced"}
+
+
+def test_urls_gzip(test_data_client, test_data):
+    response = test_data_client.get("/api/urls.json", headers={"Accept-Encoding": "gzip"})
+
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert json.loads(gzip.decompress(response.data)) == test_data
+
+
+def test_urls_brotli(test_data_client, test_data):
+    brotli = pytest.importorskip("brotli")
+
+    response = test_data_client.get("/api/urls.json", headers={"Accept-Encoding": "gzip;q=0.5, br"})
+
+    assert response.headers["content-encoding"] == "br"
+    assert json.loads(brotli.decompress(response.data)) == test_data
+
+
+def test_urls_identity_if_gzip_not_acceptable(test_data_client, test_data):
+    response = test_data_client.get("/api/urls.json", headers={"Accept-Encoding": "gzip;q=0"})
+
+    assert "content-encoding" not in response.headers
+    assert response.json == test_data
+
+
+def test_urls_if_none_match(test_data_client):
+    response = test_data_client.get("/api/urls.json")
+    etag = response.headers["etag"]
+
+    assert etag.startswith('W/"')
+
+    response = test_data_client.get("/api/urls.json", headers={"If-None-Match": etag})
+
+    assert response.status_code == 304
+    assert response.data == b""
+    assert response.headers["etag"] == etag
+
+    response = test_data_client.get("/api/urls.json", headers={"If-None-Match": 'W/"something-else"'})
+
+    assert response.status_code == 200
+
+
+def test_urls_if_modified_since(test_data_client):
+    response = test_data_client.get("/api/urls.json")
+
+    response = test_data_client.get(
+        "/api/urls.json", headers={"If-Modified-Since": response.headers["last-modified"]}
+    )
+
+    assert response.status_code == 304
+
+
+def test_urls_etag_changes_on_reload(tmpdir):
+    app, test_client = make_client(tmpdir, {"https://test.test": ["test1"]})
+
+    etag = test_client.get("/api/urls.json").headers["etag"]
+
+    with open(app.config["REDIRECTIONS_MAP_PATH"], "w") as f:
+        json.dump({"https://other.test": ["other"]}, f)
+
+    assert redirector.non_db_ext.reload()
+
+    response = test_client.get("/api/urls.json", headers={"If-None-Match": etag})
+
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    assert response.json == {"https://other.test": ["other"]}
+
+
+def test_changes_snapshot(test_data_client, test_data):
+    response = test_data_client.get("/api/changes.json")
+
+    assert response.status_code == 200
+    assert response.json["snapshot"] == test_data
+    assert response.json["version"] == redirector.non_db_ext.non_db.version
+
+
+def test_changes_invalid_since(test_data_client):
+    response = test_data_client.get("/api/changes.json?since=abc")
+
+    assert response.status_code == 400
+
+
+def test_changes_since(tmpdir):
+    app, test_client = make_client(tmpdir, {"https://test.test": ["test1", "test2"]})
+
+    version = test_client.get("/api/changes.json").json["version"]
+
+    response = test_client.get("/api/changes.json?since={}".format(version))
+    assert response.json == {"version": version, "since": version, "changes": {}}
+
+    with open(app.config["REDIRECTIONS_MAP_PATH"], "w") as f:
+        json.dump({"https://test.test": ["test1"], "https://other.test": ["other"]}, f)
+
+    assert redirector.non_db_ext.reload()
+
+    response = test_client.get("/api/changes.json?since={}".format(version))
+
+    assert response.json["version"] > version
+    assert response.json["changes"] == {"test2": None, "other": "https://other.test"}
+
+    # clients which are too far behind get a full snapshot
+    response = test_client.get("/api/changes.json?since={}".format(version - 1))
+
+    assert "changes" not in response.json
+    assert response.json["snapshot"] == {"https://test.test": ["test1"], "https://other.test": ["other"]}
+
+
+def test_resolve(test_data_client):
+    response = test_data_client.post("/api/resolve.json", json={"names": ["test1", "unknown", "test3"]})
+
+    assert response.status_code == 200
+    assert response.json == {"test1": "https://test.test", "unknown": None, "test3": "https://test.test"}
+
+
+def test_resolve_empty_batch(test_data_client):
+    response = test_data_client.post("/api/resolve.json", json={"names": []})
+
+    assert response.status_code == 200
+    assert response.json == {}
+
+
+# batches are streamed in chunks of 1000 items, so the last chunk can be full, partial, or the only one
+@pytest.mark.parametrize("count", [999, 1999, 2500])
+def test_resolve_large_batch(tmpdir, count):
+    test_data = {"https://test{}.test".format(i): ["test{}".format(i)] for i in range(count)}
+    _, test_client = make_client(tmpdir, test_data)
+
+    names = ["test{}".format(i) for i in range(count)] + ["unknown"]
+
+    response = test_client.post("/api/resolve.json", json={"names": names})
+
+    assert response.is_streamed
+    assert response.json == dict({"test{}".format(i): "https://test{}.test".format(i) for i in range(count)},
+                                 unknown=None)
+
+
+@pytest.mark.parametrize("data", [None, [], {}, {"names": "test1"}, {"names": [1, 2]}, {"urls": ["test1"]}])
+def test_resolve_invalid_request(test_data_client, data):
+    response = test_data_client.post("/api/resolve.json", json=data)
+
+    assert response.status_code == 400
+
+
+def test_resolve_batch_too_large(tmpdir, test_data):
+    _, test_client = make_client(tmpdir, test_data, config={"API_BATCH_MAX_SIZE": 2})
+
+    response = test_client.post("/api/resolve.json", json={"names": ["test1", "test2", "test3"]})
+
+    assert response.status_code == 413
+
+
+def test_reverse(test_data_client):
+    response = test_data_client.post("/api/reverse.json", json={"urls": ["https://test.test", "https://unknown.test"]})
+
+    assert response.status_code == 200
+    assert response.json == {"https://test.test": ["test1", "test2", "test3"], "https://unknown.test": None}
@@ -1,3 +1,4 @@
+import gc
 import json
 
 import pytest
@@ -58,3 +59,18 @@ def test_create_app_with_custom_redirections_file_path_from_environment(tmpdir,
         app = create_app()
 
     assert app.config[env_var_name] == env_var_value
+
+
+@pytest.mark.skipif(not hasattr(gc, "freeze"), reason="gc.freeze not available")
+def test_create_app_gc_freeze(tmpdir):
+    data_file = tmpdir.join("redirects.json")
+    data_file.write(json.dumps({"https://test.test": ["test"]}))
+
+    gc.unfreeze()
+
+    try:
+        create_app({"REDIRECTIONS_MAP_PATH": str(data_file), "GC_FREEZE": "1"})
+        assert gc.get_freeze_count() > 0
+
+    finally:
+        gc.unfreeze()
@@ -0,0 +1,208 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from flask import abort
+from werkzeug.exceptions import NotFound
+
+from redirector.callback_guard import CallbackGuard, CallbackUnavailable, CircuitBreaker
+
+
+@pytest.fixture
+def guard():
+    guard = CallbackGuard()
+    guard.deadline = 0.1
+    guard.max_workers = 2
+    guard.breaker_threshold = 2
+    guard.breaker_reset_timeout = 10
+    return guard
+
+
+def fail():
+    raise RuntimeError("upstream error")
+
+
+def test_circuit_breaker_opens_after_threshold():
+    breaker = CircuitBreaker(2, 10)
+
+    breaker.record_failure(0)
+    assert breaker.state(0) == CircuitBreaker.CLOSED
+    assert breaker.allow(0)
+
+    breaker.record_failure(0)
+    assert breaker.state(5) == CircuitBreaker.OPEN
+    assert not breaker.allow(5)
+
+
+def test_circuit_breaker_success_resets_failures():
+    breaker = CircuitBreaker(2, 10)
+
+    breaker.record_failure(0)
+    breaker.record_success()
+    breaker.record_failure(0)
+
+    assert breaker.state(0) == CircuitBreaker.CLOSED
+
+
+def test_circuit_breaker_half_open_allows_single_trial():
+    breaker = CircuitBreaker(1, 10)
+    breaker.record_failure(0)
+
+    assert breaker.state(10) == CircuitBreaker.HALF_OPEN
+    assert breaker.allow(10)
+    assert not breaker.allow(10)
+
+    # a failed trial opens the circuit again
+    breaker.record_failure(10)
+    assert not breaker.allow(15)
+
+    assert breaker.allow(20)
+    breaker.record_success()
+
+    assert breaker.state(20) == CircuitBreaker.CLOSED
+    assert breaker.allow(20)
+
+
+def test_circuit_breaker_disabled():
+    breaker = CircuitBreaker(0, 10)
+
+    for _ in range(10):
+        breaker.record_failure(0)
+
+    assert breaker.allow(0)
+
+
+def test_call(guard):
+    assert guard.call("/a", lambda n: n * 2, {"n": 21}) == 42
+
+
+def test_call_coroutine_function(guard):
+    async def callback(n):
+        await asyncio.sleep(0)
+        return n * 2
+
+    assert guard.call("/a", callback, {"n": 21}) == 42
+
+
+def test_call_timeout(guard):
+    start = time.monotonic()
+
+    with pytest.raises(CallbackUnavailable) as e:
+        guard.call("/a", lambda: time.sleep(1), {})
+
+    assert e.value.reason == "timeout"
+    assert time.monotonic() - start < 0.5
+
+
+def test_call_timeout_cancels_coroutine(guard):
+    cancelled = threading.Event()
+
+    async def callback():
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    with pytest.raises(CallbackUnavailable) as e:
+        guard.call("/a", callback, {})
+
+    assert e.value.reason == "timeout"
+    assert cancelled.wait(1)
+
+
+def test_call_deadline_overrides_default(guard):
+    assert guard.call("/a", lambda: time.sleep(0.2) or "slow", {}, deadline=1) == "slow"
+
+
+def test_circuit_opens_after_failures(guard):
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            guard.call("/a", fail, {})
+
+    calls = []
+
+    with pytest.raises(CallbackUnavailable) as e:
+        guard.call("/a", calls.append, {"object": 1})
+
+    assert e.value.reason == "circuit_open"
+    assert calls == []
+
+    # the circuits of other routes are not affected
+    assert guard.call("/b", lambda: "b", {}) == "b"
+
+    assert guard.get_stats() == {
+        "callback_error": 2, "callback_timeout": 0, "callback_circuit_open": 1, "callback_overloaded": 0,
+        "open_circuits": 1,
+    }
+
+
+def test_busy_workers_reject_calls(guard):
+    release = threading.Event()
+
+    # callbacks which miss their deadline keep their worker busy
+    for _ in range(2):
+        with pytest.raises(CallbackUnavailable):
+            guard.call("/slow", release.wait, {})
+
+    with pytest.raises(CallbackUnavailable) as e:
+        guard.call("/other", lambda: "other", {})
+
+    assert e.value.reason == "overloaded"
+
+    release.set()
+
+    # the workers become available again once the callbacks have returned
+    for _ in range(20):
+        try:
+            assert guard.call("/other", lambda: "other", {}) == "other"
+            break
+
+        except CallbackUnavailable:
+            time.sleep(0.05)
+
+    else:
+        pytest.fail("workers have not become available again")
+
+
+def test_overloaded_trial_does_not_block_circuit(guard):
+    breaker = guard.breaker("/a")
+    breaker.record_failure(0)
+    breaker.record_failure(0)
+
+    assert breaker.allow()
+    breaker.cancel_trial()
+
+    assert breaker.allow()
+
+
+def test_timeout_error_of_callback_is_an_error(guard):
+    def callback():
+        raise TimeoutError("socket timed out")
+
+    # the callback has returned in time, it has just failed
+    with pytest.raises(TimeoutError, match="socket timed out"):
+        guard.call("/a", callback, {})
+
+    async def async_callback():
+        raise TimeoutError("socket timed out")
+
+    with pytest.raises(TimeoutError, match="socket timed out"):
+        guard.call("/b", async_callback, {})
+
+    stats = guard.get_stats()
+    assert stats["callback_error"] == 2
+    assert stats["callback_timeout"] == 0
+
+
+def test_http_exceptions_are_not_failures(guard):
+    def callback():
+        abort(404)
+
+    for _ in range(3):
+        with pytest.raises(NotFound):
+            guard.call("/a", callback, {})
+
+    assert guard.breaker("/a").state() == CircuitBreaker.CLOSED
+    assert guard.get_stats()["callback_error"] == 0
@@ -0,0 +1,64 @@
+import pytest
+
+from redirector.change_log import ChangeLog, compute_changes
+
+
+def test_compute_changes():
+    old = {"a": "https://a.test", "b": "https://b.test", "c": "https://c.test"}
+    new = {"a": "https://a.test", "b": "https://other.test", "d": "https://d.test"}
+
+    assert compute_changes(old, new) == {"b": "https://other.test", "c": None, "d": "https://d.test"}
+
+
+def test_compute_changes_no_changes():
+    assert compute_changes({"a": "https://a.test"}, {"a": "https://a.test"}) == {}
+
+
+def test_empty_change_log():
+    change_log = ChangeLog(10)
+
+    assert change_log.changes_since(10) == {}
+    assert change_log.changes_since(9) is None
+    assert change_log.changes_since(11) is None
+
+
+def test_changes_since():
+    change_log = ChangeLog(1).extend(2, {"a": "https://a.test"}).extend(3, {"b": "https://b.test", "a": None})
+
+    assert change_log.version == 3
+    assert change_log.changes_since(1) == {"a": None, "b": "https://b.test"}
+    assert change_log.changes_since(2) == {"a": None, "b": "https://b.test"}
+    assert change_log.changes_since(3) == {}
+
+    # versions in between are treated like the last version before them
+    change_log = ChangeLog(10).extend(20, {"a": "https://a.test"}).extend(30, {"b": "https://b.test"})
+    assert change_log.changes_since(25) == {"b": "https://b.test"}
+
+
+def test_extend_does_not_modify_log():
+    change_log = ChangeLog(1)
+    change_log.extend(2, {"a": "https://a.test"})
+
+    assert change_log.version == 1
+    assert change_log.changes_since(1) == {}
+
+
+@pytest.mark.parametrize("max_changes, oldest_known_version", [(1, 3), (2, 2), (3, 1)])
+def test_change_log_is_bounded(max_changes, oldest_known_version):
+    change_log = ChangeLog(1, max_changes=max_changes)
+
+    for version, name in [(2, "a"), (3, "b"), (4, "c")]:
+        change_log = change_log.extend(version, {name: "https://{}.test".format(name)})
+
+    for version in range(1, 5):
+        if version >= oldest_known_version:
+            assert change_log.changes_since(version) is not None
+        else:
+            assert change_log.changes_since(version) is None
+
+
+def test_too_many_changes_at_once():
+    change_log = ChangeLog(1, max_changes=2).extend(2, {"a": None}).extend(3, {"b": None, "c": None, "d": None})
+
+    assert change_log.changes_since(2) is None
+    assert change_log.changes_since(3) == {}
@@ -0,0 +1,110 @@
+import json
+
+import pytest
+from flask import Flask
+
+from redirector.compact_map import CompactMap
+from redirector.non_database import FlaskNonDatabase, NonDatabase
+
+
+@pytest.fixture
+def data():
+    return {
+        "https://bla.com": ["bla", "bla1"],
+        "https://bla2.com": ["bla2"],
+        "https://a.com": ["zzz", "aaa"],
+        "https://empty.com": [],
+    }
+
+
+def test_compact_map_lookups(data):
+    compact_map = CompactMap(data)
+
+    assert dict(compact_map.names_to_urls) == NonDatabase(data).names_to_urls
+    assert {url: list(names) for url, names in compact_map.urls_to_names.items()} == data
+
+    # order should be the same as in the source
+    assert list(compact_map.urls_to_names) == list(data)
+
+    for url, names in data.items():
+        assert compact_map.urls_to_names[url] == tuple(names)
+
+        for name in names:
+            assert compact_map.names_to_urls[name] == url
+
+
+@pytest.mark.parametrize("key", ["", "0", "bla0", "zzzz", "https://bla.com"])
+def test_compact_map_missing_names(data, key):
+    compact_map = CompactMap(data)
+
+    with pytest.raises(KeyError):
+        compact_map.names_to_urls[key]
+
+    assert key not in compact_map.names_to_urls
+
+
+@pytest.mark.parametrize("key", ["", "https://", "https://bla1.com", "https://zzz.com", "bla"])
+def test_compact_map_missing_urls(data, key):
+    compact_map = CompactMap(data)
+
+    with pytest.raises(KeyError):
+        compact_map.urls_to_names[key]
+
+
+def test_compact_map_empty():
+    compact_map = CompactMap({})
+
+    assert len(compact_map.urls_to_names) == 0
+    assert len(compact_map.names_to_urls) == 0
+
+    with pytest.raises(KeyError):
+        compact_map.names_to_urls["test"]
+
+    with pytest.raises(KeyError):
+        compact_map.urls_to_names["https://test.com"]
+
+
+def test_non_db_compact_lookups(data):
+    non_db = NonDatabase(data, compact=True)
+
+    assert non_db.lookup_url_for_name("bla1") == "https://bla.com"
+
+    # the names are returned without copying, which is safe since tuples are immutable
+    names = non_db.lookup_names_for_url("https://bla.com")
+    assert names == ("bla", "bla1")
+    assert non_db.lookup_names_for_url("https://bla.com") is names
+
+    with pytest.raises(KeyError):
+        non_db.lookup_url_for_name("test")
+
+
+def test_non_db_compact_validation():
+    with pytest.raises(ValueError):
+        NonDatabase({"https://bla.com": ["test"], "https://bla2.com": ["test"]}, compact=True)
+
+
+@pytest.mark.parametrize("value,compact", [(True, True), ("1", True), ("true", True), ("0", False), ("", False)])
+def test_flask_ext_compact_config(tmpdir, data, value, compact):
+    tmpfile = tmpdir.join("test.json")
+
+    with open(tmpfile, "w") as f:
+        json.dump(data, f)
+
+    app = Flask(__name__)
+    app.config["REDIRECTIONS_MAP_PATH"] = str(tmpfile)
+    app.config["REDIRECTIONS_MAP_COMPACT"] = value
+
+    ext = FlaskNonDatabase(app)
+
+    assert isinstance(ext.non_db.lookup_names_for_url("https://bla.com"), tuple) is compact
+
+    # reloaded instances must use the same mode
+    assert ext.reload()
+    assert ext.non_db.compact is compact
+
+
+def test_non_db_compact_prefix_rules():
+    non_db = NonDatabase({"https://github.com/org/": ["gh/*"], "https://docs.test": ["docs/install"]}, compact=True)
+
+    assert non_db.lookup_url_for_name("gh/repo") == "https://github.com/org/repo"
+    assert non_db.lookup_url_for_name("docs/install") == "https://docs.test"
@@ -0,0 +1,143 @@
+import json
+
+import pytest
+
+from redirector import create_app
+from redirector import compiled_map as compiled_map_module
+from redirector.compiled_map import MAGIC, CompiledMap, compile_map, is_compiled_map
+from redirector.non_database import NonDatabase
+
+
+@pytest.fixture
+def data():
+    return {
+        "https://bla.com": ["bla", "bla1"],
+        "https://bla2.com": ["bla2"],
+        "https://ünicöde.com/ä": ["ü", "ö"],
+    }
+
+
+@pytest.fixture
+def compiled_file(tmpdir, data):
+    filename = str(tmpdir.join("redirects.bin"))
+    compile_map(data, filename)
+    return filename
+
+
+def test_compiled_map_lookups(compiled_file, data):
+    compiled_map = CompiledMap(compiled_file)
+
+    assert compiled_map.names_count == 5
+    assert compiled_map.urls_count == 3
+
+    assert compiled_map.urls_to_names == data
+    assert compiled_map.names_to_urls == NonDatabase(data).names_to_urls
+
+    # order should be the same as in the source
+    assert list(compiled_map.urls_to_names) == list(data)
+
+    assert compiled_map.names_to_urls["ü"] == "https://ünicöde.com/ä"
+    assert compiled_map.urls_to_names["https://bla.com"] == ["bla", "bla1"]
+
+
+def test_compiled_map_missing_keys(compiled_file):
+    compiled_map = CompiledMap(compiled_file)
+
+    with pytest.raises(KeyError):
+        compiled_map.names_to_urls["test"]
+
+    with pytest.raises(KeyError):
+        compiled_map.urls_to_names["https://test.com"]
+
+    assert "test" not in compiled_map.names_to_urls
+    assert "bla" in compiled_map.names_to_urls
+
+
+def test_compiled_map_empty(tmpdir):
+    filename = str(tmpdir.join("redirects.bin"))
+    compile_map({}, filename)
+
+    compiled_map = CompiledMap(filename)
+
+    assert compiled_map.urls_to_names == {}
+    assert compiled_map.names_to_urls == {}
+
+    with pytest.raises(KeyError):
+        compiled_map.names_to_urls["test"]
+
+
+def test_non_db_loads_compiled_map(compiled_file, data):
+    assert is_compiled_map(compiled_file)
+
+    non_db = NonDatabase(compiled_file)
+
+    assert non_db.lookup_url_for_name("bla1") == "https://bla.com"
+    assert non_db.lookup_names_for_url("https://bla2.com") == ["bla2"]
+
+    with pytest.raises(KeyError):
+        non_db.lookup_url_for_name("test")
+
+
+def test_compile_command(tmpdir, data):
+    source = str(tmpdir.join("redirects.json"))
+    destination = str(tmpdir.join("redirects.bin"))
+
+    with open(source, "w") as f:
+        json.dump(data, f)
+
+    assert not is_compiled_map(source)
+
+    app = create_app({"REDIRECTIONS_MAP_PATH": source})
+
+    result = app.test_cli_runner().invoke(args=["redirector", "compile", source, destination])
+
+    assert result.exit_code == 0, result.output
+    assert is_compiled_map(destination)
+
+    # the compiled map can be used as a drop-in replacement
+    test_client = create_app({"REDIRECTIONS_MAP_PATH": destination}).test_client()
+
+    assert test_client.get("/api/urls.json").json == data
+    assert test_client.get("/bla2").headers["location"] == "https://bla2.com"
+
+
+def test_non_db_compiled_map_prefix_rules(tmpdir):
+    filename = str(tmpdir.join("redirects.bin"))
+    compile_map({"https://github.com/org/": ["gh/*"], "https://docs.test": ["docs/install"]}, filename)
+
+    non_db = NonDatabase(filename)
+
+    assert non_db.lookup_url_for_name("gh/repo") == "https://github.com/org/repo"
+    assert non_db.lookup_url_for_name("docs/install") == "https://docs.test"
+
+
+def test_compiled_map_rules(tmpdir, monkeypatch):
+    filename = str(tmpdir.join("redirects.bin"))
+    compile_map({
+        "https://github.com/org/": ["gh/*", "github"],
+        "https://docs.test": ["docs/install"],
+        "https://dl.test/<version>": ["release/<version>"],
+    }, filename)
+
+    assert CompiledMap(filename).rules() == [
+        ("gh/*", "https://github.com/org/"), ("release/<version>", "https://dl.test/<version>")
+    ]
+
+    def fail(*args):
+        raise AssertionError("the entire map has been decoded")
+
+    monkeypatch.setattr(compiled_map_module._URLsToNamesItemsView, "__iter__", fail)
+
+    # the trie is built from the rules only
+    non_db = NonDatabase(filename)
+    assert non_db.lookup_url_for_name("release/1.0") == "https://dl.test/1.0"
+
+
+def test_compiled_map_other_format_version(compiled_file):
+    with open(compiled_file, "r+b") as f:
+        f.write(MAGIC[:-1] + b"\x01")
+
+    assert is_compiled_map(compiled_file)
+
+    with pytest.raises(ValueError, match="different format version"):
+        CompiledMap(compiled_file)
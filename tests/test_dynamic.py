@@ -0,0 +1,557 @@
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+from flask import abort, redirect, request
+
+from redirector import cache, dynamic_redirect
+from redirector.async_support import BackgroundThread, EventLoopThread, event_loop
+from redirector.dynamic import _compute_once_across_processes, get_stats
+from redirector.metrics import metrics
+from redirector.refresh import refresh_scheduler
+from redirector.single_flight import FlightTimeout, SingleFlight
+from redirector.tiered_cache import tiered_cache
+
+from .view_fixtures import make_client
+
+
+# dynamic routes are registered globally and must be registered before any app is created, i.e., on import
+calls = {}
+
+
+@dynamic_redirect("/test-dynamic-async/<int:n>")
+async def dynamic_async(n):
+    calls[n] = calls.get(n, 0) + 1
+
+    # the request context must be available in the coroutine
+    path = request.path
+
+    await asyncio.sleep(0.2)
+
+    return redirect("https://async.test/{}?path={}".format(n, path))
+
+
+@dynamic_redirect("/test-dynamic-async-error")
+async def dynamic_async_error():
+    raise RuntimeError("upstream error")
+
+
+coalescing_calls = []
+
+
+@dynamic_redirect("/test-dynamic-coalescing/<int:n>")
+def dynamic_coalescing(n):
+    coalescing_calls.append(n)
+    time.sleep(0.2)
+    return redirect("https://coalescing.test/{}".format(n))
+
+
+refresh_state = {}
+
+
+@dynamic_redirect("/test-dynamic-refresh", timeout=100)
+def dynamic_refresh():
+    if refresh_state["fail"]:
+        raise RuntimeError("upstream error")
+
+    refresh_state["counter"] += 1
+
+    return redirect("https://refresh.test/{}".format(refresh_state["counter"]))
+
+
+upstream_state = {}
+
+
+@dynamic_redirect("/test-dynamic-upstream/<int:n>")
+def dynamic_upstream(n):
+    upstream_state["calls"] += 1
+
+    if upstream_state["hang"]:
+        upstream_state["release"].wait(1)
+
+    return redirect("https://upstream.test/{}".format(n))
+
+
+@dynamic_redirect("/test-dynamic-fallback", fallback_url="https://fallback.test")
+def dynamic_fallback():
+    raise RuntimeError("upstream error")
+
+
+@dynamic_redirect("/test-dynamic-abort", fallback_url="https://fallback.test")
+def dynamic_abort():
+    abort(404)
+
+
+@pytest.fixture
+def client(tmpdir, test_data):
+    _, test_client = make_client(tmpdir, test_data)
+    return test_client
+
+
+@pytest.fixture
+def refresh_client(tmpdir, test_data):
+    refresh_state.update(counter=0, fail=False)
+
+    _, test_client = make_client(tmpdir, test_data, {"DYNAMIC_REDIRECTS_REFRESH": "1"})
+    return test_client
+
+
+def test_async_dynamic_redirect(client):
+    response = client.get("/test-dynamic-async/1")
+
+    assert response.status_code == 302
+    assert response.headers["location"] == "https://async.test/1?path=/test-dynamic-async/1"
+
+
+def test_async_dynamic_redirect_cached(client):
+    for _ in range(3):
+        assert client.get("/test-dynamic-async/2").status_code == 302
+
+    assert calls[2] == 1
+
+
+def test_async_dynamic_redirect_concurrency(client):
+    responses = []
+
+    def request_name(n):
+        responses.append(client.get("/test-dynamic-async/{}".format(n)))
+
+    threads = [threading.Thread(target=request_name, args=(n,)) for n in range(100, 110)]
+
+    start = time.monotonic()
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    # the upstream lookups run concurrently on the event loop, so this takes about as long as a single lookup
+    assert time.monotonic() - start < 1
+    assert [response.status_code for response in responses] == [302] * 10
+
+
+def test_async_dynamic_redirect_error(client):
+    client.application.testing = True
+
+    with pytest.raises(RuntimeError, match="upstream error"):
+        client.get("/test-dynamic-async-error")
+
+
+def test_event_loop_thread():
+    async def coro():
+        return asyncio.get_event_loop()
+
+    loop = event_loop.run(coro())
+    assert event_loop.run(coro()) is loop
+
+
+def test_event_loop_thread_timeout():
+    loop_thread = EventLoopThread()
+
+    with pytest.raises(Exception) as e:
+        loop_thread.run(asyncio.sleep(1), timeout=0.01)
+
+    assert e.type.__name__ == "TimeoutError"
+
+
+def test_background_thread_started_once():
+    started = []
+    release = threading.Event()
+
+    def run():
+        started.append(threading.current_thread().name)
+        release.wait(5)
+
+    thread = BackgroundThread(run, "test-background-thread")
+    assert not thread.running
+
+    for _ in range(3):
+        thread.ensure_started()
+
+    release.set()
+
+    assert thread.running
+    assert started == ["test-background-thread"]
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires fork()")
+def test_background_thread_restarted_after_fork():
+    release = threading.Event()
+    thread = BackgroundThread(lambda: release.wait(5), "test-background-thread")
+    thread.ensure_started()
+
+    pid = os.fork()
+
+    if pid == 0:
+        # threads do not survive forking
+        running_before = thread.running
+        thread.ensure_started()
+        os._exit(0 if not running_before and thread.running else 1)
+
+    _, status = os.waitpid(pid, 0)
+    release.set()
+
+    assert os.WEXITSTATUS(status) == 0
+
+
+def get_refresh_location(client):
+    response = client.get("/test-dynamic-refresh")
+    assert response.status_code == 302
+    return response.headers["location"]
+
+
+@pytest.fixture
+def upstream_client(tmpdir, test_data):
+    upstream_state.update(calls=0, hang=False, release=threading.Event())
+
+    config = {"DYNAMIC_REDIRECTS_CALLBACK_TIMEOUT": "0.1", "DYNAMIC_REDIRECTS_BREAKER_THRESHOLD": "2"}
+    _, test_client = make_client(tmpdir, test_data, config)
+
+    yield test_client
+
+    upstream_state["release"].set()
+
+
+def expire(client, path):
+    # removes a value from both cache tiers, but not the last good value
+    with client.application.app_context():
+        cache.delete("dynamic/{}".format(path))
+        tiered_cache.clear()
+
+
+def test_timeout_serves_last_good_value(upstream_client):
+    assert upstream_client.get("/test-dynamic-upstream/1").headers["location"] == "https://upstream.test/1"
+
+    upstream_state["hang"] = True
+    expire(upstream_client, "/test-dynamic-upstream/1")
+
+    start = time.monotonic()
+    response = upstream_client.get("/test-dynamic-upstream/1")
+
+    assert time.monotonic() - start < 0.5
+    assert response.headers["location"] == "https://upstream.test/1"
+    assert get_stats()["served_last_good"] >= 1
+
+
+def test_timeout_without_last_good_value(upstream_client):
+    upstream_state["hang"] = True
+
+    start = time.monotonic()
+    response = upstream_client.get("/test-dynamic-upstream/2")
+
+    assert time.monotonic() - start < 0.5
+    assert response.status_code == 504
+
+
+def test_open_circuit_fails_fast(upstream_client):
+    upstream_state["hang"] = True
+
+    for n in range(3, 5):
+        assert upstream_client.get("/test-dynamic-upstream/{}".format(n)).status_code == 504
+
+    assert upstream_state["calls"] == 2
+
+    # the upstream service is not asked anymore
+    response = upstream_client.get("/test-dynamic-upstream/5")
+
+    assert response.status_code == 503
+    assert upstream_state["calls"] == 2
+    assert get_stats()["open_circuits"] == 1
+
+    # static redirections are not affected
+    assert upstream_client.get("/test1").status_code == 301
+
+
+def test_fallback_url(upstream_client):
+    response = upstream_client.get("/test-dynamic-fallback")
+
+    assert response.status_code == 302
+    assert response.headers["location"] == "https://fallback.test"
+
+
+def test_http_errors_of_callback_are_passed_on(upstream_client):
+    with upstream_client.application.app_context():
+        cache.set("dynamic//test-dynamic-abort/last-good", redirect("https://stale.test"))
+
+    stats_before = get_stats()
+
+    # neither the last good value nor the fallback URL are served, and the circuit stays closed
+    for _ in range(3):
+        assert upstream_client.get("/test-dynamic-abort").status_code == 404
+
+    stats = get_stats()
+    assert stats["open_circuits"] == 0
+    assert stats["callback_error"] - stats_before["callback_error"] == 0
+
+
+def test_global_fallback_url(tmpdir, test_data):
+    upstream_state.update(calls=0, hang=True, release=threading.Event())
+
+    config = {"DYNAMIC_REDIRECTS_CALLBACK_TIMEOUT": "0.1", "DYNAMIC_REDIRECTS_FALLBACK_URL": "https://global.test"}
+    _, test_client = make_client(tmpdir, test_data, config)
+
+    try:
+        response = test_client.get("/test-dynamic-upstream/6")
+
+    finally:
+        upstream_state["release"].set()
+
+    assert response.status_code == 302
+    assert response.headers["location"] == "https://global.test"
+
+
+def test_refresh_disabled_by_default(client):
+    refresh_state.update(counter=0, fail=False)
+
+    get_refresh_location(client)
+
+    assert refresh_scheduler.last_good_value("dynamic//test-dynamic-refresh") is None
+
+
+def test_refresh_before_expiry(refresh_client):
+    assert get_refresh_location(refresh_client) == "https://refresh.test/1"
+
+    # nothing is due yet
+    refresh_scheduler.refresh_due()
+    assert refresh_state["counter"] == 1
+
+    refresh_scheduler.refresh_due(time.monotonic() + 95)
+    assert refresh_state["counter"] == 2
+
+    # the refreshed value is served from the cache
+    assert get_refresh_location(refresh_client) == "https://refresh.test/2"
+    assert refresh_state["counter"] == 2
+
+
+def test_refresh_failure_keeps_last_good_value(refresh_client):
+    assert get_refresh_location(refresh_client) == "https://refresh.test/1"
+
+    refresh_state["fail"] = True
+
+    refresh_scheduler.refresh_due(time.monotonic() + 95)
+    assert get_refresh_location(refresh_client) == "https://refresh.test/1"
+
+    # even if the value has expired from the cache, the last good value is served
+    with refresh_client.application.app_context():
+        cache.clear()
+
+    assert get_refresh_location(refresh_client) == "https://refresh.test/1"
+
+    refresh_state["fail"] = False
+
+    # failed refreshes are retried soon
+    refresh_scheduler.refresh_due(time.monotonic() + 20)
+    assert get_refresh_location(refresh_client) == "https://refresh.test/2"
+
+
+def test_refresh_skipped_while_other_process_holds_lock(refresh_client):
+    get_refresh_location(refresh_client)
+
+    with refresh_client.application.app_context():
+        assert cache.add("dynamic//test-dynamic-refresh/lock", 1234)
+
+    now = time.monotonic()
+
+    refresh_scheduler.refresh_due(now + 95)
+    assert refresh_state["counter"] == 1
+
+    with refresh_client.application.app_context():
+        # the other process has refreshed the value
+        cache.set("dynamic//test-dynamic-refresh", redirect("https://other-process.test"))
+        cache.set("dynamic//test-dynamic-refresh/refreshed", True)
+        cache.delete("dynamic//test-dynamic-refresh/lock")
+
+    # the value refreshed by the other process is picked up instead of being refreshed again
+    refresh_scheduler.refresh_due(now + 105)
+    assert refresh_state["counter"] == 1
+
+    location = refresh_scheduler.last_good_value("dynamic//test-dynamic-refresh").headers["location"]
+    assert location == "https://other-process.test"
+
+
+def test_refresh_skips_idle_values(refresh_client):
+    get_refresh_location(refresh_client)
+
+    now = time.monotonic()
+
+    refresh_scheduler.refresh_due(now + 95)
+    assert refresh_state["counter"] == 2
+
+    # nobody has requested the value since the last refresh
+    refresh_scheduler.refresh_due(now + 200)
+    assert refresh_state["counter"] == 2
+    assert refresh_scheduler.last_good_value("dynamic//test-dynamic-refresh") is None
+
+
+def count_misses(route: str, result: str) -> float:
+    key = ("redirector_dynamic_misses_total", (("route", route), ("result", result)))
+    return metrics.snapshot().counters.get(key, 0)
+
+
+def test_concurrent_misses_are_coalesced(client):
+    stats_before = get_stats()
+    misses_before = {
+        result: count_misses("/test-dynamic-coalescing/<int:n>", result) for result in ("computed", "coalesced")
+    }
+
+    responses = []
+
+    def request_name():
+        responses.append(client.get("/test-dynamic-coalescing/1"))
+
+    threads = [threading.Thread(target=request_name) for _ in range(10)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    assert coalescing_calls.count(1) == 1
+    assert [response.headers["location"] for response in responses] == ["https://coalescing.test/1"] * 10
+
+    stats = get_stats()
+    assert stats["computed"] - stats_before["computed"] == 1
+    assert stats["coalesced"] - stats_before["coalesced"] == 9
+
+    # the counters are reported as metrics, too, so that they are merged across processes
+    route = "/test-dynamic-coalescing/<int:n>"
+    assert count_misses(route, "computed") - misses_before["computed"] == 1
+    assert count_misses(route, "coalesced") - misses_before["coalesced"] == 9
+
+
+def test_misses_are_coalesced_across_processes(client):
+    stats_before = get_stats()
+    remote_before = count_misses("/test-dynamic-coalescing/<int:n>", "remote_coalesced")
+
+    key = "dynamic//test-dynamic-coalescing/2"
+
+    with client.application.app_context():
+        # simulate another process computing the value
+        assert cache.add(key + "/lock", 1234)
+
+    def other_process():
+        time.sleep(0.2)
+
+        with client.application.app_context():
+            cache.set(key, redirect("https://other-process.test"))
+            cache.delete(key + "/lock")
+
+    thread = threading.Thread(target=other_process)
+    thread.start()
+
+    response = client.get("/test-dynamic-coalescing/2")
+    thread.join()
+
+    assert response.headers["location"] == "https://other-process.test"
+    assert 2 not in coalescing_calls
+    assert get_stats()["remote_coalesced"] - stats_before["remote_coalesced"] == 1
+    assert count_misses("/test-dynamic-coalescing/<int:n>", "remote_coalesced") - remote_before == 1
+
+
+def test_failed_computation_in_other_process(client):
+    with client.application.app_context():
+        cache.add("dynamic//test-dynamic-coalescing/3/lock", 1234)
+
+    def other_process():
+        time.sleep(0.1)
+
+        # lock is released without a value
+        with client.application.app_context():
+            cache.delete("dynamic//test-dynamic-coalescing/3/lock")
+
+    thread = threading.Thread(target=other_process)
+    thread.start()
+
+    response = client.get("/test-dynamic-coalescing/3")
+    thread.join()
+
+    assert response.headers["location"] == "https://coalescing.test/3"
+    assert coalescing_calls.count(3) == 1
+
+
+def test_value_stored_before_taking_lock_is_used(client):
+    key = "dynamic//test-dynamic-coalescing/5"
+
+    def compute():
+        raise AssertionError("value must not be computed again")
+
+    with client.application.test_request_context():
+        # another process has stored the value and released the lock after this process has missed the value
+        cache.set(key, "other process")
+
+        assert _compute_once_across_processes(key, compute, "/test-dynamic-coalescing/<int:n>") == "other process"
+        assert cache.get(key + "/lock") is None
+
+
+def test_lock_of_other_process_is_not_released(tmpdir, test_data):
+    _, test_client = make_client(tmpdir, test_data, {"DYNAMIC_REDIRECTS_LOCK_TIMEOUT": "1"})
+
+    key = "dynamic//test-dynamic-coalescing/6"
+
+    with test_client.application.test_request_context():
+        # another process is computing the value, but takes longer than the lock timeout
+        cache.add(key + "/lock", 1234)
+
+        assert _compute_once_across_processes(key, lambda: "this process", "/test-dynamic-coalescing/<int:n>") == \
+            "this process"
+        assert cache.get(key + "/lock") == 1234
+
+
+def test_wait_for_other_process_is_bounded_by_deadline(upstream_client):
+    key = "dynamic//test-dynamic-upstream/7"
+
+    with upstream_client.application.app_context():
+        # another process is computing the value, and takes longer than the deadline
+        cache.add(key + "/lock", 1234)
+
+    start = time.monotonic()
+    response = upstream_client.get("/test-dynamic-upstream/7")
+
+    assert time.monotonic() - start < 0.5
+    assert response.status_code == 504
+    assert upstream_state["calls"] == 0
+
+
+def test_wait_for_running_computation_is_bounded():
+    single_flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+
+    def leader():
+        single_flight.do("key", lambda: started.set() or release.wait(5))
+
+    thread = threading.Thread(target=leader)
+    thread.start()
+    started.wait(1)
+
+    start = time.monotonic()
+
+    with pytest.raises(FlightTimeout):
+        single_flight.do("key", lambda: None, timeout=0.1)
+
+    assert time.monotonic() - start < 0.5
+
+    release.set()
+    thread.join()
+
+
+def test_cached_values_are_served_from_l1(client):
+    client.get("/test-dynamic-coalescing/4")
+
+    stats_before = get_stats()
+
+    with client.application.app_context():
+        # a value in the shared cache is not looked up again
+        cache.set("dynamic//test-dynamic-coalescing/4", redirect("https://other-process.test"))
+
+    response = client.get("/test-dynamic-coalescing/4")
+
+    assert response.headers["location"] == "https://coalescing.test/4"
+    assert coalescing_calls.count(4) == 1
+
+    stats = get_stats()
+    assert stats["l1_hits"] - stats_before["l1_hits"] == 1
+    assert stats["l2_hits"] - stats_before["l2_hits"] == 0
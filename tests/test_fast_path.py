@@ -0,0 +1,93 @@
+import pytest
+
+from redirector.fast_path import StaticRedirectsFastPath
+
+from .view_fixtures import make_client
+
+
+data = {
+    "https://test.test": ["test1", "test2"],
+    "https://ünicöde.test": ["ü"],
+    "https://api.test": ["api1"],
+    "https://shadowed.test": ["shadowed", "v-shadowed"],
+}
+
+
+@pytest.fixture
+def app_and_client(tmpdir):
+    app, test_client = make_client(tmpdir, data, {"STATIC_REDIRECTIONS_FAST_PATH": "1"})
+
+    # used to check whether requests have been handled by Flask
+    app.flask_requests = 0
+
+    @app.before_request
+    def count_request():
+        app.flask_requests += 1
+
+    return app, test_client
+
+
+def test_fast_path_installed(app_and_client):
+    app, _ = app_and_client
+    assert isinstance(app.wsgi_app, StaticRedirectsFastPath)
+
+
+def test_fast_path_not_installed_by_default(tmpdir):
+    app, _ = make_client(tmpdir, data)
+    assert not isinstance(app.wsgi_app, StaticRedirectsFastPath)
+
+
+@pytest.mark.parametrize("method", ["GET", "HEAD"])
+@pytest.mark.parametrize("name,location", [("test1", "https://test.test"), ("ü", "https://xn--nicde-lua2b.test")])
+def test_fast_path_static_redirection(app_and_client, method, name, location):
+    app, test_client = app_and_client
+
+    response = test_client.open("/{}?some=query".format(name), method=method)
+
+    assert response.status_code == 301
+    assert response.headers["location"] == location
+    assert response.headers["cache-control"] == "max-age=120"
+    assert response.data == b""
+
+    assert app.flask_requests == 0
+
+
+@pytest.mark.parametrize("path,status_code", [
+    ("/", 200),
+    ("/api/urls.json", 200),
+    ("/api1", 404),
+    ("/unknown", 404),
+    ("/test1/", 404),
+    ("/static/css/normalize.css", 200),
+])
+def test_fast_path_falls_through(app_and_client, path, status_code):
+    app, test_client = app_and_client
+
+    response = test_client.get(path)
+
+    assert response.status_code == status_code
+    assert app.flask_requests == 1
+
+
+def test_fast_path_falls_through_for_other_methods(app_and_client):
+    app, test_client = app_and_client
+
+    assert test_client.post("/test1").status_code == 405
+    assert app.flask_requests == 1
+
+
+def test_fast_path_respects_other_routes(app_and_client):
+    app, test_client = app_and_client
+
+    app.add_url_rule("/shadowed", "shadowed", lambda: "shadowed")
+    app.add_url_rule("/v-<x>", "variable", lambda x: "variable")
+
+    # the rules are collected when the middleware is created
+    app.wsgi_app = StaticRedirectsFastPath(app, app.wsgi_app.wsgi_app)
+
+    assert test_client.get("/shadowed").data == b"shadowed"
+    assert test_client.get("/v-shadowed").data == b"variable"
+    assert app.flask_requests == 2
+
+    assert test_client.get("/test2").status_code == 301
+    assert app.flask_requests == 2
@@ -0,0 +1,213 @@
+import json
+
+import pytest
+from flask import Flask
+
+from redirector import create_app
+from redirector.map_check import RouteShadowing, check_map, normalize_url
+from redirector.views import is_reserved_name
+
+
+@pytest.mark.parametrize("url,normalized", [
+    ("https://example.org/a", "https://example.org/a"),
+    ("https://example.org", "https://example.org/"),
+    ("HTTPS://Example.ORG:443/a", "https://example.org/a"),
+    ("http://example.org:80/a?", "http://example.org/a"),
+    ("http://example.org:8080/a", "http://example.org:8080/a"),
+    ("https://example.org/%2f", "https://example.org/%2F"),
+    ("https://example.org?a=/b", "https://example.org/?a=/b"),
+    ("https://User@Example.org/", "https://User@example.org/"),
+    ("https://ünicöde.com/ä", "https://xn--nicde-lua2b.com/%C3%A4"),
+    ("https://example.org/a b", "https://example.org/a%20b"),
+    ("http://[::1", "http://[::1"),
+])
+def test_normalize_url(url, normalized):
+    assert normalize_url(url) == normalized
+
+
+def write_map(path, text: str) -> str:
+    path.write(text)
+    return str(path)
+
+
+@pytest.fixture(params=[1, 2])
+def processes(request):
+    return request.param
+
+
+def test_check_valid_map(tmpdir, processes):
+    path = write_map(tmpdir.join("map.json"), json.dumps({"https://a.test": ["a", "b"], "https://b.test": ["c"]}))
+
+    report = check_map(path, processes=processes)
+
+    assert report.problems == []
+    assert report.names_count == 3
+    assert report.urls_count == 2
+    assert report.files_count == 1
+
+
+def test_check_reports_all_problems(tmpdir, processes, monkeypatch):
+    # make sure entries are spread across multiple chunks
+    monkeypatch.setattr("redirector.map_check.CHUNK_SIZE", 2)
+
+    path = write_map(tmpdir.join("map.json"), "\n".join([
+        "{",
+        '    "https://a.test": ["a", "b"],',
+        '    "https://b.test": ["a", "bad/"],',
+        '    "https://c.test": ["c"],',
+        '    "https://A.test/": ["d"],',
+        '    "https://c.test": ["e"],',
+        '    "https://e.test": ["b", "/bad"]',
+        "}",
+    ]))
+
+    report = check_map(path, processes=processes)
+
+    assert [(problem.lineno, problem.kind) for problem in report.problems] == [
+        (3, "invalid_name"),
+        (3, "name_collision"),
+        (5, "similar_urls"),
+        (6, "duplicate_url"),
+        (7, "invalid_name"),
+        (7, "name_collision"),
+    ]
+
+    assert str(report.problems[0]) == \
+        "{}:3:5: invalid_name: names must not be empty, start or end with a / or contain empty segments: bad/".format(
+            path
+        )
+
+    assert report.problems[1].message == \
+        "Name collision: a is used for (at least) both URLs https://a.test and https://b.test"
+
+    # the names of the replaced definition of a URL are not used anymore
+    assert report.names_count == 4
+
+
+def test_check_ambiguous_rules(tmpdir):
+    path = write_map(tmpdir.join("map.json"), "\n".join([
+        "{",
+        '    "https://a.com/<x>": ["a/<x>"],',
+        '    "https://b.com/<y>": ["<y>/b"],',
+        '    "https://c.com/": ["<z>/c", "c/*"],',
+        '    "https://d.com/<v>": ["d/<v>/<w>", "<v>/d/<w>"]',
+        "}",
+    ]))
+
+    report = check_map(path, processes=1)
+
+    # every ambiguous rule is reported, not only the first one
+    assert [(problem.lineno, problem.kind) for problem in report.problems] == [
+        (3, "ambiguous_rules"),
+        (4, "ambiguous_rules"),
+        (5, "ambiguous_rules"),
+    ]
+
+    assert report.problems[0].message == "pattern rules a/<x> and <y>/b are ambiguous"
+
+
+def test_check_prefix_rule_url_without_trailing_slash(tmpdir):
+    path = write_map(tmpdir.join("map.json"), json.dumps({"https://example.org": ["ex/*"]}))
+
+    report = check_map(path, processes=1)
+
+    assert [(problem.kind, problem.message) for problem in report.problems] == [
+        ("invalid_name", "URL https://example.org of prefix rule ex/* must end with a /"),
+    ]
+
+
+def test_check_syntax_error(tmpdir):
+    path = write_map(tmpdir.join("map.json"), '{\n    "https://a.test": ["a", "a"],\n    "https://b.test": "b"\n}')
+
+    report = check_map(path, processes=1)
+
+    assert [(problem.lineno, problem.kind) for problem in report.problems] == [(2, "name_collision"), (3, "syntax")]
+
+
+def test_check_shards(tmpdir, processes):
+    shards_dir = tmpdir.mkdir("shards")
+    write_map(shards_dir.join("a.json"), json.dumps({"https://a.test": ["a"], "https://b.test": ["b"]}))
+    write_map(shards_dir.join("b.json"), json.dumps({"https://b.test": ["c"], "https://c.test": ["a"]}))
+    write_map(shards_dir.join("c.json"), "{")
+
+    report = check_map(str(shards_dir), processes=processes)
+
+    assert report.files_count == 3
+    assert report.processes == (0 if processes == 1 else 2)
+    assert [(problem.filename, problem.kind) for problem in report.problems] == [
+        (str(shards_dir.join("b.json")), "duplicate_url"),
+        (str(shards_dir.join("b.json")), "name_collision"),
+        (str(shards_dir.join("c.json")), "syntax"),
+    ]
+
+
+def test_route_shadowing():
+    app = Flask(__name__)
+
+    app.add_url_rule("/", "index")
+    app.add_url_rule("/api/urls.json", "api_urls")
+    app.add_url_rule("/api/resolve.json", "api_resolve", methods=["POST"])
+    app.add_url_rule("/latest/", "latest")
+    app.add_url_rule("/release/<int:n>", "release")
+    app.add_url_rule("/<path:name>", "shortener")
+
+    shadowing = RouteShadowing(app.url_map, "shortener")
+
+    assert shadowing("test") is None
+    assert shadowing("release/latest") is None
+    assert shadowing("latest/a") is None
+    assert shadowing("release/1/a") is None
+
+    assert shadowing("api/urls.json") == "name api/urls.json is shadowed by route /api/urls.json"
+    assert shadowing("release/1") == "name release/1 is shadowed by route /release/<int:n>"
+
+    # GET requests are handled by the shortener
+    assert shadowing("api/resolve.json") is None
+
+    assert "redirected" in shadowing("latest")
+
+
+def test_check_shadowed_names(tmpdir):
+    path = write_map(tmpdir.join("map.json"), json.dumps({"https://a.test": ["a", "apidocs", "static/app.css"]}))
+
+    app = create_app({"REDIRECTIONS_MAP_PATH": path})
+    shadowing = RouteShadowing(app.url_map, is_reserved_name=is_reserved_name)
+
+    report = check_map(path, processes=1, shadowing=shadowing)
+
+    assert sorted(problem.message for problem in report.problems) == [
+        "name apidocs is reserved",
+        "name static/app.css is shadowed by route /static/<path:filename>",
+    ]
+
+
+def test_check_command(tmpdir):
+    path = write_map(tmpdir.join("map.json"), json.dumps({"https://a.test": ["a"]}))
+    broken_path = write_map(tmpdir.join("broken.json"), json.dumps({"https://a.test": ["a"], "https://b.test": ["a"]}))
+
+    runner = create_app({"REDIRECTIONS_MAP_PATH": path}).test_cli_runner()
+
+    result = runner.invoke(args=["redirector", "check", "--processes", "1"])
+
+    assert result.exit_code == 0, result.output
+    assert "checked 1 names for 1 URLs in 1 file(s): 0 problem(s) found" in result.output
+
+    result = runner.invoke(args=["redirector", "check", "--processes", "1", broken_path])
+
+    assert result.exit_code == 1
+    assert "name_collision: Name collision: a is used" in result.output
+    assert "1 problem(s) found" in result.output
+
+
+def test_check_command_without_map(tmpdir, monkeypatch):
+    # no path is configured, and there is no redirects.json in the working directory
+    monkeypatch.chdir(str(tmpdir))
+
+    with pytest.warns(UserWarning):
+        runner = create_app().test_cli_runner()
+
+    result = runner.invoke(args=["redirector", "check"])
+
+    assert result.exit_code == 1
+    assert "Error: the map redirects.json does not exist" in result.output
+    assert "Traceback" not in result.output
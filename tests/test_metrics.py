@@ -0,0 +1,257 @@
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from redirector.metrics import Metrics, instrument, metrics
+
+from .view_fixtures import make_client
+
+
+def parse_metrics(text: str) -> dict:
+    samples = {}
+
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+
+        name, value = line.rsplit(" ", 1)
+        samples[name] = float(value)
+
+    return samples
+
+
+def test_counters_and_histograms():
+    m = Metrics()
+
+    m.inc("requests_total", (("endpoint", "a"),))
+    m.inc("requests_total", (("endpoint", "a"),), 2)
+    m.inc("requests_total", (("endpoint", "b"),))
+
+    m.observe("duration_seconds", 0.003)
+    m.observe("duration_seconds", 0.2)
+
+    samples = parse_metrics(m.render())
+
+    assert samples['requests_total{endpoint="a"}'] == 3
+    assert samples['requests_total{endpoint="b"}'] == 1
+
+    assert samples['duration_seconds_bucket{le="0.001"}'] == 0
+    assert samples['duration_seconds_bucket{le="0.005"}'] == 1
+    assert samples['duration_seconds_bucket{le="0.25"}'] == 2
+    assert samples['duration_seconds_bucket{le="+Inf"}'] == 2
+    assert samples["duration_seconds_count"] == 2
+    assert samples["duration_seconds_sum"] == pytest.approx(0.203)
+
+
+def test_label_values_are_escaped():
+    m = Metrics()
+
+    m.inc("hits_total", (("name", 'a"b\\c\nd'),))
+
+    assert 'hits_total{name="a\\"b\\\\c\\nd"} 1' in m.render()
+
+
+def test_values_of_all_threads_are_merged():
+    m = Metrics()
+
+    def record():
+        for _ in range(100):
+            m.inc("requests_total")
+
+    threads = [threading.Thread(target=record) for _ in range(4)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    record()
+
+    assert parse_metrics(m.render())["requests_total"] == 500
+
+    # the values of terminated threads must be kept
+    assert parse_metrics(m.render())["requests_total"] == 500
+
+
+def test_values_of_all_processes_are_merged(tmpdir):
+    processes = []
+
+    for _ in range(3):
+        m = Metrics()
+        m.directory = str(tmpdir)
+        m.inc("requests_total")
+        m.observe("duration_seconds", 0.01, (("endpoint", "a"),))
+        m.flush()
+
+        processes.append(m)
+
+    samples = parse_metrics(processes[0].render())
+
+    assert samples["requests_total"] == 3
+    assert samples['duration_seconds_count{endpoint="a"}'] == 3
+
+    # the values of the collecting process must be up to date
+    processes[0].inc("requests_total")
+
+    assert parse_metrics(processes[0].render())["requests_total"] == 4
+
+
+def exited_pid() -> int:
+    # the process ID of a process which has exited
+    process = subprocess.Popen([sys.executable, "-c", ""])
+    process.wait()
+
+    return process.pid
+
+
+def test_values_of_exited_processes_are_aggregated(tmpdir):
+    m = Metrics()
+    m.directory = str(tmpdir)
+    m.inc("requests_total")
+    m.flush()
+
+    exited_filename = tmpdir.join("{}-abcdef12.json".format(exited_pid()))
+    exited_filename.write('{"counters": [["requests_total", [], 5]], "histograms": []}')
+
+    # counters must not decrease when a worker exits
+    assert parse_metrics(m.render())["requests_total"] == 6
+    assert not exited_filename.exists()
+
+    # the values are counted once only
+    assert parse_metrics(m.render())["requests_total"] == 6
+
+    other_filename = tmpdir.join("{}-12abcdef.json".format(exited_pid()))
+    other_filename.write('{"counters": [["requests_total", [], 2]], "histograms": []}')
+
+    assert parse_metrics(m.render())["requests_total"] == 8
+
+    assert sorted(name for name in os.listdir(str(tmpdir)) if name.endswith(".json")) == sorted([
+        os.path.basename(m._filename), "aggregate.json",
+    ])
+
+
+def test_directory_cleared_on_fresh_start(tmpdir):
+    tmpdir.join("aggregate.json").write('{"counters": [["requests_total", [], 5]], "histograms": [], '
+                                        '"process_group": -1}')
+    tmpdir.join("{}-abcdef12.json".format(exited_pid())).write(
+        '{"counters": [["requests_total", [], 3]], "histograms": []}'
+    )
+
+    # the files have been left behind by a server running in another process group
+    m = Metrics()
+    m.directory = str(tmpdir)
+    m._clear_previous_run()
+    m.inc("requests_total")
+
+    assert parse_metrics(m.render())["requests_total"] == 1
+
+    # workers started later by the same server keep the values
+    tmpdir.join("{}-abcdef12.json".format(exited_pid())).write(
+        '{"counters": [["requests_total", [], 3]], "histograms": []}'
+    )
+    assert parse_metrics(m.render())["requests_total"] == 4
+
+    m._clear_previous_run()
+    assert parse_metrics(m.render())["requests_total"] == 4
+
+
+def test_values_flushed_at_exit(tmpdir):
+    code = "\n".join([
+        "from flask import Flask",
+        "from redirector.metrics import Metrics",
+        "app = Flask(__name__)",
+        "app.config['METRICS_DIR'] = {!r}".format(str(tmpdir)),
+        "m = Metrics()",
+        "m.init_app(app)",
+        "m.inc('requests_total', amount=7)",
+    ])
+
+    # the process exits right away, before its values have been written regularly
+    subprocess.check_call([sys.executable, "-c", code], cwd=os.path.dirname(os.path.dirname(__file__)))
+
+    m = Metrics()
+    m.directory = str(tmpdir)
+
+    assert parse_metrics(m.render())["requests_total"] == 7
+
+
+def test_instrument_records_status():
+    @instrument("test")
+    def view(fail):
+        if fail:
+            from werkzeug.exceptions import NotFound
+            raise NotFound
+
+        return "ok"
+
+    before = parse_metrics(metrics.render())
+
+    view(False)
+
+    with pytest.raises(Exception):
+        view(True)
+
+    samples = parse_metrics(metrics.render())
+
+    for status in ("200", "404"):
+        key = 'redirector_requests_total{{endpoint="test",status="{}"}}'.format(status)
+        assert samples[key] - before.get(key, 0) == 1
+
+
+@pytest.mark.parametrize("fast_path", [False, True])
+def test_metrics_endpoint(tmpdir, test_data, fast_path):
+    _, test_client = make_client(tmpdir, test_data, config={"STATIC_REDIRECTIONS_FAST_PATH": fast_path})
+
+    before = parse_metrics(test_client.get("/api/metrics").data.decode())
+
+    test_client.get("/test1")
+    test_client.get("/test1")
+    test_client.get("/unknown")
+
+    response = test_client.get("/api/metrics")
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+
+    samples = parse_metrics(response.data.decode())
+
+    def increase(key):
+        return samples.get(key, 0) - before.get(key, 0)
+
+    assert increase('redirector_name_hits_total{name="test1"}') == 2
+    assert increase('redirector_requests_total{endpoint="shortener",status="301"}') == 2
+    assert increase('redirector_requests_total{endpoint="shortener",status="404"}') == 1
+    assert increase('redirector_request_duration_seconds_count{endpoint="shortener"}') == 3
+
+
+def test_name_hits_of_rules_are_counted_by_rule(tmpdir):
+    _, test_client = make_client(tmpdir, {"https://github.com/": ["gh/*"], "https://dl.test/<v>": ["dl/<v>"]})
+
+    before = parse_metrics(test_client.get("/api/metrics").data.decode())
+
+    for path in ["/gh/a", "/gh/b", "/dl/1.0"]:
+        test_client.get(path)
+
+    samples = parse_metrics(test_client.get("/api/metrics").data.decode())
+
+    def increase(key):
+        return samples.get(key, 0) - before.get(key, 0)
+
+    assert increase('redirector_name_hits_total{name="gh/*"}') == 2
+    assert increase('redirector_name_hits_total{name="dl/<v>"}') == 1
+    assert not any('name="gh/a"' in key for key in samples)
+
+
+def test_per_name_hits_can_be_disabled(tmpdir, test_data):
+    _, test_client = make_client(tmpdir, test_data, config={"METRICS_PER_NAME_HITS": "0"})
+
+    key = 'redirector_name_hits_total{name="test2"}'
+    before = parse_metrics(test_client.get("/api/metrics").data.decode()).get(key)
+
+    test_client.get("/test2")
+
+    assert parse_metrics(test_client.get("/api/metrics").data.decode()).get(key) == before
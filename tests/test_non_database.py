@@ -1,4 +1,5 @@
 import json
+import os
 
 import pytest
 
@@ -99,15 +100,99 @@ def test_construction_proper_data():
     assert non_db.names_to_urls == reverse_map
 
 
-def test_improper_name():
+@pytest.mark.parametrize("name", ["", "/test", "test/", "test//test", "test/*/test", "*/test"])
+def test_improper_name(name):
     data = {
-        "https://bla.com": ["test/test"],
+        "https://bla.com": [name],
     }
 
     with pytest.raises(ValueError):
         NonDatabase(data)
 
 
+def test_hierarchical_names_and_prefix_rules():
+    non_db = NonDatabase({
+        "https://docs.test/install": ["docs/install"],
+        "https://github.com/org/": ["gh/*"],
+        "https://github.com/other-org/": ["gh/other/*"],
+        "https://special.test": ["gh/special"],
+    })
+
+    assert non_db.lookup_url_for_name("docs/install") == "https://docs.test/install"
+
+    assert non_db.lookup_url_for_name("gh/repo") == "https://github.com/org/repo"
+    assert non_db.lookup_url_for_name("gh/repo/issues/1") == "https://github.com/org/repo/issues/1"
+    assert non_db.lookup_url_for_name("gh/") == "https://github.com/org/"
+
+    # the longest prefix wins
+    assert non_db.lookup_url_for_name("gh/other/repo") == "https://github.com/other-org/repo"
+
+    # exact names win over prefix rules
+    assert non_db.lookup_url_for_name("gh/special") == "https://special.test"
+
+    # the name of the rule itself is treated like any other name
+    assert non_db.lookup_url_for_name("gh/*") == "https://github.com/org/%2A"
+
+    for name in ["gh", "docs", "docs/install/more", "other/repo"]:
+        with pytest.raises(KeyError):
+            non_db.lookup_url_for_name(name)
+
+
+def test_prefix_rules_cannot_leave_the_path():
+    non_db = NonDatabase({"https://example.org/": ["ex/*"]})
+
+    # the rest of the name is percent-encoded, so it cannot add a query, fragment or user information
+    assert non_db.lookup_url_for_name("ex/@evil.com") == "https://example.org/%40evil.com"
+    assert non_db.lookup_url_for_name("ex/a?b=c#d") == "https://example.org/a%3Fb%3Dc%23d"
+    assert non_db.lookup_url_for_name("ex/a/b c") == "https://example.org/a/b%20c"
+
+    for name in ["ex/..", "ex/a/../b", "ex/.", "ex/./a"]:
+        with pytest.raises(KeyError):
+            non_db.lookup_url_for_name(name)
+
+    # otherwise, the rest of the name could change the host, e.g., https://example.org followed by @evil.com
+    with pytest.raises(ValueError, match="must end with a /"):
+        NonDatabase({"https://example.org": ["ex/*"]})
+
+
+def test_pattern_rules():
+    non_db = NonDatabase({
+        "https://example.org/dl/<version>/app.AppImage": ["release/<version>"],
+        "https://example.org/dl/latest/app.AppImage": ["release/latest"],
+        "https://example.org/releases/": ["release/*"],
+    })
+
+    assert non_db.lookup_url_for_name("release/1.0") == "https://example.org/dl/1.0/app.AppImage"
+
+    # exact names win over pattern rules, which win over prefix rules
+    assert non_db.lookup_url_for_name("release/latest") == "https://example.org/dl/latest/app.AppImage"
+    assert non_db.lookup_url_for_name("release/1.0/notes") == "https://example.org/releases/1.0/notes"
+
+    # the name of the rule itself is treated like any other name
+    assert non_db.lookup_url_for_name("release/<version>") == "https://example.org/dl/%3Cversion%3E/app.AppImage"
+
+
+def test_pattern_rule_values_are_encoded():
+    non_db = NonDatabase({"https://example.org/dl/<version>/app.AppImage": ["release/<version>"]})
+
+    assert non_db.lookup_url_for_name("release/1.0?x=1#") == "https://example.org/dl/1.0%3Fx%3D1%23/app.AppImage"
+    assert non_db.lookup_url_for_name("release/a b@c") == "https://example.org/dl/a%20b%40c/app.AppImage"
+
+    for name in ["release/..", "release/."]:
+        with pytest.raises(KeyError):
+            non_db.lookup_url_for_name(name)
+
+
+def test_ambiguous_pattern_rules():
+    with pytest.raises(ValueError, match="ambiguous"):
+        NonDatabase({"https://a.test/<a>": ["a/<a>"], "https://b.test/<b>": ["a/<b>"]})
+
+
+def test_prefix_rule_collision():
+    with pytest.raises(ValueError, match="Name collision"):
+        NonDatabase({"https://a.test/": ["gh/*"], "https://b.test/": ["gh/*"]})
+
+
 def test_name_collision_name():
     data = {
         "https://bla.com": ["test"],
@@ -132,3 +217,59 @@ def test_lookups():
     assert non_db.lookup_url_for_name("bla") == "https://bla.com"
     assert non_db.lookup_url_for_name("bla1") == "https://bla.com"
     assert non_db.lookup_url_for_name("bla2") == "https://bla2.com"
+
+
+def test_match_name():
+    non_db = NonDatabase({
+        "https://bla.com": ["bla"],
+        "https://github.com/org/": ["gh/*"],
+    })
+
+    assert non_db.match_name("bla") == ("bla", "https://bla.com")
+    assert non_db.match_name("gh/repo") == ("gh/*", "https://github.com/org/repo")
+
+    with pytest.raises(KeyError):
+        non_db.match_name("unknown")
+
+
+def test_failed_reload_keeps_data():
+    data = {
+        "https://bla.com": ["bla"],
+    }
+
+    non_db = NonDatabase(data)
+
+    broken_data = {
+        "https://bla.com": ["test"],
+        "https://bla2.com": ["test"],
+    }
+
+    with pytest.raises(ValueError):
+        non_db.load_data(broken_data)
+
+    assert non_db.urls_to_names == data
+    assert non_db.names_to_urls == {"bla": "https://bla.com"}
+
+
+def test_version_of_file(tmpdir):
+    path = str(tmpdir.join("redirects.json"))
+
+    with open(path, "w") as f:
+        json.dump({"https://a.test": ["a"]}, f)
+
+    assert NonDatabase(path).version == os.stat(path).st_mtime_ns
+
+
+def test_continue_change_log():
+    old_non_db = NonDatabase({"https://a.test": ["a", "b"], "https://b.test": ["c"]})
+
+    new_non_db = NonDatabase({"https://a.test": ["a"], "https://b.test": ["c"], "https://c.test": ["b", "d"]})
+
+    # e.g., an older map file has been restored
+    new_non_db.version = old_non_db.version - 50
+
+    new_non_db.continue_change_log(old_non_db)
+
+    # versions must never decrease
+    assert new_non_db.version == old_non_db.version + 1
+    assert new_non_db.change_log.changes_since(old_non_db.version) == {"b": "https://c.test", "d": "https://c.test"}
@@ -1,4 +1,8 @@
 import json
+import os
+import signal
+import threading
+import time
 
 import pytest
 from flask import Flask
@@ -63,3 +67,233 @@ def test_empty_file_custom_filename_empty_map_file(tmpdir, monkeypatch):
 
         ext = FlaskNonDatabase(app)
         assert isinstance(ext.non_db, NonDatabase)
+
+
+def make_app_with_map(tmpdir, data: dict, config: dict = None):
+    tmpfile = tmpdir.join("test.json")
+
+    with open(tmpfile, "w") as f:
+        json.dump(data, f)
+
+    app = Flask(__name__)
+    app.config["REDIRECTIONS_MAP_PATH"] = str(tmpfile)
+
+    if config is not None:
+        app.config.update(config)
+
+    return app, tmpfile
+
+
+def wait_for(condition, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+
+        time.sleep(0.01)
+
+    return False
+
+
+def test_reload_swaps_non_db(tmpdir):
+    app, tmpfile = make_app_with_map(tmpdir, {"https://bla.com": ["bla"]})
+
+    ext = FlaskNonDatabase(app)
+    old_non_db = ext.non_db
+
+    with open(tmpfile, "w") as f:
+        json.dump({"https://bla2.com": ["bla2"]}, f)
+
+    assert ext.reload()
+
+    # the old instance must not be modified, requests still using it must see a consistent state
+    assert ext.non_db is not old_non_db
+    assert old_non_db.lookup_url_for_name("bla") == "https://bla.com"
+    assert ext.non_db.lookup_url_for_name("bla2") == "https://bla2.com"
+
+
+def test_reload_keeps_last_good_map_on_collision(tmpdir):
+    app, tmpfile = make_app_with_map(tmpdir, {"https://bla.com": ["bla"]})
+
+    ext = FlaskNonDatabase(app)
+    old_non_db = ext.non_db
+
+    with open(tmpfile, "w") as f:
+        json.dump({"https://bla.com": ["test"], "https://bla2.com": ["test"]}, f)
+
+    assert not ext.reload()
+    assert ext.non_db is old_non_db
+
+
+def test_reload_keeps_last_good_map_if_load_callback_fails(tmpdir):
+    app, tmpfile = make_app_with_map(tmpdir, {"https://bla.com": ["bla"]})
+
+    ext = FlaskNonDatabase(app)
+    old_non_db = ext.non_db
+
+    def callback(app, non_db):
+        if "bla2" in non_db.names_to_urls:
+            raise KeyError("bla2")
+
+    ext.on_load(callback)
+
+    with open(tmpfile, "w") as f:
+        json.dump({"https://bla2.com": ["bla2"]}, f)
+
+    assert not ext.reload()
+    assert ext.non_db is old_non_db
+
+
+def test_reload_watch_mode(tmpdir):
+    config = {
+        "REDIRECTIONS_MAP_RELOAD": "watch",
+        "REDIRECTIONS_MAP_RELOAD_INTERVAL": "0.01",
+    }
+
+    app, tmpfile = make_app_with_map(tmpdir, {"https://bla.com": ["bla"]}, config)
+
+    ext = FlaskNonDatabase(app)
+
+    # make sure the modification time changes even on file systems with a coarse resolution
+    with open(tmpfile, "w") as f:
+        json.dump({"https://bla2.com": ["bla2", "bla3"]}, f)
+
+    os.utime(str(tmpfile), ns=(0, 0))
+
+    assert wait_for(lambda: "bla2" in ext.non_db.names_to_urls)
+
+
+def test_init_app_stops_previous_reloader(tmpdir):
+    config = {
+        "REDIRECTIONS_MAP_RELOAD": "watch",
+        "REDIRECTIONS_MAP_RELOAD_INTERVAL": "0.01",
+    }
+
+    app, _ = make_app_with_map(tmpdir, {"https://bla.com": ["bla"]}, config)
+
+    ext = FlaskNonDatabase(app)
+    first_reloader = ext.reloader
+
+    for _ in range(5):
+        ext.init_app(app)
+
+    assert not first_reloader.is_alive()
+
+    reloaders = [thread for thread in threading.enumerate() if thread.name == "redirector-map-reloader"]
+    assert [reloader for reloader in reloaders if reloader.ext is ext] == [ext.reloader]
+
+    ext.reloader.stop()
+    assert not ext.reloader.is_alive()
+
+
+@pytest.mark.skipif(not hasattr(signal, "SIGHUP"), reason="SIGHUP not available on this platform")
+def test_reload_sighup_mode(tmpdir):
+    app, tmpfile = make_app_with_map(tmpdir, {"https://bla.com": ["bla"]}, {"REDIRECTIONS_MAP_RELOAD": "sighup"})
+
+    previous_handler = signal.getsignal(signal.SIGHUP)
+
+    try:
+        ext = FlaskNonDatabase(app)
+
+        with open(tmpfile, "w") as f:
+            json.dump({"https://bla2.com": ["bla2"]}, f)
+
+        os.kill(os.getpid(), signal.SIGHUP)
+
+        assert wait_for(lambda: "bla2" in ext.non_db.names_to_urls)
+
+    finally:
+        signal.signal(signal.SIGHUP, previous_handler)
+
+
+def test_invalid_reload_mode(tmpdir):
+    app, _ = make_app_with_map(tmpdir, {}, {"REDIRECTIONS_MAP_RELOAD": "invalid"})
+
+    with pytest.raises(ValueError):
+        FlaskNonDatabase(app)
+
+
+def run_in_fork(f) -> int:
+    pid = os.fork()
+
+    if pid == 0:
+        # the child must never return into the test runner
+        try:
+            os._exit(f())
+
+        finally:
+            os._exit(2)
+
+    _, status = os.waitpid(pid, 0)
+    return os.WEXITSTATUS(status)
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="fork not available on this platform")
+def test_reloader_restarted_by_post_fork(tmpdir):
+    config = {
+        "REDIRECTIONS_MAP_RELOAD": "watch",
+        "REDIRECTIONS_MAP_RELOAD_INTERVAL": "0.01",
+    }
+
+    app, tmpfile = make_app_with_map(tmpdir, {"https://bla.com": ["bla"]}, config)
+
+    # e.g., gunicorn --preload, where the app is created in the master process
+    ext = FlaskNonDatabase(app)
+
+    def worker():
+        # forked processes which are not workers do not run a reloader
+        if ext.reloader.is_alive():
+            return 1
+
+        ext.post_fork()
+
+        with open(tmpfile, "w") as f:
+            json.dump({"https://bla2.com": ["bla2"]}, f)
+
+        os.utime(str(tmpfile), ns=(0, 0))
+
+        return 0 if wait_for(lambda: "bla2" in ext.non_db.names_to_urls) else 1
+
+    assert run_in_fork(worker) == 0
+
+    # the reloader of this process is not affected
+    assert ext.reloader.is_alive()
+    ext.reloader.stop()
+
+
+@pytest.mark.skipif(not hasattr(os, "fork") or not hasattr(signal, "SIGHUP"),
+                    reason="fork or SIGHUP not available on this platform")
+def test_post_fork_reinstalls_sighup_handler(tmpdir):
+    app, _ = make_app_with_map(tmpdir, {"https://bla.com": ["bla"]}, {"REDIRECTIONS_MAP_RELOAD": "sighup"})
+
+    previous_handler = signal.getsignal(signal.SIGHUP)
+
+    try:
+        ext = FlaskNonDatabase(app)
+
+        def worker():
+            # e.g., the server resets the signal handlers of its workers
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+            ext.post_fork()
+
+            return 0 if signal.getsignal(signal.SIGHUP) == ext._handle_sighup and ext.reloader.is_alive() else 1
+
+        assert run_in_fork(worker) == 0
+
+    finally:
+        signal.signal(signal.SIGHUP, previous_handler)
+        ext.reloader.stop()
+
+
+def test_snapshot_dir(tmpdir):
+    snapshot_dir = tmpdir.join("snapshots")
+
+    config = {"REDIRECTIONS_MAP_SNAPSHOT_DIR": str(snapshot_dir)}
+    app, _ = make_app_with_map(tmpdir, {"https://bla.com": ["bla"]}, config)
+
+    ext = FlaskNonDatabase(app)
+
+    assert ext.non_db.names_to_urls == {"bla": "https://bla.com"}
+    assert len(snapshot_dir.listdir()) == 1
@@ -0,0 +1,122 @@
+import pytest
+from flask import Flask
+from werkzeug.urls import iri_to_uri
+
+from redirector import non_db_ext
+from redirector.non_database import NonDatabase
+from redirector.responses import (
+    SerializedMap, StaticRedirectResponses, get_serialized_map, get_static_redirect_responses
+)
+
+from .view_fixtures import make_client
+
+
+data = {
+    "https://bla.com": ["bla", "bla1"],
+    "https://ünicöde.com/ä": ["ü"],
+}
+
+
+@pytest.mark.parametrize("compact", [False, True])
+@pytest.mark.parametrize("max_age,status,extra_headers", [
+    ("120", "301 MOVED PERMANENTLY", [("Cache-Control", "max-age=120")]),
+    (10, "301 MOVED PERMANENTLY", [("Cache-Control", "max-age=10")]),
+    ("0", "302 FOUND", []),
+    (-1, "302 FOUND", []),
+    (None, "302 FOUND", []),
+])
+def test_static_redirect_responses(compact, max_age, status, extra_headers):
+    responses = StaticRedirectResponses(NonDatabase(data, compact=compact), max_age)
+
+    assert responses.status == status
+    assert responses.headers_for_name("bla1") == [("Location", "https://bla.com")] + extra_headers
+    assert responses.headers_for_name("ü") == [("Location", "https://xn--nicde-lua2b.com/%C3%A4")] + extra_headers
+
+    with pytest.raises(KeyError):
+        responses.headers_for_name("test")
+
+
+@pytest.mark.parametrize("url", [
+    "https://bla.com",
+    "https://bla.com/a/b?c=d&e=f#g",
+    "http://sub.bla.com./%20",
+    "https://BLA.com/a",
+    "https://bla.com:443/a",
+    "https://user@bla.com/a",
+    "https://bla.com/a b",
+    "https://bla.com/a?",
+    "https://bla.com/a?<b>",
+    "https://bla.com/ä#ö",
+])
+def test_location_header_matches_iri_to_uri(url):
+    # plain URLs are not converted, which must not make any difference
+    assert StaticRedirectResponses._make_location_header(url) == ("Location", iri_to_uri(url))
+
+
+def test_static_redirect_responses_are_recomputed_on_config_change():
+    app = Flask(__name__)
+    app.config["STATIC_REDIRECTIONS_MAX_AGE"] = "120"
+
+    non_db = NonDatabase(data)
+
+    responses = get_static_redirect_responses(app, non_db)
+    assert get_static_redirect_responses(app, non_db) is responses
+
+    app.config["STATIC_REDIRECTIONS_MAX_AGE"] = "0"
+
+    new_responses = get_static_redirect_responses(app, non_db)
+    assert new_responses is not responses
+    assert new_responses.status == "302 FOUND"
+
+
+def test_responses_precomputed_on_load(tmpdir, test_data):
+    app, test_client = make_client(tmpdir, test_data)
+
+    responses = non_db_ext.non_db.derived[StaticRedirectResponses]
+
+    response = test_client.get("/test1")
+    assert response.headers["location"] == "https://test.test"
+
+    # map is unchanged, so the responses must not have been recomputed
+    assert non_db_ext.non_db.derived[StaticRedirectResponses] is responses
+
+    with open(app.config["REDIRECTIONS_MAP_PATH"], "w") as f:
+        f.write('{"https://test2.test": ["test1"]}')
+
+    assert non_db_ext.reload()
+
+    assert non_db_ext.non_db.derived[StaticRedirectResponses] is not responses
+    assert test_client.get("/test1").headers["location"] == "https://test2.test"
+
+
+def test_config_change_at_runtime(tmpdir, test_data):
+    app, test_client = make_client(tmpdir, test_data)
+
+    assert test_client.get("/test1").status_code == 301
+
+    app.config["STATIC_REDIRECTIONS_MAX_AGE"] = 0
+
+    response = test_client.get("/test1")
+    assert response.status_code == 302
+    assert "cache-control" not in response.headers
+
+
+def test_serialized_map_is_deterministic():
+    app = Flask(__name__)
+
+    with app.app_context():
+        first = SerializedMap(NonDatabase({"https://test.test": ["test1", "test2"]}))
+        second = SerializedMap(NonDatabase({"https://test.test": ["test1", "test2"]}))
+
+    assert first.body == second.body
+    assert first.etag == second.etag
+    assert first.encoded_bodies == second.encoded_bodies
+
+
+def test_serialized_map_computed_once_per_map():
+    app = Flask(__name__)
+    non_db = NonDatabase({"https://test.test": ["test1"]})
+
+    with app.app_context():
+        assert get_serialized_map(non_db) is get_serialized_map(non_db)
+        assert get_serialized_map(non_db) is not get_serialized_map(NonDatabase({"https://test.test": ["test1"]}))
@@ -0,0 +1,60 @@
+import pytest
+
+from redirector.non_database import NonDatabase
+from redirector.search import SearchIndex
+
+
+@pytest.fixture
+def search_index():
+    non_db = NonDatabase({
+        "https://github.com/AppImage/AppImageKit": ["appimagekit", "aik"],
+        "https://github.com/linuxdeploy/linuxdeploy": ["linuxdeploy", "ld"],
+        "https://example.com": ["Example"],
+    })
+
+    return SearchIndex(non_db)
+
+
+def test_search_empty_query(search_index):
+    assert search_index.search("") == [0, 1, 2]
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("github", [0, 1]),
+    ("appimage", [0]),
+    ("linuxdeploy", [1]),
+    ("EXAMPLE", [2]),
+    ("aik", [0]),
+    ("ld", [1]),
+    ("x", [1, 2]),
+    ("i", [0, 1]),
+    ("doesnotexist", []),
+    # all trigrams are contained in the URL, but not the query itself
+    ("hubgit", []),
+])
+def test_search(search_index, query, expected):
+    assert search_index.search(query) == expected
+
+
+def test_search_index_is_built_lazily(search_index):
+    assert search_index._postings is None
+
+    search_index.search("github")
+
+    assert search_index._postings is not None
+
+
+def test_entries(search_index):
+    assert search_index.entries([2, 1]) == [
+        ("https://example.com", ["Example"]),
+        ("https://github.com/linuxdeploy/linuxdeploy", ["linuxdeploy", "ld"]),
+    ]
+
+
+def test_search_compact_map():
+    non_db = NonDatabase({"https://a.test": ["abc"], "https://b.test": ["bcd"]}, compact=True)
+
+    search_index = SearchIndex(non_db)
+
+    assert search_index.search("bc") == [0, 1]
+    assert search_index.entries(search_index.search("cd")) == [("https://b.test", ("bcd",))]
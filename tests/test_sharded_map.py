@@ -0,0 +1,159 @@
+import json
+import os
+
+import pytest
+from flask import Flask
+
+from redirector.non_database import FlaskNonDatabase, NonDatabase
+from redirector.sharded_map import directory_signature, list_shards
+
+
+def write_shard(directory, filename: str, data: dict):
+    path = str(directory.join(filename))
+
+    with open(path, "w") as f:
+        json.dump(data, f)
+
+    return path
+
+
+@pytest.fixture
+def shards_dir(tmpdir):
+    directory = tmpdir.mkdir("shards")
+
+    write_shard(directory, "a.json", {"https://a.test": ["a", "a2"], "https://gh.test/": ["gh/*"]})
+    write_shard(directory, "b.json", {"https://b.test": ["b"]})
+
+    # these must be ignored
+    write_shard(directory, ".c.json", {"https://c.test": ["c"]})
+    write_shard(directory, "d.txt", {"https://d.test": ["d"]})
+
+    return directory
+
+
+def test_list_shards(shards_dir):
+    assert sorted(os.path.basename(path) for path in list_shards(str(shards_dir))) == ["a.json", "b.json"]
+
+
+def test_load_sharded_map(shards_dir):
+    non_db = NonDatabase(str(shards_dir))
+
+    assert non_db.names_to_urls == {"a": "https://a.test", "a2": "https://a.test", "gh/*": "https://gh.test/",
+                                    "b": "https://b.test"}
+    assert list(non_db.urls_to_names) == ["https://a.test", "https://gh.test/", "https://b.test"]
+
+    assert non_db.lookup_url_for_name("gh/repo") == "https://gh.test/repo"
+
+
+def test_load_sharded_map_compact(shards_dir):
+    non_db = NonDatabase(str(shards_dir), compact=True)
+
+    assert non_db.lookup_url_for_name("b") == "https://b.test"
+    assert non_db.shards is None
+
+
+def test_name_collision_names_both_shards(shards_dir):
+    write_shard(shards_dir, "c.json", {"https://c.test": ["a"]})
+
+    with pytest.raises(ValueError, match=r"Name collision: a .*a\.json.*c\.json"):
+        NonDatabase(str(shards_dir))
+
+
+def test_url_collision_names_both_shards(shards_dir):
+    write_shard(shards_dir, "c.json", {"https://b.test": ["c"]})
+
+    with pytest.raises(ValueError, match=r"URL collision: https://b\.test .*b\.json.*c\.json"):
+        NonDatabase(str(shards_dir))
+
+
+def test_errors_name_the_shard(shards_dir):
+    path = write_shard(shards_dir, "c.json", {"https://c.test": ["c//c"]})
+
+    with pytest.raises(ValueError, match=path):
+        NonDatabase(str(shards_dir))
+
+
+def test_incremental_load(shards_dir, monkeypatch):
+    non_db = NonDatabase(str(shards_dir), load_processes=1)
+
+    # the entries of the shards are only stored in the merged map
+    a_path = str(shards_dir.join("a.json"))
+    assert non_db.shards[a_path].urls_to_names is None
+    assert non_db.shards[a_path].names_to_urls is None
+
+    b_path = write_shard(shards_dir, "b.json", {"https://b.test": ["b", "b2"]})
+    os.utime(b_path, ns=(0, 0))
+
+    parsed_filenames = []
+    load_file = NonDatabase._load_file
+
+    def record_load_file(cls, filename):
+        parsed_filenames.append(filename)
+        return load_file(filename)
+
+    monkeypatch.setattr(NonDatabase, "_load_file", classmethod(record_load_file))
+
+    new_non_db = NonDatabase(load_processes=1)
+    new_non_db.load_data(str(shards_dir), non_db)
+
+    # unchanged shards are not parsed again, their entries are taken from the previous map
+    assert parsed_filenames == [b_path]
+    assert new_non_db.lookup_url_for_name("a") == "https://a.test"
+    assert new_non_db.lookup_url_for_name("gh/repo") == "https://gh.test/repo"
+    assert new_non_db.lookup_url_for_name("b2") == "https://b.test"
+
+    # the previous instance must not be modified
+    assert "b2" not in non_db.names_to_urls
+
+    os.remove(b_path)
+
+    newest_non_db = NonDatabase()
+    newest_non_db.load_data(str(shards_dir), new_non_db)
+
+    assert "b" not in newest_non_db.names_to_urls
+    assert newest_non_db.lookup_url_for_name("a") == "https://a.test"
+
+
+def test_load_in_worker_processes(shards_dir):
+    non_db = NonDatabase(str(shards_dir), load_processes=2)
+
+    assert non_db.lookup_url_for_name("a2") == "https://a.test"
+    assert non_db.lookup_url_for_name("b") == "https://b.test"
+
+
+def test_load_in_worker_processes_error(shards_dir):
+    write_shard(shards_dir, "c.json", {"https://c.test": ["c//c"]})
+
+    with pytest.raises(ValueError, match="c.json"):
+        NonDatabase(str(shards_dir), load_processes=2)
+
+
+def test_directory_signature(shards_dir):
+    signature = directory_signature(str(shards_dir))
+
+    os.remove(str(shards_dir.join("b.json")))
+
+    assert directory_signature(str(shards_dir)) != signature
+    assert directory_signature(str(shards_dir.join("missing"))) is None
+
+
+def test_reload_sharded_map(shards_dir):
+    app = Flask(__name__)
+    app.config["REDIRECTIONS_MAP_PATH"] = str(shards_dir)
+
+    ext = FlaskNonDatabase(app)
+    old_non_db = ext.non_db
+
+    write_shard(shards_dir, "c.json", {"https://c.test": ["c"]})
+
+    assert ext.reload()
+
+    assert ext.non_db.lookup_url_for_name("c") == "https://c.test"
+    assert ext.non_db.version > old_non_db.version
+    assert ext.non_db.change_log.changes_since(old_non_db.version) == {"c": "https://c.test"}
+
+    # a collision across shards keeps the last good map
+    write_shard(shards_dir, "d.json", {"https://d.test": ["c"]})
+
+    assert not ext.reload()
+    assert ext.non_db.lookup_url_for_name("c") == "https://c.test"
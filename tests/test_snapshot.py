@@ -0,0 +1,112 @@
+import io
+import json
+import os
+
+import pytest
+
+from redirector.non_database import NonDatabase
+from redirector.snapshot import FORMAT_VERSION, file_digest, load_snapshot, snapshot_path, write_snapshot
+from redirector.streaming_loader import MapLoadError
+
+
+@pytest.fixture
+def map_file(tmpdir):
+    path = tmpdir.join("redirects.json")
+    path.write(json.dumps({"https://a.test": ["a", "b"], "https://gh.test/": ["gh/*"]}))
+    return str(path)
+
+
+@pytest.fixture
+def snapshot_dir(tmpdir):
+    return str(tmpdir.join("snapshots"))
+
+
+def test_file_digest():
+    assert file_digest(io.BytesIO(b"")) == "e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855"
+
+
+def test_write_and_load_snapshot(map_file, snapshot_dir):
+    data = ({"https://a.test": ["a"]}, {"a": "https://a.test"}, [])
+
+    write_snapshot(snapshot_dir, map_file, "1234", data)
+
+    assert load_snapshot(snapshot_dir, map_file, "1234") == data
+    assert load_snapshot(snapshot_dir, map_file, "5678") is None
+
+    # snapshots are specific to the map file
+    assert load_snapshot(snapshot_dir, map_file + ".other", "1234") is None
+
+
+def test_write_snapshot_removes_outdated_snapshots(map_file, snapshot_dir):
+    write_snapshot(snapshot_dir, map_file, "1234", ({}, {}, []))
+    write_snapshot(snapshot_dir, map_file + ".other", "1234", ({}, {}, []))
+    write_snapshot(snapshot_dir, map_file, "5678", ({}, {}, []))
+
+    assert sorted(os.listdir(snapshot_dir)) == sorted([
+        os.path.basename(snapshot_path(snapshot_dir, map_file + ".other", "1234")),
+        os.path.basename(snapshot_path(snapshot_dir, map_file, "5678")),
+    ])
+
+
+def test_broken_snapshot_is_ignored(map_file, snapshot_dir):
+    os.makedirs(snapshot_dir)
+
+    with open(snapshot_path(snapshot_dir, map_file, "1234"), "wb") as f:
+        f.write(b"garbage")
+
+    assert load_snapshot(snapshot_dir, map_file, "1234") is None
+
+
+def test_snapshot_of_other_format_version_is_ignored(map_file, snapshot_dir, monkeypatch):
+    write_snapshot(snapshot_dir, map_file, "1234", ({}, {}, []))
+
+    monkeypatch.setattr("redirector.snapshot.FORMAT_VERSION", FORMAT_VERSION + 1)
+
+    assert load_snapshot(snapshot_dir, map_file, "1234") is None
+
+
+def test_non_database_uses_snapshot(map_file, snapshot_dir, monkeypatch):
+    non_db = NonDatabase(map_file, snapshot_dir=snapshot_dir)
+
+    assert len(os.listdir(snapshot_dir)) == 1
+
+    def parse_file(*args):
+        raise AssertionError("file must not be parsed again")
+
+    monkeypatch.setattr(NonDatabase, "_parse_file", parse_file)
+
+    cached_non_db = NonDatabase(map_file, snapshot_dir=snapshot_dir)
+
+    assert cached_non_db.names_to_urls == non_db.names_to_urls
+    assert cached_non_db.urls_to_names == non_db.urls_to_names
+    assert cached_non_db.version == non_db.version
+    assert cached_non_db.lookup_url_for_name("gh/foo") == non_db.lookup_url_for_name("gh/foo")
+
+
+def test_non_database_snapshot_invalidated_by_changes(map_file, snapshot_dir):
+    NonDatabase(map_file, snapshot_dir=snapshot_dir)
+
+    with open(map_file, "w") as f:
+        json.dump({"https://c.test": ["c"]}, f)
+
+    assert NonDatabase(map_file, snapshot_dir=snapshot_dir).names_to_urls == {"c": "https://c.test"}
+    assert len(os.listdir(snapshot_dir)) == 1
+
+
+def test_non_database_no_snapshot_of_invalid_map(map_file, snapshot_dir):
+    with open(map_file, "w") as f:
+        json.dump({"https://a.test": ["a"], "https://b.test": ["a"]}, f)
+
+    with pytest.raises(MapLoadError):
+        NonDatabase(map_file, snapshot_dir=snapshot_dir)
+
+    assert not os.path.exists(snapshot_dir)
+
+
+def test_non_database_snapshot_compact(map_file, snapshot_dir):
+    NonDatabase(map_file, snapshot_dir=snapshot_dir)
+
+    non_db = NonDatabase(map_file, compact=True, snapshot_dir=snapshot_dir)
+
+    assert non_db.lookup_url_for_name("b") == "https://a.test"
+    assert list(non_db.lookup_names_for_url("https://a.test")) == ["a", "b"]
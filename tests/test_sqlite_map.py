@@ -0,0 +1,291 @@
+import gzip
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from redirector import create_app
+from redirector.non_database import NonDatabase
+from redirector import sqlite_map as sqlite_map_module
+from redirector.responses import SerializedMapFiles, brotli
+from redirector.search import SqliteSearchIndex
+from redirector.sqlite_map import SqliteMap, build_sqlite_map, is_sqlite_map, read_meta
+from redirector.streaming_loader import MapLoadError
+
+
+@pytest.fixture
+def data():
+    return {
+        "https://bla.com": ["bla", "bla1"],
+        "https://bla2.com": ["bla2"],
+        "https://ünicöde.com/ä": ["ü", "ö"],
+        "https://github.com/org/": ["gh/*"],
+        "https://empty.com": [],
+    }
+
+
+@pytest.fixture
+def source(tmpdir, data):
+    filename = str(tmpdir.join("redirects.json"))
+
+    with open(filename, "w") as f:
+        json.dump(data, f)
+
+    return filename
+
+
+@pytest.fixture
+def sqlite_file(tmpdir, data):
+    filename = str(tmpdir.join("redirects.sqlite"))
+    build_sqlite_map(data.items(), filename, 1, 2.0)
+    return filename
+
+
+def test_sqlite_map_lookups(sqlite_file, data):
+    sqlite_map = SqliteMap(sqlite_file)
+
+    assert is_sqlite_map(sqlite_file)
+    assert sqlite_map.version == 1
+    assert sqlite_map.last_modified == 2.0
+
+    assert len(sqlite_map.names_to_urls) == 6
+    assert len(sqlite_map.urls_to_names) == 5
+
+    assert sqlite_map.names_to_urls["ü"] == "https://ünicöde.com/ä"
+    assert sqlite_map.urls_to_names["https://bla.com"] == ("bla", "bla1")
+    assert sqlite_map.urls_to_names["https://empty.com"] == ()
+
+    # iteration follows the order of the source
+    assert {url: list(names) for url, names in sqlite_map.urls_to_names.items()} == data
+    assert list(sqlite_map.urls_to_names) == list(data)
+    assert list(sqlite_map.names_to_urls) == [name for names in data.values() for name in names]
+    assert dict(sqlite_map.names_to_urls.items()) == {name: url for url, names in data.items() for name in names}
+
+    assert sqlite_map.rules() == [("gh/*", "https://github.com/org/")]
+
+
+def test_sqlite_map_missing_keys(sqlite_file):
+    sqlite_map = SqliteMap(sqlite_file)
+
+    with pytest.raises(KeyError):
+        sqlite_map.names_to_urls["missing"]
+
+    with pytest.raises(KeyError):
+        sqlite_map.urls_to_names["https://missing.com"]
+
+    assert "missing" not in sqlite_map.names_to_urls
+    assert "bla" in sqlite_map.names_to_urls
+
+
+def test_sqlite_map_cache(sqlite_file):
+    sqlite_map = SqliteMap(sqlite_file, cache_size=1)
+
+    for name in ["bla", "bla", "missing", "bla2", "bla"]:
+        sqlite_map.names_to_urls.get(name)
+
+    info = sqlite_map.find_url_for_name.cache_info()
+
+    # unknown names are not cached, so they never evict known ones
+    assert (info.hits, info.misses, info.currsize) == (1, 4, 1)
+
+    # membership tests bypass the cache
+    assert "bla1" in sqlite_map.names_to_urls
+    assert sqlite_map.find_url_for_name.cache_info().misses == 4
+
+
+def test_sqlite_map_collision(tmpdir):
+    with pytest.raises(ValueError, match="Name collision"):
+        build_sqlite_map([("https://a.com", ["a"]), ("https://b.com", ["a"])], str(tmpdir.join("map.sqlite")), 1, 1)
+
+    # the incomplete file is removed
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_sqlite_map_later_entries_replace_earlier_ones(tmpdir):
+    filename = str(tmpdir.join("map.sqlite"))
+    build_sqlite_map([("https://a.com", ["a"]), ("https://a.com", ["b", "a"])], filename, 1, 1)
+
+    assert SqliteMap(filename).urls_to_names["https://a.com"] == ("b", "a")
+
+
+def test_non_db_sqlite_backend(source, data):
+    non_db = NonDatabase(source, backend="sqlite")
+
+    sqlite_filename = source + ".sqlite"
+
+    assert is_sqlite_map(sqlite_filename)
+    assert non_db.version == os.stat(source).st_mtime_ns
+
+    assert non_db.lookup_url_for_name("bla1") == "https://bla.com"
+    assert non_db.lookup_url_for_name("gh/repo") == "https://github.com/org/repo"
+    assert non_db.lookup_names_for_url("https://bla2.com") == ("bla2",)
+
+    # the database is only built again once the source has changed
+    mtime = os.stat(sqlite_filename).st_mtime_ns
+    NonDatabase(source, backend="sqlite")
+    assert os.stat(sqlite_filename).st_mtime_ns == mtime
+
+    with open(source, "w") as f:
+        json.dump({"https://new.com": ["new"]}, f)
+
+    os.utime(source, ns=(0, 0))
+
+    non_db = NonDatabase(source, backend="sqlite")
+    assert non_db.lookup_url_for_name("new") == "https://new.com"
+    assert read_meta(sqlite_filename)["source_mtime_ns"] == 0
+
+
+def test_sqlite_map_built_once_by_concurrent_processes(source, monkeypatch):
+    builds = []
+    build_sqlite_map = NonDatabase.build_sqlite_map
+
+    def slow_build_sqlite_map(cls, *args):
+        builds.append(args)
+        time.sleep(0.1)
+        build_sqlite_map(*args)
+
+    monkeypatch.setattr(NonDatabase, "build_sqlite_map", classmethod(slow_build_sqlite_map))
+
+    # the lock is held per open file, so threads contend for it like processes do
+    threads = [threading.Thread(target=NonDatabase, args=(source,), kwargs={"backend": "sqlite"}) for _ in range(3)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    assert len(builds) == 1
+    assert is_sqlite_map(source + ".sqlite")
+
+
+def test_non_db_sqlite_backend_errors(tmpdir):
+    filename = str(tmpdir.join("redirects.json"))
+
+    with open(filename, "w") as f:
+        f.write('{\n"https://a.com": ["a"],\n"https://b.com": ["a"]\n}')
+
+    with pytest.raises(MapLoadError, match="Name collision.*line 3"):
+        NonDatabase(filename, backend="sqlite")
+
+    with open(filename, "w") as f:
+        f.write('{\n"https://a.com": ["a//a"]\n}')
+
+    with pytest.raises(MapLoadError, match="line 2"):
+        NonDatabase(filename, backend="sqlite")
+
+
+def test_non_db_invalid_backend():
+    with pytest.raises(ValueError):
+        NonDatabase(backend="invalid")
+
+
+def test_compile_command_sqlite(tmpdir, source, data):
+    destination = str(tmpdir.join("redirects.sqlite"))
+
+    app = create_app({"REDIRECTIONS_MAP_PATH": source})
+
+    result = app.test_cli_runner().invoke(args=["redirector", "compile", "--format", "sqlite", source, destination])
+
+    assert result.exit_code == 0, result.output
+    assert is_sqlite_map(destination)
+
+    # SQLite maps are detected automatically
+    test_client = create_app({"REDIRECTIONS_MAP_PATH": destination}).test_client()
+
+    assert test_client.get("/api/urls.json").json == data
+    assert test_client.get("/bla2").headers["location"] == "https://bla2.com"
+
+
+def test_app_sqlite_backend(source):
+    app = create_app({"REDIRECTIONS_MAP_PATH": source, "REDIRECTIONS_MAP_BACKEND": "sqlite"})
+
+    response = app.test_client().get("/ü")
+    assert response.status_code == 301
+    assert response.headers["location"] == "https://xn--nicde-lua2b.com/%C3%A4"
+
+
+def test_sqlite_search_index(sqlite_file):
+    search_index = SqliteSearchIndex(SqliteMap(sqlite_file))
+
+    assert len(search_index) == 5
+    assert search_index.search("") == [0, 1, 2, 3, 4]
+    assert search_index.search("BLA") == [0, 1]
+    assert search_index.search("bla1") == [0]
+    # matches both URL and name, and is case-insensitive beyond ASCII
+    assert search_index.search("Ü") == [2]
+    assert search_index.search("doesnotexist") == []
+
+    assert search_index.entries([2, 0]) == [("https://ünicöde.com/ä", ("ü", "ö")), ("https://bla.com", ("bla", "bla1"))]
+
+
+def test_app_sqlite_backend_does_not_load_entire_map(source, monkeypatch):
+    def fail(*args):
+        raise AssertionError("the entire map has been iterated over")
+
+    for view in ("_URLsToNamesView", "_URLsToNamesItemsView", "_NamesToURLsView", "_NamesToURLsItemsView"):
+        monkeypatch.setattr(getattr(sqlite_map_module, view), "__iter__", fail)
+
+    app = create_app({"REDIRECTIONS_MAP_PATH": source, "REDIRECTIONS_MAP_BACKEND": "sqlite"})
+    test_client = app.test_client()
+
+    assert test_client.get("/bla").status_code == 301
+
+    response = test_client.get("/?q=bla2")
+    assert b"https://bla2.com" in response.data
+    assert b"https://bla.com" not in response.data
+
+    # suggestions would require an index of all names
+    assert test_client.get("/blaa").status_code == 404
+
+
+def test_app_sqlite_backend_serves_api_from_files(tmpdir, source, data, monkeypatch):
+    test_client = create_app({"REDIRECTIONS_MAP_PATH": source, "REDIRECTIONS_MAP_BACKEND": "sqlite"}).test_client()
+
+    response = test_client.get("/api/urls.json")
+    assert response.json == data
+    # the same JSON as for maps kept in memory
+    assert response.data == json.dumps(data).encode()
+
+    gzip_response = test_client.get("/api/urls.json", headers={"Accept-Encoding": "gzip"})
+    assert gzip_response.headers["content-encoding"] == "gzip"
+    assert json.loads(gzip.decompress(gzip_response.data)) == data
+
+    assert test_client.get("/api/urls.json", headers={"If-None-Match": response.headers["etag"]}).status_code == 304
+
+    changes = test_client.get("/api/changes.json").json
+    assert changes["snapshot"] == data
+
+    version = changes["version"]
+    assert os.path.exists(str(tmpdir.join("redirects.json.sqlite.{}.json".format(version))))
+    assert os.path.exists(str(tmpdir.join("redirects.json.sqlite.{}.json.gz".format(version))))
+
+    # other processes use the files instead of serializing the map again
+    def fail(*args):
+        raise AssertionError("the map has been serialized again")
+
+    monkeypatch.setattr(SerializedMapFiles, "_write_files", fail)
+
+    other_client = create_app({"REDIRECTIONS_MAP_PATH": source, "REDIRECTIONS_MAP_BACKEND": "sqlite"}).test_client()
+    other_response = other_client.get("/api/urls.json", headers={"Accept-Encoding": "gzip"})
+
+    assert other_response.data == gzip_response.data
+    assert other_response.headers["etag"] == gzip_response.headers["etag"]
+
+
+def test_serialized_map_files_of_outdated_versions_are_removed(tmpdir, data):
+    filename = str(tmpdir.join("redirects.sqlite"))
+
+    for version in (1, 2):
+        build_sqlite_map(data.items(), filename, version, 2.0)
+        SerializedMapFiles(NonDatabase(filename))
+
+    expected = ["redirects.sqlite.2.json", "redirects.sqlite.2.json.gz"]
+
+    if brotli is not None:
+        expected.append("redirects.sqlite.2.json.br")
+
+    files = [name for name in os.listdir(str(tmpdir)) if name.endswith((".json", ".gz", ".br"))]
+    assert sorted(files) == sorted(expected)
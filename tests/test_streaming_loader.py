@@ -0,0 +1,118 @@
+import io
+import json
+import pickle
+
+import pytest
+
+from redirector.non_database import NonDatabase
+from redirector.streaming_loader import MapLoadError, MapSyntaxError, iter_map_entries, locate, locate_all
+
+
+data = {
+    "https://bla.com": ["bla", "bla1"],
+    "https://bla2.com": [],
+    "https://ünicöde.com/\"quoted\"": ["ü", "\\u00f6"],
+}
+
+
+def parse(text: str, chunk_size: int = 1024 * 1024):
+    return list(iter_map_entries(io.StringIO(text), "test.json", chunk_size=chunk_size))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 1024 * 1024])
+@pytest.mark.parametrize("indent", [None, 4])
+def test_iter_map_entries(chunk_size, indent):
+    entries = parse(json.dumps(data, indent=indent), chunk_size)
+
+    assert {url: names for url, names, _ in entries} == data
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 1024 * 1024])
+def test_iter_map_entries_positions(chunk_size):
+    text = "{\n    \"https://bla.com\": [\"bla\"],\n    \"https://bla2.com\": [\"bla2\"]\n}\n"
+
+    offsets = [pos for _, _, pos in parse(text, chunk_size)]
+
+    assert offsets == [6, 38]
+    assert [locate(io.StringIO(text), pos, chunk_size) for pos in offsets] == [(6, 2, 5), (38, 3, 5)]
+    assert locate_all(io.StringIO(text), offsets + [6], chunk_size) == {6: (6, 2, 5), 38: (38, 3, 5)}
+
+
+@pytest.mark.parametrize("text", ["{}", " { } \n", "\n{\n}"])
+def test_iter_map_entries_empty(text):
+    assert parse(text) == []
+
+
+@pytest.mark.parametrize("text,lineno,colno", [
+    ("", 1, 1),
+    ("broken stuff", 1, 1),
+    ("{\n\"https://bla.com\": [\"bla\"],\n}", 3, 1),
+    ("{\"https://bla.com\" [\"bla\"]}", 1, 20),
+    ("{\"https://bla.com\": [\"bla\"}", 1, 27),
+    ("{\"https://bla.com\": [\"bla\"]} {}", 1, 30),
+    ("{\"https://bla.com\": [\"bla\"]", 1, 28),
+])
+@pytest.mark.parametrize("chunk_size", [1, 1024 * 1024])
+def test_iter_map_entries_syntax_errors(text, lineno, colno, chunk_size):
+    with pytest.raises(json.JSONDecodeError) as e:
+        parse(text, chunk_size)
+
+    assert isinstance(e.value, MapSyntaxError)
+    assert (e.value.lineno, e.value.colno) == (lineno, colno)
+
+
+@pytest.mark.parametrize("text", [
+    "{\"https://bla.com\": \"bla\"}",
+    "{\"https://bla.com\": [1]}",
+])
+def test_iter_map_entries_structure_errors(text):
+    with pytest.raises(MapLoadError) as e:
+        parse(text)
+
+    assert not isinstance(e.value, json.JSONDecodeError)
+    assert (e.value.lineno, e.value.colno) == (1, 2)
+
+
+def test_map_load_error_pickle():
+    error = MapSyntaxError("test", "test.json", (1, 2, 3))
+    unpickled = pickle.loads(pickle.dumps(error))
+
+    assert type(unpickled) is MapSyntaxError
+    assert str(unpickled) == str(error)
+
+
+def write_file(tmpdir, text: str) -> str:
+    filename = str(tmpdir.join("redirects.json"))
+
+    with open(filename, "w") as f:
+        f.write(text)
+
+    return filename
+
+
+def test_non_db_collision_position(tmpdir):
+    filename = write_file(tmpdir, "{\n  \"https://bla.com\": [\"bla\"],\n  \"https://bla2.com\": [\"bla\"]\n}")
+
+    with pytest.raises(MapLoadError, match="Name collision") as e:
+        NonDatabase(filename)
+
+    assert (e.value.filename, e.value.lineno, e.value.colno) == (filename, 3, 3)
+
+
+def test_non_db_invalid_name_position(tmpdir):
+    filename = write_file(tmpdir, "{\"https://bla.com\": [\"bla//bla\"]}")
+
+    with pytest.raises(MapLoadError, match="empty segments") as e:
+        NonDatabase(filename)
+
+    assert (e.value.lineno, e.value.colno) == (1, 2)
+
+
+def test_non_db_duplicate_url_last_entry_wins(tmpdir):
+    # json.load's behavior is to use the last value for a duplicate key, so we do the same
+    filename = write_file(tmpdir, "{\"https://bla.com\": [\"bla\"], \"https://bla.com\": [\"bla\", \"bla1\"]}")
+
+    non_db = NonDatabase(filename)
+
+    assert non_db.urls_to_names == {"https://bla.com": ["bla", "bla1"]}
+    assert non_db.names_to_urls == {"bla": "https://bla.com", "bla1": "https://bla.com"}
@@ -0,0 +1,46 @@
+import pytest
+
+from redirector.non_database import NonDatabase
+from redirector.suggestions import NameSuggestions
+
+
+@pytest.fixture
+def suggestions():
+    non_db = NonDatabase({
+        "https://github.com/AppImage/AppImageKit": ["appimagekit", "aik"],
+        "https://github.com/AppImage/appimagetool": ["appimagetool"],
+        "https://github.com/linuxdeploy/linuxdeploy": ["linuxdeploy", "ld"],
+        "https://github.com/": ["gh/*"],
+    })
+
+    return NameSuggestions(non_db)
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("appimagetoll", ["appimagetool", "appimagekit"]),
+    ("AppImageKit", ["appimagekit", "appimagetool"]),
+    ("linuxdeplyo", ["linuxdeploy"]),
+    ("something-else", []),
+    ("", []),
+])
+def test_suggest(suggestions, name, expected):
+    assert suggestions.suggest(name) == expected
+
+
+def test_suggest_limit(suggestions):
+    assert suggestions.suggest("appimagetoll", limit=1) == ["appimagetool"]
+
+
+def test_rules_are_not_suggested(suggestions):
+    assert "gh/*" not in suggestions.names
+
+
+def test_suggest_budget():
+    non_db = NonDatabase({"https://test/{}".format(i): ["name-{}".format(i)] for i in range(1000)})
+    suggestions = NameSuggestions(non_db)
+
+    # the trigrams shared by all names exceed the budget, but the rarer ones are sufficient to find the closest name
+    assert suggestions.suggest("name-123x", limit=1, budget=100) == ["name-123"]
+
+    # if no trigram fits into the budget, there cannot be any suggestions
+    assert suggestions.suggest("name-123x", budget=0) == []
@@ -0,0 +1,165 @@
+import time
+
+import pytest
+from flask import redirect
+
+import redirector
+from redirector import cache
+from redirector.tiered_cache import EPOCH_CHECK_INTERVAL, TieredCache, tiered_cache
+
+
+@pytest.fixture
+def app():
+    app = redirector.create_app({"DYNAMIC_REDIRECTS_L1_SIZE": "3", "DYNAMIC_REDIRECTS_L1_TIMEOUT": "5"})
+
+    with app.app_context():
+        yield app
+
+
+def test_lookup_miss(app):
+    assert tiered_cache.lookup("dynamic/missing") == (None, None)
+    assert tiered_cache.get("dynamic/missing") is None
+
+
+def test_set_writes_both_tiers(app):
+    tiered_cache.set("dynamic/a", "value", 100)
+
+    assert cache.get("dynamic/a") == "value"
+    assert tiered_cache.lookup("dynamic/a") == ("value", "l1")
+
+
+def test_l2_hit_populates_l1(app):
+    # e.g., written by another process
+    cache.set("dynamic/a", "value")
+
+    assert tiered_cache.lookup("dynamic/a") == ("value", "l2")
+    assert tiered_cache.lookup("dynamic/a") == ("value", "l1")
+
+
+def test_l1_entries_expire(app, monkeypatch):
+    tiered_cache.set("dynamic/a", "value", 100)
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 6)
+
+    # the entry has expired from L1, but is still in L2
+    assert tiered_cache.lookup("dynamic/a") == ("value", "l2")
+
+
+def test_l1_timeout_is_bounded_by_value_timeout(app, monkeypatch):
+    tiered_cache.set("dynamic/a", "value", 1)
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 2)
+
+    cache.delete("dynamic/a")
+    assert tiered_cache.lookup("dynamic/a") == (None, None)
+
+
+def test_values_without_timeout_are_kept_in_l1(app):
+    tiered_cache.set("dynamic/a", "value", 0)
+
+    cache.delete("dynamic/a")
+    assert tiered_cache.lookup("dynamic/a") == ("value", "l1")
+
+
+def test_l1_returns_fresh_responses(app):
+    tiered_cache.set("dynamic/a", redirect("https://a.test"), 100)
+
+    first, tier = tiered_cache.lookup("dynamic/a")
+    assert tier == "l1"
+
+    # e.g., modified by an after_request hook
+    first.headers["X-Modified"] = "1"
+
+    second, _ = tiered_cache.lookup("dynamic/a")
+
+    assert second is not first
+    assert second.status_code == 302
+    assert second.headers["Location"] == "https://a.test"
+    assert "X-Modified" not in second.headers
+
+
+def test_l1_evicts_least_recently_used(app):
+    for key in ["dynamic/a", "dynamic/b", "dynamic/c"]:
+        tiered_cache.set(key, key, 100)
+
+    # a becomes the most recently used entry
+    assert tiered_cache.lookup("dynamic/a")[1] == "l1"
+
+    tiered_cache.set("dynamic/d", "dynamic/d", 100)
+
+    assert tiered_cache.lookup("dynamic/b")[1] == "l2"
+    assert tiered_cache.lookup("dynamic/a")[1] == "l1"
+
+
+def other_process():
+    # another process has its own first tier, but shares the second one
+    other = TieredCache()
+    other.size = 3
+    return other
+
+
+def test_writes_of_other_processes_invalidate_l1(app, monkeypatch):
+    tiered_cache.set("dynamic/a", "old", 100)
+    tiered_cache.set("dynamic/b", "b", 100)
+
+    # the first lookup checks the epoch
+    assert tiered_cache.get("dynamic/b") == "b"
+
+    other_process().set("dynamic/a", "new", 100)
+
+    # the epoch is only checked once in a while
+    assert tiered_cache.get("dynamic/a") == "old"
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + EPOCH_CHECK_INTERVAL)
+
+    assert tiered_cache.lookup("dynamic/a") == ("new", "l2")
+
+    # only the value which has been written is dropped
+    assert tiered_cache.lookup("dynamic/b") == ("b", "l1")
+    assert tiered_cache.get_stats()["l1_invalidations"] == 1
+
+
+def test_own_write_after_write_of_other_process(app, monkeypatch):
+    tiered_cache.set("dynamic/a", "old", 100)
+
+    other_process().set("dynamic/a", "new", 100)
+    tiered_cache.set("dynamic/b", "b", 100)
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + EPOCH_CHECK_INTERVAL)
+
+    assert tiered_cache.lookup("dynamic/a") == ("new", "l2")
+    assert tiered_cache.lookup("dynamic/b") == ("b", "l1")
+
+
+def test_own_writes_do_not_invalidate_l1(app):
+    tiered_cache.set("dynamic/a", "a", 100)
+    tiered_cache.set("dynamic/b", "b", 100)
+
+    assert tiered_cache.lookup("dynamic/a") == ("a", "l1")
+
+
+def test_l1_disabled(app):
+    tiered_cache.size = 0
+
+    tiered_cache.set("dynamic/a", "value", 100)
+    assert tiered_cache.lookup("dynamic/a") == ("value", "l2")
+    assert tiered_cache.lookup("dynamic/a") == ("value", "l2")
+
+
+def test_stats(app):
+    stats_before = tiered_cache.get_stats()
+
+    tiered_cache.get("dynamic/a")
+    tiered_cache.set("dynamic/a", "value", 100)
+    tiered_cache.get("dynamic/a")
+
+    stats = tiered_cache.get_stats()
+
+    assert stats["l1_hits"] - stats_before["l1_hits"] == 1
+    assert stats["l1_misses"] - stats_before["l1_misses"] == 1
+    assert stats["l2_hits"] - stats_before["l2_hits"] == 0
+    assert stats["l2_misses"] - stats_before["l2_misses"] == 1
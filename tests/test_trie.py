@@ -0,0 +1,148 @@
+import pytest
+
+from redirector.trie import NameTrie, is_pattern_rule, is_prefix_rule, validate_rule
+
+
+def test_is_prefix_rule():
+    assert is_prefix_rule("gh/*")
+    assert not is_prefix_rule("gh")
+    assert not is_prefix_rule("gh*")
+
+
+def test_empty_trie():
+    with pytest.raises(KeyError):
+        NameTrie().lookup("gh/repo")
+
+
+def test_from_map():
+    trie = NameTrie.from_map({
+        "https://github.com/": ["gh/*", "github"],
+        "https://gitlab.com/": ["gl/*"],
+        "https://example.com/a/": ["a/b/c/*"],
+    })
+
+    assert trie.rules_count == 3
+
+    assert trie.lookup("gh/test") == "https://github.com/test"
+    assert trie.lookup("gl/test/test") == "https://gitlab.com/test/test"
+    assert trie.lookup("a/b/c/d") == "https://example.com/a/d"
+
+    for name in ["github/test", "gh", "a/b/test", "a/b/c"]:
+        with pytest.raises(KeyError):
+            trie.lookup(name)
+
+
+def test_longest_match_with_backtracking():
+    trie = NameTrie()
+    trie.add("a/*", "https://a.test/")
+    trie.add("a/b/c/*", "https://c.test/")
+
+    # a/b exists as a path in the trie, but has no rule, so the shorter rule has to be used
+    assert trie.lookup("a/b/d") == "https://a.test/b/d"
+    assert trie.lookup("a/b/c/d") == "https://c.test/d"
+
+
+def test_is_pattern_rule():
+    assert is_pattern_rule("release/<version>")
+    assert not is_pattern_rule("release/latest")
+
+
+def test_pattern_rules():
+    trie = NameTrie.from_map({
+        "https://example.org/dl/<version>/app.AppImage": ["release/<version>"],
+        "https://example.org/dl/latest/app.AppImage": ["release/<version>/latest"],
+        "https://example.org/<project>/blob/<branch>/README.md": ["readme/<project>/<branch>"],
+        "https://example.org/master/README.md": ["readme/<project>/master"],
+    })
+
+    assert trie.pattern_rules_count == 4
+
+    assert trie.lookup("release/1.0") == "https://example.org/dl/1.0/app.AppImage"
+    assert trie.lookup("release/1.0/latest") == "https://example.org/dl/latest/app.AppImage"
+
+    # placeholders may be used in any order, or not at all
+    assert trie.lookup("readme/test/dev") == "https://example.org/test/blob/dev/README.md"
+    assert trie.lookup("readme/test/master") == "https://example.org/master/README.md"
+
+    for name in ["release", "release/", "release/1.0/other", "readme/test", "other/1.0"]:
+        with pytest.raises(KeyError):
+            trie.lookup(name)
+
+
+def test_literal_segments_take_precedence():
+    trie = NameTrie()
+    trie.add("a/<x>", "https://1.test/<x>")
+    trie.add("a/b", "https://2.test/")
+    trie.add("<x>/b/c", "https://3.test/<x>")
+    trie.add("a/b/c", "https://4.test/")
+    trie.add("a/<x>/d", "https://5.test/<x>")
+
+    assert trie.lookup("a/x") == "https://1.test/x"
+    assert trie.lookup("a/b") == "https://2.test/"
+    assert trie.lookup("x/b/c") == "https://3.test/x"
+    assert trie.lookup("a/b/c") == "https://4.test/"
+
+    # a/b leads to a dead end, so the lookup has to go back and use the placeholder
+    assert trie.lookup("a/b/d") == "https://5.test/b"
+
+
+def test_pattern_rules_take_precedence_over_prefix_rules():
+    trie = NameTrie()
+    trie.add("gh/*", "https://github.com/")
+    trie.add("gh/<repo>", "https://github.com/org/<repo>")
+
+    assert trie.lookup("gh/repo") == "https://github.com/org/repo"
+    assert trie.lookup("gh/repo/issues") == "https://github.com/repo/issues"
+
+
+@pytest.mark.parametrize("names", [
+    # equally specific
+    ["a/<x>", "a/<y>"],
+    ["<x>/<y>", "<y>/<x>"],
+    # each rule is more specific than the other one somewhere
+    ["a/<x>", "<y>/b"],
+    ["a/<x>/<y>", "<x>/<y>/c"],
+])
+def test_ambiguous_pattern_rules(names):
+    trie = NameTrie()
+    trie.add(names[0], "https://1.test/")
+
+    with pytest.raises(ValueError, match="ambiguous"):
+        trie.add(names[1], "https://2.test/")
+
+
+def test_unambiguous_pattern_rules():
+    trie = NameTrie()
+
+    # different numbers of segments never match the same name
+    for name in ["<x>", "<x>/<y>", "a/<x>", "a/b", "a/<x>/c", "<x>/b/d"]:
+        trie.add(name, "https://test/")
+
+    assert trie.pattern_rules_count == 6
+
+
+@pytest.mark.parametrize("name,url", [
+    ("release/v<version>", "https://test/"),
+    ("release/<version", "https://test/"),
+    ("release/<1>", "https://test/"),
+    ("release/<version>/<version>", "https://test/<version>"),
+    ("release/<version>/*", "https://test/"),
+    ("release/<version>", "https://test/<other>"),
+    ("release", "https://test/<version>"),
+    ("gh/*", "https://github.com"),
+    ("gh/*", "https://github.com/org"),
+])
+def test_invalid_rules(name, url):
+    with pytest.raises(ValueError):
+        validate_rule(name, url)
+
+
+def test_match_returns_rule():
+    trie = NameTrie()
+    trie.add("a/*", "https://a.test/")
+    trie.add("a/b/c/*", "https://c.test/")
+    trie.add("a/<x>/d", "https://d.test/<x>")
+
+    assert trie.match("a/b/e") == ("a/*", "https://a.test/b/e")
+    assert trie.match("a/b/c/e") == ("a/b/c/*", "https://c.test/e")
+    assert trie.match("a/b/d") == ("a/<x>/d", "https://d.test/b")
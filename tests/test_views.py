@@ -1,8 +1,14 @@
 from typing import Union, Dict
 
+import json
+
 from lxml import html
 import pytest
 
+import redirector
+
+from .view_fixtures import make_client
+
 
 def extract_static_redirections_from_index_response(data: Union[bytes, str]) -> Dict[str, Dict[str, str]]:
     root = html.fromstring(data)
@@ -84,3 +90,137 @@ def test_shortener_name_exceptions(test_data_client, name):
     response = test_data_client.get("/{}".format(name))
 
     assert response.status_code == 404
+
+
+@pytest.fixture
+def paginated_client(tmpdir):
+    test_data = {"https://test{}.test".format(i): ["test{}".format(i)] for i in range(25)}
+
+    app, test_client = make_client(tmpdir, test_data, config={"INDEX_PAGE_SIZE": 10})
+    return test_client
+
+
+def test_index_pagination(paginated_client):
+    urls = []
+
+    for page in (1, 2, 3):
+        response = paginated_client.get("/?page={}".format(page))
+        assert response.status_code == 200
+
+        static_redirs = extract_static_redirections_from_index_response(response.data)
+        urls += list(static_redirs)
+
+    assert urls == ["https://test{}.test".format(i) for i in range(25)]
+
+    # pages beyond the last one are empty
+    response = paginated_client.get("/?page=4")
+    assert extract_static_redirections_from_index_response(response.data) == {}
+
+
+@pytest.mark.parametrize("page", ["abc", "-1", "0"])
+def test_index_invalid_page(paginated_client, page):
+    response = paginated_client.get("/?page={}".format(page))
+
+    assert response.status_code == 200
+    assert len(extract_static_redirections_from_index_response(response.data)) == 10
+
+
+def test_index_search(paginated_client):
+    response = paginated_client.get("/?q=TEST2")
+
+    assert response.status_code == 200
+
+    static_redirs = extract_static_redirections_from_index_response(response.data)
+    assert list(static_redirs) == ["https://test2.test"] + ["https://test{}.test".format(i) for i in range(20, 25)]
+    assert static_redirs["https://test21.test"] == {"test21": "/test21"}
+
+
+def test_index_is_cached(paginated_client):
+    first_response = paginated_client.get("/?q=test1")
+
+    # the cached page must be returned, no matter what the map contains
+    non_db = redirector.non_db_ext.non_db
+    non_db.derived.clear()
+    non_db.urls_to_names = {}
+
+    assert paginated_client.get("/?q=test1").data == first_response.data
+
+
+def test_index_cache_invalidated_on_reload(tmpdir):
+    app, test_client = make_client(tmpdir, {"https://test.test": ["test1"]})
+
+    assert list(extract_static_redirections_from_index_response(test_client.get("/").data)) == ["https://test.test"]
+
+    with open(app.config["REDIRECTIONS_MAP_PATH"], "w") as f:
+        json.dump({"https://other.test": ["other"]}, f)
+
+    assert redirector.non_db_ext.reload()
+
+    assert list(extract_static_redirections_from_index_response(test_client.get("/").data)) == ["https://other.test"]
+
+
+def test_shortener_hierarchical_names_and_prefix_rules(tmpdir):
+    _, test_client = make_client(tmpdir, {
+        "https://docs.test/install": ["docs/install"],
+        "https://github.com/org/": ["gh/*"],
+    })
+
+    response = test_client.get("/docs/install")
+    assert response.status_code == 301
+    assert response.headers["location"] == "https://docs.test/install"
+
+    response = test_client.get("/gh/repo/issues")
+    assert response.status_code == 301
+    assert response.headers["location"] == "https://github.com/org/repo/issues"
+
+    assert test_client.get("/docs").status_code == 404
+    assert test_client.get("/docs/install/more").status_code == 404
+
+    # the rest of the path cannot leave the path of the URL
+    response = test_client.get("/gh/@evil.com%3Fa%23b")
+    assert response.status_code == 301
+    assert response.headers["location"] == "https://github.com/org/%40evil.com%3Fa%23b"
+
+    assert test_client.get("/gh/a%2F..%2F..%2Fother").status_code == 404
+
+
+def test_shortener_pattern_rules(tmpdir):
+    _, test_client = make_client(tmpdir, {
+        "https://example.org/dl/<version>/app.AppImage": ["release/<version>"],
+    })
+
+    response = test_client.get("/release/1.0")
+    assert response.status_code == 301
+    assert response.headers["location"] == "https://example.org/dl/1.0/app.AppImage"
+
+    assert test_client.get("/release").status_code == 404
+    assert test_client.get("/release/1.0/more").status_code == 404
+
+    # the values are encoded, so they cannot add a query or fragment, or leave the path
+    response = test_client.get("/release/1.0%3Fx=1%23")
+    assert response.status_code == 301
+    assert response.headers["location"] == "https://example.org/dl/1.0%3Fx%3D1%23/app.AppImage"
+
+    assert test_client.get("/release/..").status_code == 404
+
+
+def test_shortener_not_found_suggestions(tmpdir):
+    _, test_client = make_client(tmpdir, {
+        "https://github.com/AppImage/appimagetool": ["appimagetool"],
+        "https://github.com/linuxdeploy/linuxdeploy": ["linuxdeploy"],
+    })
+
+    response = test_client.get("/appimagetoll")
+    assert response.status_code == 404
+    assert b'href="/appimagetool"' in response.data
+    assert b"linuxdeploy" not in response.data
+
+
+def test_shortener_not_found_suggestions_disabled(tmpdir):
+    _, test_client = make_client(tmpdir, {
+        "https://github.com/AppImage/appimagetool": ["appimagetool"],
+    }, {"SUGGESTIONS_LIMIT": "0"})
+
+    response = test_client.get("/appimagetoll")
+    assert response.status_code == 404
+    assert b"appimagetool" not in response.data